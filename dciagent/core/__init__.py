@@ -16,11 +16,46 @@
 # under the License.
 """
 Main module for global values.
+
+The package version is resolved lazily: looking up distribution metadata scans
+site-packages, which is too expensive to pay on every agent start when it is
+only needed for `--version`.
 """
 
-try:
-    import importlib.metadata as metadata
-except ModuleNotFoundError:
-    import importlib_metadata as metadata
+import sys
+
+_version = None
+
+
+def version():
+    """
+    Return the installed package version, resolving it on first use.
+    """
+
+    global _version
+
+    if _version is None:
+        try:
+            import importlib.metadata as metadata
+        except ModuleNotFoundError:
+            import importlib_metadata as metadata
+
+        _version = metadata.version("python-dciagent")
+
+    return _version
+
+
+if sys.version_info >= (3, 7):
+
+    def __getattr__(name):
+        """
+        Resolve `__version__` on access (PEP 562).
+        """
+
+        if name == "__version__":
+            return version()
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
 
-__version__ = metadata.version("python-dciagent")
+else:
+    # no module level __getattr__ before python 3.7
+    __version__ = version()
@@ -0,0 +1,109 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Abort policies of a run.
+
+A doomed run should free its lab as soon as possible rather than go on for
+hours. The watchdog aborts the run on a wall-clock timeout, when the output
+stays idle for too long or as soon as a line of output matches a failure
+pattern. Agents can abort on their own conditions too, e.g. the ansible agents
+on the first unreachable host.
+
+Aborting terminates the process group of every pipeline of the run, see
+`dciagent.core.stream.Pipeline.terminate_async()`.
+"""
+
+import asyncio
+import re
+import time
+
+import dciagent.core.printer as printer
+import dciagent.core.stream as stream
+
+
+class Watchdog(stream.Consumer):
+    """
+    Abort the run of `pipelines` when one of the policies triggers.
+
+    A `timeout` or `idle_timeout` of 0 disables it. The reason of the abort, if
+    any, is available in `self.reason`.
+    """
+
+    def __init__(self, pipelines, timeout=0, idle_timeout=0, patterns=()):
+        self.pipelines = pipelines
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.patterns = [re.compile(p) for p in patterns]
+        self.started = self.last_output = time.time()
+        self.reason = None
+        self.terminations = []
+
+    def __call__(self, line):
+        """
+        Note the output activity and look for the failure patterns.
+        """
+
+        if line.stream == "progress":
+            return  # synthetic, see dciagent.core.progress
+        self.last_output = line.time
+        if self.reason is None:
+            for pattern in self.patterns:
+                if pattern.search(line.text):
+                    self.abort(
+                        "output matched {!r}: {}".format(pattern.pattern, line.text)
+                    )
+                    break
+
+    def abort(self, reason):
+        """
+        Terminate all the pipelines of the run, only the first reason is kept.
+        """
+
+        if self.reason is not None:
+            return
+        self.reason = reason
+        printer.header("Aborting the run, {}".format(reason))
+        for pipeline in self.pipelines:
+            self.terminations.append(asyncio.ensure_future(pipeline.terminate_async()))
+
+    def check(self, now):
+        """
+        Return why the run should be aborted at `now` for a timeout, or `None`.
+        """
+
+        if self.timeout > 0 and now - self.started >= self.timeout:
+            return "timed out after {}s".format(self.timeout)
+        if self.idle_timeout > 0 and now - self.last_output >= self.idle_timeout:
+            return "no output for {}s".format(self.idle_timeout)
+
+        return None
+
+    async def run(self, interval=1):
+        """
+        Check the timeouts every `interval` seconds until cancelled.
+        """
+
+        while self.reason is None:
+            await asyncio.sleep(interval)
+            reason = self.check(time.time())
+            if reason is not None:
+                self.abort(reason)
+
+    async def wait_async(self):
+        """
+        Wait for the pipelines being terminated, if aborted.
+        """
+
+        if self.terminations:
+            await asyncio.gather(*self.terminations)
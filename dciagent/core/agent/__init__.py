@@ -15,12 +15,28 @@
 Module for the base classes used by the agents.
 """
 
-import distutils.util as distutil
 import os
 
 import dciagent.core.error as error
 
 
+def strtobool(val):
+    """
+    Convert a string representation of truth to 1 or 0.
+
+    Same semantics as the `distutils.util.strtobool` it replaces: distutils is
+    slow to import (it drags setuptools along) and is gone in python 3.12.
+    """
+
+    val = val.lower()
+    if val in ("y", "yes", "t", "true", "on", "1"):
+        return 1
+    elif val in ("n", "no", "f", "false", "off", "0"):
+        return 0
+    else:
+        raise ValueError("invalid truth value {!r}".format(val))
+
+
 class Argument:
     """
     An abstraction to define arguments at the class level.
@@ -92,7 +108,10 @@ class Argument:
                 "store_true",
                 "store_false",
             ):
-                default = distutil.strtobool(os.getenv(self.env, "false"))
+                default = strtobool(os.getenv(self.env, "false"))
+            elif self.action == "append" and os.getenv(self.env):
+                # one value per line, the command line ones are appended
+                default = [v for v in os.getenv(self.env).splitlines() if v]
             else:
                 default = os.getenv(self.env, self.default)
         else:
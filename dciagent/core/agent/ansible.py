@@ -15,12 +15,31 @@
 Module for the base ansible agent.
 """
 
+import asyncio
+import contextlib
+import functools
+import json
 import os.path
 import shlex
+import shutil
+import subprocess
+import tempfile
+import time
 
 import dciagent.core.agent as agent
 import dciagent.core.agent.base as base
+import dciagent.core.context as ctx
 import dciagent.core.error as error
+import dciagent.core.events as events
+import dciagent.core.facts as facts
+import dciagent.core.inputs as inputs
+import dciagent.core.inventory as inventory
+import dciagent.core.printer as printer
+import dciagent.core.progress as progress
+import dciagent.core.shard as shard
+import dciagent.core.sshpool as sshpool
+import dciagent.core.stream as stream
+import dciagent.core.tuning as tuning
 
 
 class Agent(base.Agent):
@@ -78,6 +97,113 @@ class Agent(base.Agent):
         long="--ansible-inventory",
         env="ANSIBLE_INVENTORY",
     )
+    shards = agent.Argument(
+        "split the inventory hosts between N parallel ansible-playbook runs",
+        long="--shards",
+        type=int,
+        default=1,
+        env="ANSIBLE_SHARDS",
+    )
+    shard_by = agent.Argument(
+        "how to split the hosts between shards: host (round-robin) or group",
+        long="--shard-by",
+        default="host",
+        env="ANSIBLE_SHARD_BY",
+    )
+    retry_failed = agent.Argument(
+        "re-run the playbook up to N times on the hosts that failed",
+        long="--retry-failed",
+        type=int,
+        default=0,
+        env="ANSIBLE_RETRY_FAILED",
+    )
+    inventory_cache_ttl = agent.Argument(
+        "reuse the resolved inventory for N seconds, 0 to always use it as is",
+        long="--inventory-cache-ttl",
+        type=int,
+        default=0,
+        env="ANSIBLE_INVENTORY_CACHE_TTL",
+    )
+    refresh_inventory = agent.Argument(
+        "resolve the inventory again, even if the cached one did not expire",
+        long="--refresh-inventory",
+        action="store_true",
+        default=False,
+        env="ANSIBLE_REFRESH_INVENTORY",
+    )
+    fact_cache = agent.Argument(
+        "keep the gathered facts in a fact cache persisted between runs",
+        long="--fact-cache",
+        action="store_true",
+        default=False,
+        env="ANSIBLE_FACT_CACHE",
+    )
+    fact_cache_timeout = agent.Argument(
+        "gather the cached facts again after N seconds, 0 to never expire",
+        long="--fact-cache-timeout",
+        type=int,
+        default=86400,
+        env="ANSIBLE_FACT_CACHE_TIMEOUT",
+    )
+    fact_cache_size = agent.Argument(
+        "evict the oldest cached facts beyond N MiB, 0 for no limit",
+        long="--fact-cache-size",
+        type=int,
+        default=256,
+        env="ANSIBLE_FACT_CACHE_SIZE",
+    )
+    ssh_pool = agent.Argument(
+        "keep SSH connections open between runs with the same prefix and "
+        "credentials",
+        long="--ssh-pool",
+        action="store_true",
+        default=False,
+        env="ANSIBLE_SSH_POOL",
+    )
+    ssh_pool_idle = agent.Argument(
+        "close the pooled SSH connections after N idle seconds",
+        long="--ssh-pool-idle",
+        type=int,
+        default=600,
+        env="ANSIBLE_SSH_POOL_IDLE",
+    )
+    perf_profile = agent.Argument(
+        "tune forks, pipelining, SSH and strategy to the inventory and host "
+        "resources, unless configured",
+        long="--perf-profile",
+        action="store_true",
+        default=False,
+        env="ANSIBLE_PERF_PROFILE",
+    )
+    progress_interval = agent.Argument(
+        "report the playbook progress from the ansible log every N seconds",
+        long="--progress-interval",
+        type=int,
+        default=0,
+        env="ANSIBLE_PROGRESS_INTERVAL",
+    )
+    skip_unchanged = agent.Argument(
+        "skip the run if its inputs did not change since the last success, "
+        "less than N seconds ago, 0 to always run",
+        long="--skip-unchanged",
+        type=int,
+        default=0,
+        env="ANSIBLE_SKIP_UNCHANGED",
+    )
+    abort_on_unreachable = agent.Argument(
+        "abort the playbook as soon as a host is unreachable",
+        long="--abort-on-unreachable",
+        action="store_true",
+        default=False,
+        env="ANSIBLE_ABORT_ON_UNREACHABLE",
+    )
+    no_events = agent.Argument(
+        "do not stream the playbook events from the bundled callback plugin",
+        long="--no-events",
+        action="store_true",
+        default=False,
+        env="ANSIBLE_NO_EVENTS",
+    )
     playbook = agent.Argument(
         "path to the ansible playbook(s) to execute",
         nargs="?",
@@ -110,7 +236,145 @@ class Agent(base.Agent):
         cfg = self.ansible_config
 
         if cfg is not None:
-            self.environment = {"ANSIBLE_CONFIG": cfg}
+            self.environment["ANSIBLE_CONFIG"] = cfg
+
+        if self.fact_cache:
+            path = facts.directory(self._namespace())
+            if not self.dry_run:
+                os.makedirs(path, exist_ok=True)
+                facts.evict(
+                    path, self.fact_cache_timeout, self.fact_cache_size * 1024 * 1024
+                )
+            args = shlex.split(self.ansible_args) if self.ansible_args else []
+            configured = tuning.explicit(cfg, ctx.environ(self.environment), args)
+            self.environment.update(
+                facts.environment(path, self.fact_cache_timeout, configured)
+            )
+
+        if not self.no_events:
+            self.environment.update(
+                events.environment(self.ansible_config, ctx.environ(self.environment))
+            )
+
+        if self.ssh_pool:
+            self._use_ssh_pool()
+
+        if self.perf_profile:
+            self._tune()
+
+    def _use_ssh_pool(self):
+        """
+        Point ansible to the ControlMaster sockets of the agent's pool.
+
+        The SSH arguments are only set when not configured, ansible needs
+        `ControlPersist` in them to use the sockets directory.
+        """
+
+        pool = sshpool.key(*self._ssh_identity())
+        if not self.dry_run:
+            sshpool.evict(keep=pool)
+        self.environment["ANSIBLE_SSH_CONTROL_PATH_DIR"] = sshpool.directory(
+            pool, create=not self.dry_run
+        )
+
+        args = shlex.split(self.ansible_args) if self.ansible_args else []
+        configured = tuning.explicit(
+            self.ansible_config, ctx.environ(self.environment), args
+        )
+        if "ANSIBLE_SSH_ARGS" not in configured:
+            self.environment["ANSIBLE_SSH_ARGS"] = sshpool.ssh_args(self.ssh_pool_idle)
+
+    async def _pre_async(self):
+        await super()._pre_async()
+        # subscribe to follow the run, see `dciagent.core.events`
+        self.events = events.Stream()
+        if self.abort_on_unreachable:
+            self.events.subscribe(self._abort_on_unreachable)
+
+        # resolving the inventory can run scripts or call cloud APIs
+        if self.perf_profile and not self.dry_run:
+            with self.timings.span("count_hosts"):
+                self.inventory_hosts = await self._count_hosts_async()
+
+    def _abort_on_unreachable(self, event):
+        """
+        Abort the run on the first unreachable host.
+        """
+
+        if event.get("event") == "result" and event.get("status") == "unreachable":
+            self.watchdog.abort(
+                "host {} unreachable in task {}".format(
+                    event.get("host"), event.get("task")
+                )
+            )
+
+    async def _count_hosts_async(self):
+        """
+        Return the number of hosts targeted by the playbook, `None` if unknown.
+        """
+
+        env = dict(self.environment)
+        if self.ansible_config is not None:
+            env["ANSIBLE_CONFIG"] = self.ansible_config
+        try:
+            data = await self._resolve_inventory_async(ctx.environ(env))
+        except (OSError, RuntimeError, ValueError):
+            return None
+
+        return len(shard.groups(data).get("all", []))
+
+    def _tune(self):
+        """
+        Apply the performance profile to the environment and print it.
+
+        Settings explicitly configured by the user are kept.
+        """
+
+        cpus, memory = tuning.resources()
+        hosts = self.inventory_hosts if "inventory_hosts" in dir(self) else None
+        args = shlex.split(self.ansible_args) if self.ansible_args else []
+        kept = tuning.explicit(self.ansible_config, ctx.environ(self.environment), args)
+
+        title = "Performance profile for {} hosts, {} CPUs, {:.1f} GiB available:"
+        with printer.section(
+            title.format(
+                "unknown" if hosts is None else hosts, cpus, memory / 1024**3
+            )
+        ):
+            for k, v in tuning.profile(hosts, cpus, memory).items():
+                if k in kept:
+                    print("{}: kept as configured".format(k))
+                else:
+                    self.environment[k] = v
+                    print("{}={}".format(k, v))
+
+    def _namespace(self):
+        """
+        Return the namespace of the fact cache and SSH pool.
+
+        Override to isolate agents from each other.
+        """
+
+        return ""
+
+    def _ssh_identity(self):
+        """
+        Return what the SSH connections of the agent depend on.
+
+        Agents share pooled SSH connections only if their identities match,
+        extend to add e.g. credentials.
+        """
+
+        return [
+            os.getuid(),
+            self._namespace(),
+            os.path.realpath(self.ansible_config) if self.ansible_config else None,
+            os.path.realpath(self.ansible_inventory)
+            if self.ansible_inventory
+            else None,
+            os.getenv("ANSIBLE_PRIVATE_KEY_FILE"),
+            os.getenv("ANSIBLE_REMOTE_USER"),
+        ]
 
     def _validate(self):
         super()._validate()
@@ -133,6 +397,33 @@ class Agent(base.Agent):
                 )
             )
 
+        if self.shards < 1:
+            raise (error.ValidationError("The number of shards must be at least 1"))
+        if self.retry_failed < 0:
+            raise (error.ValidationError("The number of retries cannot be negative"))
+        if self.ssh_pool_idle < 1:
+            raise (error.ValidationError("The SSH pool idle time must be positive"))
+        if self.fact_cache_timeout < 0 or self.fact_cache_size < 0:
+            raise (error.ValidationError("Fact cache limits cannot be negative"))
+        if self.inventory_cache_ttl < 0:
+            raise (error.ValidationError("The inventory cache TTL cannot be negative"))
+        if self.progress_interval < 0:
+            raise (error.ValidationError("The progress interval cannot be negative"))
+        if self.skip_unchanged < 0:
+            raise (error.ValidationError("The skip TTL cannot be negative"))
+        if self.abort_on_unreachable and self.no_events:
+            raise (
+                error.ValidationError(
+                    "Aborting on unreachable hosts requires the playbook events"
+                )
+            )
+        if self.shard_by not in ("host", "group"):
+            raise (
+                error.ValidationError(
+                    "Unknown sharding method {}".format(self.shard_by)
+                )
+            )
+
         cfg = self.ansible_config
         if cfg is None:
             raise (
@@ -174,3 +465,366 @@ class Agent(base.Agent):
             self.command_line.append(verbosity)
 
         self.command_line.append(self.playbook)
+
+    async def _inventory_async(self, *args, env=None):
+        """
+        Return the parsed output of `ansible-inventory` run with `args`.
+
+        It runs with the run environment, unless another `env` is given.
+        """
+
+        command = [
+            os.path.join(os.path.dirname(self.executable), "ansible-inventory"),
+            "--inventory",
+            self.ansible_inventory,
+        ]
+        command.extend(args)
+
+        # not an asyncio subprocess: with python < 3.8 the child watcher is
+        # only attached to the loop of the main thread
+        p = await asyncio.get_event_loop().run_in_executor(
+            None,
+            functools.partial(
+                subprocess.run,
+                command,
+                stdout=subprocess.PIPE,
+                env=self.run_environment if env is None else env,
+            ),
+        )
+        data = p.stdout
+        if p.returncode != 0:
+            raise RuntimeError("Cannot resolve the inventory hosts")
+
+        return json.loads(data.decode())
+
+    async def _resolve_inventory_async(self, env=None):
+        """
+        Return the parsed output of `ansible-inventory --list`.
+        """
+
+        args = ["--list"]
+        if self.ansible_limit is not None:
+            args.extend(["--limit", self.ansible_limit])
+
+        return await self._inventory_async(*args, env=env)
+
+    async def _cache_inventory_async(self):
+        """
+        Switch to the cached static version of the inventory.
+
+        The inventory is resolved again when the cached version expired or
+        `--refresh-inventory` is given.
+        """
+
+        # hashing and writing large inventories would stall the loop
+        loop = asyncio.get_event_loop()
+        cached = await loop.run_in_executor(
+            None, inventory.path, self.ansible_inventory
+        )
+        if self.refresh_inventory or not inventory.fresh(
+            cached, self.inventory_cache_ttl
+        ):
+            data = await self._inventory_async("--list", "--export")
+            await loop.run_in_executor(None, inventory.store, cached, data)
+            printer.header("Cached the resolved inventory in {}".format(cached))
+
+        command = []
+        for arg in self.command_line:
+            if command and command[-1] == "--inventory":
+                arg = cached
+            command.append(arg)
+        self.command_line = command
+        self.ansible_inventory = cached
+
+    def _limit_command(self, command, limit_file):
+        """
+        Return `command` restricted to the hosts listed in `limit_file`.
+
+        Any previous `--limit` is dropped: the hosts in the file were already
+        resolved with it.
+        """
+
+        limited = []
+        args = iter(command[:-1])
+        for arg in args:
+            if arg == "--limit":
+                next(args)
+            else:
+                limited.append(arg)
+
+        return limited + ["--limit", "@{}".format(limit_file), command[-1]]
+
+    async def _run_playbook_async(self, command, env, consumer, run_dir):
+        """
+        Run a playbook command, then retry its failed hosts if requested.
+
+        The retry files are written in `run_dir` and `consumer` is not closed.
+        """
+
+        os.makedirs(run_dir, exist_ok=True)
+        if self.retry_failed > 0:
+            env = ctx.environ(
+                {
+                    "ANSIBLE_RETRY_FILES_ENABLED": "True",
+                    "ANSIBLE_RETRY_FILES_SAVE_PATH": run_dir,
+                },
+                base=env,
+            )
+
+        rc = await self._pipeline([consumer]).run_async(command, env=env)
+        if self.retry_failed <= 0 or not self.playbook:
+            return rc
+
+        stem = os.path.splitext(os.path.basename(self.playbook))[0]
+        retry_file = os.path.join(run_dir, "{}.retry".format(stem))
+        for attempt in range(1, self.retry_failed + 1):
+            # no retry file means the failure is not host related
+            if rc == 0 or not os.path.isfile(retry_file):
+                break
+            if self.watchdog.reason is not None:
+                break
+            limit_file = os.path.join(run_dir, "retry{}.limit".format(attempt))
+            os.replace(retry_file, limit_file)
+            with open(limit_file) as f:
+                hosts = f.read().split()
+            printer.header(
+                "Retrying {} failed host(s), attempt {}/{}: {}".format(
+                    len(hosts), attempt, self.retry_failed, ", ".join(hosts)
+                )
+            )
+            rc = await self._pipeline([consumer]).run_async(
+                self._limit_command(command, limit_file), env=env
+            )
+
+        return rc
+
+    async def _run_shards_async(self, shards, consumers, workdir):
+        """
+        Run one playbook process per shard and merge their results.
+        """
+
+        log_path = self.run_environment.get("ANSIBLE_LOG_PATH")
+        junit_dir = self.run_environment.get("JUNIT_OUTPUT_DIR")
+        tags = ["shard{}".format(i) for i in range(len(shards))]
+        try:
+            runs = []
+            for tag, hosts in zip(tags, shards):
+                limit_file = os.path.join(workdir, "{}.limit".format(tag))
+                with open(limit_file, "w") as f:
+                    f.write("\n".join(hosts) + "\n")
+
+                # every shard gets its own log and JUnit directory, merged
+                # back once they are all done
+                env = {"DCIAGENT_EVENTS_TAG": tag}
+                if log_path:
+                    env["ANSIBLE_LOG_PATH"] = "{}.{}".format(log_path, tag)
+                if junit_dir:
+                    env["JUNIT_OUTPUT_DIR"] = os.path.join(junit_dir, tag)
+                    os.makedirs(env["JUNIT_OUTPUT_DIR"], exist_ok=True)
+
+                runs.append(
+                    self._run_playbook_async(
+                        self._limit_command(self.command_line, limit_file),
+                        ctx.environ(env, base=self.run_environment),
+                        stream.Tagged(consumers, tag),
+                        os.path.join(workdir, tag),
+                    )
+                )
+
+            self.shard_results = await asyncio.gather(*runs)
+        finally:
+            if log_path:
+                shard.merge_logs(["{}.{}".format(log_path, t) for t in tags], log_path)
+            if junit_dir:
+                shard.merge_junit(
+                    [os.path.join(junit_dir, t) for t in tags],
+                    junit_dir,
+                    "{}-shards.xml".format(
+                        os.path.splitext(os.path.basename(self.playbook))[0]
+                    ),
+                )
+
+        # report the worst shard, a signal (negative rc) being a failure too
+        return max(self.shard_results, key=abs)
+
+    def _watch(self, consumers, tags):
+        """
+        Return a progress watcher on the ansible log(s), if requested.
+
+        Every shard tag gets its own log, see `_run_shards_async()`.
+        """
+
+        log_path = self.run_environment.get("ANSIBLE_LOG_PATH")
+        if self.progress_interval <= 0 or not log_path:
+            return None
+
+        sources = {None: log_path}
+        if tags:
+            sources = {t: "{}.{}".format(log_path, t) for t in tags}
+
+        return progress.Watcher(
+            sources,
+            consumers,
+            self.progress_interval,
+            progress.load_history(self.playbook),
+        )
+
+    async def _listen_events_async(self, path):
+        """
+        Receive the events of the callback plugin on the socket `path`.
+
+        Without the socket, e.g. with a path too long, the run goes on without
+        events.
+        """
+
+        try:
+            await self.events.listen(path)
+        except OSError as e:
+            printer.header("Cannot receive the playbook events: {}".format(e))
+            return
+        self.run_environment = ctx.environ(
+            {"DCIAGENT_EVENTS": path}, base=self.run_environment
+        )
+
+    def _input_paths(self):
+        """
+        Return the files and directories the run depends on.
+
+        The directory of the playbook is walked, along with the inventory,
+        the configuration, the roles path and the extra variables files.
+        Extend to add e.g. other configuration files.
+        """
+
+        paths = [
+            os.path.dirname(os.path.abspath(self.playbook)),
+            self.ansible_inventory,
+            self.ansible_config,
+        ]
+        directory = os.path.dirname(os.path.abspath(self.ansible_inventory))
+        paths.extend(os.path.join(directory, d) for d in ("group_vars", "host_vars"))
+        for extra_var in self.ansible_extra_vars or []:
+            if extra_var.startswith("@"):
+                paths.append(extra_var[1:])
+
+        roles_path = os.getenv("ANSIBLE_ROLES_PATH")
+        if roles_path is None:
+            roles_path = tuning.read_config(self.ansible_config).get(
+                "defaults", "roles_path", fallback=""
+            )
+        paths.extend(os.path.expanduser(p) for p in roles_path.split(":") if p)
+
+        return [p for p in paths if p]
+
+    def _input_description(self):
+        """
+        Return what the run depends on besides its input files.
+
+        Extend to drop the values changing with every run.
+        """
+
+        return {
+            "agent": self.ap.prog,
+            "command_line": self.command_line,
+            "environment": dict(self.environment),
+            "ansible": {
+                k: v for k, v in os.environ.items() if k.startswith("ANSIBLE_")
+            },
+        }
+
+    def _input_digest(self, state):
+        """
+        Return the digest of the inputs, caching the file hashes in `state`.
+        """
+
+        cache = inputs.HashCache(os.path.join(state, "hashes.json"))
+        digest = inputs.digest(self._input_paths(), self._input_description(), cache)
+        cache.save()
+        return digest
+
+    async def _execute_async(self, consumers):
+        if self.skip_unchanged <= 0:
+            return await self._execute_playbook_async(consumers)
+
+        state = inputs.state_path(
+            self.ap.prog, self._namespace(), os.path.realpath(self.playbook)
+        )
+        with self.timings.span("inputs"):
+            digest = await asyncio.get_event_loop().run_in_executor(
+                None, self._input_digest, state
+            )
+
+        last = inputs.unchanged(state, digest, self.skip_unchanged)
+        if last is not None:
+            for consumer in consumers:
+                consumer.close()
+            printer.header(
+                "Inputs unchanged since the successful run of {} ({:.0f}s), "
+                "skipping the run".format(
+                    time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(last["time"])),
+                    last["duration"],
+                )
+            )
+            return 0
+
+        start = time.monotonic()
+        rc = await self._execute_playbook_async(consumers)
+        if rc == 0:
+            inputs.record_success(state, digest, time.monotonic() - start)
+
+        return rc
+
+    async def _execute_playbook_async(self, consumers):
+        """
+        Run the playbook, possibly sharded and retried, and return its rc.
+        """
+
+        if self.inventory_cache_ttl > 0:
+            with self.timings.span("inventory"):
+                await self._cache_inventory_async()
+
+        watcher = None
+        if self.progress_interval <= 0 and self.no_events:
+            if self.shards <= 1 and self.retry_failed <= 0:
+                return await super()._execute_async(consumers)
+
+        workdir = tempfile.mkdtemp(prefix="dci-ansible-")
+        try:
+            if not self.no_events:
+                await self._listen_events_async(os.path.join(workdir, "events.sock"))
+
+            shards = []
+            if self.shards > 1:
+                shards = shard.partition(
+                    await self._resolve_inventory_async(), self.shards, self.shard_by
+                )
+            if len(shards) < 2:
+                shards = []
+
+            watcher = self._watch(
+                consumers, ["shard{}".format(i) for i in range(len(shards))]
+            )
+            if watcher is not None:
+                task = asyncio.ensure_future(watcher.run())
+
+            if shards:
+                return await self._run_shards_async(shards, consumers, workdir)
+
+            return await self._run_playbook_async(
+                self.command_line,
+                self.run_environment,
+                stream.Shared(consumers),
+                os.path.join(workdir, "run"),
+            )
+        finally:
+            await self.events.close()
+            if watcher is not None:
+                task.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await task
+                # the logs were fully written, report and record the tasks
+                tasks = watcher.close()
+                if tasks:
+                    progress.save_history(self.playbook, tasks)
+            for consumer in consumers:
+                consumer.close()
+            shutil.rmtree(workdir, ignore_errors=True)
@@ -15,13 +15,23 @@
 Module for the base agent.
 """
 import argparse
+import asyncio
+import contextlib
+import itertools
+import os
+import re
 import shutil
-import subprocess
 
+import dciagent.core.abort as abort
 import dciagent.core.agent as agent
 import dciagent.core.context as ctx
 import dciagent.core.error as error
 import dciagent.core.printer as printer
+import dciagent.core.rusage as rusage
+import dciagent.core.stream as stream
+import dciagent.core.timing as timing
+
+_cgroups = itertools.count()
 
 
 class Agent(object):
@@ -36,6 +46,7 @@ class Agent(object):
     environment = {}
     command_line = []
     ap = None
+    tail_lines = 50
     verbosity = agent.Argument(
         "increase the verbosity",
         short="-v",
@@ -51,6 +62,51 @@ class Agent(object):
         default=False,
         env="DRY_RUN",
     )
+    timings_file = agent.Argument(
+        "write the duration of each run phase as JSON to this file",
+        long="--timings-file",
+        env="TIMINGS_FILE",
+    )
+    prometheus_textfile = agent.Argument(
+        "write the duration of each run phase to this node exporter textfile",
+        long="--prometheus-textfile",
+        env="PROMETHEUS_TEXTFILE",
+    )
+    cgroup_accounting = agent.Argument(
+        "account the whole child process tree in a cgroup v2, when delegated",
+        long="--cgroup-accounting",
+        action="store_true",
+        default=False,
+        env="CGROUP_ACCOUNTING",
+    )
+    timeout = agent.Argument(
+        "abort the command after N seconds, 0 for no limit",
+        long="--timeout",
+        type=int,
+        default=0,
+        env="TIMEOUT",
+    )
+    idle_timeout = agent.Argument(
+        "abort the command after N seconds without output, 0 for no limit",
+        long="--idle-timeout",
+        type=int,
+        default=0,
+        env="IDLE_TIMEOUT",
+    )
+    abort_pattern = agent.Argument(
+        "abort the command as soon as a line of output matches this regex, one "
+        "per line in the environment variable",
+        long="--abort-pattern",
+        action="append",
+        env="ABORT_PATTERN",
+    )
+    kill_grace = agent.Argument(
+        "when aborting, kill the processes left N seconds after SIGTERM",
+        long="--kill-grace",
+        type=int,
+        default=10,
+        env="KILL_GRACE",
+    )
     no_validation = agent.Argument(
         "UNSAFE: skip various validations e.g. full path, file checks, etc",
         long="--no-validation",
@@ -60,6 +116,11 @@ class Agent(object):
     )
 
     def __init__(self, prog, desc, version, parents=[], *args, **kwargs):
+        # never mutate the class-level defaults, they are shared between runs
+        self.environment = dict(self.environment)
+        # consumers fed on top of `_consumers()`, e.g. by the daemon
+        self.extra_consumers = []
+        self.echo = True
         self.ap = argparse.ArgumentParser(
             prog=prog,
             description=desc,
@@ -144,6 +205,8 @@ class Agent(object):
     def _build_env(self):
         """
         Override in child classes to construct your execution environment.
+
+        It runs in the default executor, it may block on I/O.
         """
 
         pass
@@ -169,6 +232,17 @@ class Agent(object):
 
         if self.executable is None:
             raise (error.ValidationError("The defined executable does not exist"))
+        if self.timeout < 0 or self.idle_timeout < 0 or self.kill_grace < 0:
+            raise (error.ValidationError("Timeouts cannot be negative"))
+        for pattern in self.abort_pattern or []:
+            try:
+                re.compile(pattern)
+            except re.error as e:
+                raise (
+                    error.ValidationError(
+                        "Invalid abort pattern {}: {}".format(pattern, e)
+                    )
+                )
 
     def _pre(self):
         """
@@ -184,23 +258,139 @@ class Agent(object):
 
         pass
 
+    async def _pre_async(self):
+        """
+        Execute the pre-execution hook from `run_async()`.
+
+        Defaults to calling `_pre()` in the default executor, so its I/O does
+        not stall the other jobs of the loop, override to define a non-blocking
+        variant.
+        """
+
+        await self._in_executor(self._pre)
+
+    async def _post_async(self):
+        """
+        Execute the post-execution hook from `run_async()`.
+
+        Defaults to calling `_post()` in the default executor, override to
+        define a non-blocking variant.
+        """
+
+        await self._in_executor(self._post)
+
+    async def _in_executor(self, func):
+        """
+        Run a blocking hook in the default executor, in the current context.
+        """
+
+        await asyncio.get_event_loop().run_in_executor(None, ctx.bind(func))
+
+    def _consumers(self):
+        """
+        Return the consumers fed with each line of the command output.
+
+        By default the output is echoed to the terminal (unless `self.echo` is
+        false) and the last lines are kept in `self.tail`. Classes inheriting
+        can extend the list, see `dciagent.core.stream` for the available
+        consumers.
+        """
+
+        consumers = [self.tail]
+        if self.echo:
+            consumers.insert(0, stream.Echo())
+
+        return consumers
+
+    async def _execute_async(self, consumers):
+        """
+        Run the command line with the run environment and return its rc.
+
+        Override to change how the command is executed, e.g. to run it several
+        times. The consumers have to be closed once done.
+        """
+
+        return await self._pipeline(consumers).run_async(
+            self.command_line, env=self.run_environment
+        )
+
+    async def _execute_watched_async(self, consumers):
+        """
+        Run `_execute_async()` under the watchdog and return its rc.
+        """
+
+        watch = None
+        if self.timeout > 0 or self.idle_timeout > 0:
+            watch = asyncio.ensure_future(self.watchdog.run())
+        try:
+            return await self._execute_async(consumers)
+        finally:
+            if watch is not None:
+                watch.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await watch
+            await self.watchdog.wait_async()
+
+    def _pipeline(self, consumers):
+        """
+        Return a new output pipeline, accounted in the run resource usage.
+        """
+
+        cgroup = None
+        if self.cgroup_accounting:
+            try:
+                cgroup = rusage.Cgroup(
+                    "dciagent-{}-{}".format(os.getpid(), next(_cgroups))
+                )
+            except OSError as e:
+                printer.header("Cannot account resources in a cgroup: {}".format(e))
+
+        pipeline = stream.Pipeline(consumers, cgroup=cgroup, grace=self.kill_grace)
+        if self.watchdog.reason is not None:
+            pipeline.terminated = True  # never start once aborted
+        self.pipelines.append(pipeline)
+        return pipeline
+
     def run(self, args):
         """
         Run the command line.
 
+        This is a blocking wrapper around `run_async()` using its own event loop.
+        """
+
+        return stream.run(self.run_async(args))
+
+    async def run_async(self, args):
+        """
+        Run the command line as a coroutine.
+
         This is the main body of the execution agent. According to the
-        configuration it will build the command line and then run it via Popen.
+        configuration it will build the command line and then run it as an
+        asyncio subprocess, streaming its output through the consumers from
+        `_consumers()`. Many agents can be driven concurrently by one event
+        loop this way: the `_pre()`, `_build_env()` and `_post()` hooks run in
+        the default executor, `_normalize()`, `_validate()` and
+        `_build_command()` run on the loop and must not block.
         """
 
-        self._load_args(vars(args))
-        self._normalize()
+        # one span per lifecycle phase, available as `self.timings`
+        self.timings = timing.Timings()
+        self.usage = None
+        with self.timings.span("load_args"):
+            self._load_args(vars(args))
+        with self.timings.span("normalize"):
+            self._normalize()
 
         if not self.no_validation:
-            self._validate()
+            with self.timings.span("validate"):
+                self._validate()
 
-        self._pre()
-        self._build_command()
-        self._build_env()
+        with self.timings.span("pre"):
+            await self._pre_async()
+        with self.timings.span("build_command"):
+            self._build_command()
+        with self.timings.span("build_env"):
+            await self._in_executor(self._build_env)
 
         if self.verbosity > 0:
             if len(self.environment) > 0:
@@ -218,11 +408,56 @@ class Agent(object):
                     print(" \\\n".join(self.command_line))
             else:
                 if len(self.command_line) > 0:
-                    with ctx.env(**self.environment):
-                        p = subprocess.Popen(self.command_line)
-                        p.communicate()
-                        rc = p.returncode
+                    self.tail = stream.Tail(self.tail_lines)
+                    # the environment is handed to the child directly, patching
+                    # os.environ would leak between concurrent runs
+                    self.run_environment = ctx.environ(self.environment)
+                    self.pipelines = []
+                    self.watchdog = abort.Watchdog(
+                        self.pipelines,
+                        self.timeout,
+                        self.idle_timeout,
+                        self.abort_pattern or [],
+                    )
+                    consumers = (
+                        self._consumers() + self.extra_consumers + [self.watchdog]
+                    )
+                    with self.timings.span("execute"):
+                        rc = await self._execute_watched_async(consumers)
+                    self.usage = rusage.combine(p.usage for p in self.pipelines)
+                    if self.usage is not None:
+                        printer.header(
+                            "Command returned {}, {}".format(
+                                rc, rusage.summary(self.usage)
+                            )
+                        )
+                    if rc != 0 and len(self.tail.lines) > 0:
+                        title = "Command failed with return code {}, last {} lines:"
+                        with printer.section(title.format(rc, len(self.tail.lines))):
+                            for line in self.tail.lines:
+                                print("[{}] {}".format(line.stream, line.text))
         finally:
-            self._post()
+            with self.timings.span("post"):
+                await self._post_async()
+            self._write_timings()
 
         return rc
+
+    def _write_timings(self):
+        """
+        Export the run timings and resource usage to the requested files.
+        """
+
+        usage = self.usage
+        if self.timings_file is not None:
+            self.timings.write_json(
+                self.timings_file,
+                usage=usage._asdict() if usage is not None else None,
+            )
+
+        if self.prometheus_textfile is not None:
+            self.timings.write_prometheus(
+                self.prometheus_textfile,
+                rusage.to_prometheus(usage, agent=self.ap.prog) if usage else "",
+                agent=self.ap.prog,
+            )
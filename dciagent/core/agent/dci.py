@@ -15,14 +15,22 @@
 Module for the DCI base agent(s).
 """
 
+import json
 import os.path
-import shutil
-import subprocess
 import tempfile
 
 import dciagent.core.agent as agent
 import dciagent.core.agent.ansible
+import dciagent.core.archive as archive
+import dciagent.core.artifacts as artifacts
+import dciagent.core.checkpoint as checkpoint
+import dciagent.core.context as ctx
+import dciagent.core.credentials as credentials
+import dciagent.core.error as error
+import dciagent.core.junit as junit
 import dciagent.core.printer as printer
+import dciagent.core.stream as stream
+import dciagent.core.trash as trash
 
 
 class Agent(dciagent.core.agent.ansible.Agent):
@@ -64,6 +72,63 @@ class Agent(dciagent.core.agent.ansible.Agent):
         long="--settings-file",
         env="DCI_SETTINGS_FILE",
     )
+    junit_report = agent.Argument(
+        "write the summary of the JUnit results to this JSON file",
+        long="--junit-report",
+        env="DCI_JUNIT_REPORT",
+    )
+    archive_dir = agent.Argument(
+        "archive the temporary directory as a tarball into this directory",
+        long="--archive-dir",
+        env="DCI_ARCHIVE_DIR",
+    )
+    archive_keep = agent.Argument(
+        "keep at most N archives in the archive directory, 0 for no limit",
+        long="--archive-keep",
+        type=int,
+        default=10,
+        env="DCI_ARCHIVE_KEEP",
+    )
+    archive_max_size = agent.Argument(
+        "keep at most N MiB of archives in the archive directory, 0 for no limit",
+        long="--archive-max-size",
+        type=int,
+        default=0,
+        env="DCI_ARCHIVE_MAX_SIZE",
+    )
+    artifact_cache = agent.Argument(
+        "directory of the artifact cache shared between runs",
+        long="--artifact-cache",
+        env="DCI_ARTIFACT_CACHE",
+    )
+    artifact_cache_size = agent.Argument(
+        "evict the least recently used artifacts beyond N MiB, 0 for no limit",
+        long="--artifact-cache-size",
+        type=int,
+        default=artifacts.DEFAULT_MAX_SIZE,
+        env="DCI_ARTIFACT_CACHE_SIZE",
+    )
+    trash_max_size = agent.Argument(
+        "remove the temporary directory in the background while the trash holds "
+        "less than N MiB, 0 to remove it right away",
+        long="--trash-max-size",
+        type=int,
+        default=10240,
+        env="DCI_TRASH_MAX_SIZE",
+    )
+    resume = agent.Argument(
+        "resume a failed or interrupted run, given its id (i.e. the name of its "
+        "temporary directory), from its first incomplete task",
+        long="--resume",
+        env="DCI_RESUME",
+    )
+    no_checkpoint = agent.Argument(
+        "do not record the completed tasks to resume the run",
+        long="--no-checkpoint",
+        action="store_true",
+        default=False,
+        env="DCI_NO_CHECKPOINT",
+    )
     no_cleanup = agent.Argument(
         "do not remove temporary directory",
         long="--no-cleanup",
@@ -75,6 +140,49 @@ class Agent(dciagent.core.agent.ansible.Agent):
     def __init__(self, prog, desc, version, parents=[], *args, **kwargs):
         super().__init__(prog, desc, version, parents, *args, **kwargs)
 
+    def _load_args(self, args):
+        resume = args.get("resume")
+        if resume:
+            # rebuild the same command line, from the arguments of the run
+            saved = self._load_checkpoint(resume)
+            args = dict(args, **{k: v for k, v in saved.args.items() if k in args})
+            args["resume"] = resume
+            self.resume_task = saved.resume_at
+        # kept before being normalized, see checkpoint.Checkpoint
+        self.run_args = json.loads(json.dumps(dict(args, resume=None)))
+        super()._load_args(args)
+
+    def _load_checkpoint(self, run_id):
+        """
+        Return the checkpoint of the run `run_id`.
+        """
+
+        if os.path.basename(run_id) != run_id or not run_id.startswith("dci-"):
+            raise (error.ValidationError("Invalid run id {}".format(run_id)))
+        try:
+            saved = checkpoint.Checkpoint.load(self._run_dir(run_id))
+        except (OSError, ValueError, KeyError) as e:
+            raise (
+                error.ValidationError(
+                    "Cannot resume run {}, no valid checkpoint: {}".format(run_id, e)
+                )
+            )
+        if saved.resume_at is None:
+            raise (
+                error.ValidationError(
+                    "Run {} completed, there is nothing to resume".format(run_id)
+                )
+            )
+
+        return saved
+
+    def _run_dir(self, run_id):
+        """
+        Return the temporary directory of a run.
+        """
+
+        return os.path.join(tempfile.gettempdir(), run_id)
+
     def _normalize(self):
         if self.config_dir is None:
             if self.default_config_dir is not None:
@@ -110,17 +218,74 @@ class Agent(dciagent.core.agent.ansible.Agent):
         # values according to the given prefix
         super()._normalize()
 
+    def _validate(self):
+        super()._validate()
+
+        if self.archive_keep < 0 or self.archive_max_size < 0:
+            raise (error.ValidationError("Archive limits cannot be negative"))
+        if self.trash_max_size < 0:
+            raise (error.ValidationError("The trash size cannot be negative"))
+        if self.artifact_cache_size < 0:
+            raise (error.ValidationError("The artifact cache size cannot be negative"))
+        if self.archive_dir is not None and not os.path.isdir(self.archive_dir):
+            raise (
+                error.ValidationError(
+                    "Cannot find archive directory {}".format(self.archive_dir)
+                )
+            )
+
     def _pre(self):
         if not self.dry_run:
-            self.tempdir = tempfile.mkdtemp(prefix="dci-")
-            printer.header("Created temporary directory: {}".format(self.tempdir))
+            with self.timings.span("recover"):
+                for path in trash.recover(keep=checkpoint.resumable):
+                    printer.header("Recovered stale directory: {}".format(path))
+            with self.timings.span("tempdir"):
+                if self.resume:
+                    self.tempdir = self._run_dir(self.resume)
+                    if trash.locked(self.tempdir):
+                        raise (
+                            error.ValidationError(
+                                "Run {} is still in progress".format(self.resume)
+                            )
+                        )
+                else:
+                    self.tempdir = tempfile.mkdtemp(prefix="dci-")
+                # held while the run lasts, see trash.recover()
+                self.tempdir_lock = trash.lock(self.tempdir)
+            if self.resume:
+                printer.header(
+                    "Resuming run {} at task {}".format(self.resume, self.resume_task)
+                )
+            else:
+                printer.header("Created temporary directory: {}".format(self.tempdir))
             self.ansible_extra_vars.append(
                 "JOB_ID_FILE={}".format(os.path.join(self.tempdir, "dci.job"))
             )
 
+    async def _pre_async(self):
+        await super()._pre_async()
+        # read the credentials ahead of _build_env() without blocking the loop
+        with self.timings.span("credentials"):
+            self.credentials = await self._read_credentials_async()
+        if "tempdir" in dir(self) and not (
+            self.dry_run or self.no_events or self.no_checkpoint
+        ):
+            self.checkpoint = checkpoint.Checkpoint(self.tempdir, self.run_args)
+            if self.resume:
+                self.checkpoint.resume_at = self.resume_task
+            self.events.subscribe(self.checkpoint.record)
+
+    def _build_command(self):
+        super()._build_command()
+        if self.resume:
+            self.command_line[-1:-1] = ["--start-at-task", self.resume_task]
+
     def _build_env(self):
         super()._build_env()
-        creds = self._read_credentials()
+        if "credentials" in dir(self):
+            creds = self.credentials
+        else:
+            creds = self._read_credentials()
         self.environment.update(creds)
         tmpdir = self.tempdir if "tempdir" in dir(self) else ""
         self.environment.update(
@@ -129,36 +294,151 @@ class Agent(dciagent.core.agent.ansible.Agent):
                 "JUNIT_OUTPUT_DIR": tmpdir,
                 "JUNIT_TEST_CASE_PREFIX": "test_",
                 "JUNIT_TASK_CLASS": "yes",
+                # used by `dci-agent-ctl fetch` from the playbooks
+                "DCI_ARTIFACT_CACHE": self.artifact_cache or ctx.cache_dir("artifacts"),
+                "DCI_ARTIFACT_CACHE_SIZE": str(self.artifact_cache_size),
             }
         )
 
+    def _namespace(self):
+        # labs configured with different prefixes never share facts or SSH
+        # connections
+        return self.prefix
+
+    def _ssh_identity(self):
+        identity = super()._ssh_identity()
+        if "credentials" in dir(self):
+            identity.append(self.credentials.get("DCI_CLIENT_ID"))
+
+        return identity
+
+    def _input_description(self):
+        description = super()._input_description()
+        if "tempdir" not in dir(self):
+            return description
+
+        # every run gets its own temporary directory
+        return json.loads(json.dumps(description).replace(self.tempdir, "<tempdir>"))
+
+    def _consumers(self):
+        consumers = super()._consumers()
+        if "tempdir" in dir(self):
+            consumers.append(stream.LogFile(os.path.join(self.tempdir, "output.log")))
+
+        return consumers
+
     def _post(self):
-        if self.no_cleanup:
-            printer.header(
-                "Skipping removal of temp directory: {}".format(self.tempdir)
+        resumable = "checkpoint" in dir(self) and self.checkpoint.resume_at is not None
+        archived = True
+        if not self.dry_run:
+            with self.timings.span("junit"):
+                self._summarize_junit()
+            if self.archive_dir is not None and not resumable:
+                with self.timings.span("archive"):
+                    archived = self._archive()
+
+        try:
+            if resumable:
+                printer.header(
+                    "Run stopped at task {}, resume it with --resume {}".format(
+                        self.checkpoint.resume_at, os.path.basename(self.tempdir)
+                    )
+                )
+            elif self.no_cleanup or not archived:
+                printer.header(
+                    "Skipping removal of temp directory: {}".format(self.tempdir)
+                )
+            elif not self.dry_run:
+                printer.header("Removing temporary directory: {}".format(self.tempdir))
+                with self.timings.span("cleanup"):
+                    trash.discard(self.tempdir, self.trash_max_size * 1024 * 1024)
+        finally:
+            if not self.dry_run:
+                # the lock file of a resumable run lets trash.recover() remove
+                # it once expired
+                trash.unlock(self.tempdir, self.tempdir_lock, remove=not resumable)
+
+    def _archive(self):
+        """
+        Archive the temporary directory, then apply the retention policy.
+
+        Unless `--no-cleanup` is given, files are removed once the archive is
+        written. Return whether it was.
+        """
+
+        name = os.path.basename(self.tempdir)
+        dest = os.path.join(self.archive_dir, name + archive.SUFFIX)
+        try:
+            size = archive.create(self.tempdir, dest, remove=not self.no_cleanup)
+            removed = archive.prune(
+                self.archive_dir,
+                "dci-",
+                keep=self.archive_keep,
+                max_bytes=self.archive_max_size * 1024 * 1024,
             )
+        except OSError as e:
+            printer.header("Cannot archive {}: {}".format(self.tempdir, e))
+            return False
 
-        if not self.dry_run:
-            printer.header("Removing temporary directory: {}".format(self.tempdir))
-            shutil.rmtree(self.tempdir)
+        printer.header(
+            "Archived temporary directory to {} ({:.1f} MiB), pruned {} old "
+            "archive(s)".format(dest, size / 1024 / 1024, len(removed))
+        )
+        return True
+
+    def _summarize_junit(self):
+        """
+        Aggregate the JUnit reports of the run into a report kept afterwards.
+
+        The report goes to `--junit-report`, or to the user cache directory
+        under the name of the temporary directory.
+        """
+
+        paths = junit.reports(self.tempdir)
+        if not paths:
+            return
+
+        summary = junit.summarize(paths)
+        path = self.junit_report
+        if path is None:
+            path = ctx.cache_dir(
+                "junit", "{}.json".format(os.path.basename(self.tempdir))
+            )
+        try:
+            junit.write(summary, path)
+        except OSError as e:
+            printer.header("Cannot write the JUnit report: {}".format(e))
+            path = None
+
+        totals = summary.totals
+        title = "JUnit: {} tests, {} failures, {} errors, {} skipped".format(
+            totals["tests"], totals["failures"], totals["errors"], totals["skipped"]
+        )
+        if path is not None:
+            title += ", see {}".format(path)
+        with printer.section(title):
+            for f in summary.failures[:10]:
+                print(
+                    "{} {}.{}: {}".format(
+                        f["kind"][:-1].upper(),
+                        f["classname"],
+                        f["name"],
+                        f["message"].splitlines()[0] if f["message"] else "",
+                    )
+                )
+            for f in summary.invalid:
+                print("INVALID {}: {}".format(f["file"], f["error"]))
 
     def _read_credentials(self):
         """
         Read authentication file (i.e. dcirc.sh) and return a dictionary.
         """
 
-        pipe = subprocess.Popen(
-            ". {}; env".format(self.auth_file),
-            stdout=subprocess.PIPE,
-            shell=True,
-            env={},  # start with a clean environment
-            universal_newlines=True,
-        )
-        data = pipe.communicate()[0]
-        env = {}
-        for line in data.splitlines():
-            if line.startswith("DCI_"):
-                k, v = line.split("=")
-                env[k] = v
-
-        return env
+        return credentials.read(self.auth_file)
+
+    async def _read_credentials_async(self):
+        """
+        Read authentication file (i.e. dcirc.sh) without blocking the loop.
+        """
+
+        return await credentials.read_async(self.auth_file)
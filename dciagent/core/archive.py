@@ -0,0 +1,161 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Compressed archives of the run directories.
+
+A directory is streamed into a tarball which is cut into blocks compressed in
+parallel by a thread pool (zlib releases the GIL), each block becoming its own
+gzip member. Concatenated members are a valid gzip file, readable by `tar xzf`
+or `tarfile`. Files are read sequentially with large buffers, and can be
+removed once the archive is complete and in place.
+"""
+
+import collections
+import concurrent.futures
+import gzip
+import os
+import tarfile
+
+SUFFIX = ".tar.gz"
+
+
+class ParallelGzip(object):
+    """
+    A write-only file object compressing blocks of data in a thread pool.
+
+    At most two blocks per worker are in flight, so memory stays bounded
+    whatever the size of the data.
+    """
+
+    def __init__(self, fileobj, level=6, block_size=4 * 1024 * 1024, workers=None):
+        self.fileobj = fileobj
+        self.level = level
+        self.block_size = block_size
+        workers = workers or os.cpu_count() or 1
+        self.pool = concurrent.futures.ThreadPoolExecutor(workers)
+        self.max_pending = 2 * workers
+        self.pending = collections.deque()
+        self.buffer = bytearray()
+
+    def write(self, data):
+        """
+        Buffer the data, compressing every complete block.
+        """
+
+        self.buffer += data
+        while len(self.buffer) >= self.block_size:
+            self._submit(bytes(self.buffer[: self.block_size]))
+            del self.buffer[: self.block_size]
+
+        return len(data)
+
+    def _submit(self, block):
+        self.pending.append(self.pool.submit(gzip.compress, block, self.level))
+        while len(self.pending) > self.max_pending:
+            self.fileobj.write(self.pending.popleft().result())
+
+    def close(self):
+        """
+        Compress what is left and write all the blocks, in order.
+        """
+
+        try:
+            if self.buffer:
+                self._submit(bytes(self.buffer))
+                self.buffer = bytearray()
+            while self.pending:
+                self.fileobj.write(self.pending.popleft().result())
+        finally:
+            self.pool.shutdown()
+
+
+def create(directory, dest, remove=False, level=6, workers=None):
+    """
+    Archive `directory` into the `dest` tarball and return its size.
+
+    Members are named after the directory basename. The tarball is written
+    under a temporary name, synced, then renamed. With `remove`, the archived
+    files are removed only then, the (then empty) directories are left behind.
+    """
+
+    tmp = "{}.{}.part".format(dest, os.getpid())
+    base = os.path.basename(os.path.normpath(directory))
+    archived = []
+    try:
+        with open(tmp, "wb", buffering=1024 * 1024) as f:
+            out = ParallelGzip(f, level=level, workers=workers)
+            try:
+                with tarfile.open(fileobj=out, mode="w|", bufsize=1024 * 1024) as tar:
+                    # read member files with large buffers as well
+                    tar.copybufsize = 1024 * 1024
+                    _add(tar, directory, base, archived)
+            finally:
+                out.close()
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, dest)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+    if remove:
+        for path in archived:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    return os.path.getsize(dest)
+
+
+def _add(tar, directory, arcname, archived):
+    tar.add(directory, arcname, recursive=False)
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        rel = os.path.relpath(root, directory)
+        prefix = arcname if rel == "." else os.path.join(arcname, rel)
+        for name in dirs:
+            tar.add(os.path.join(root, name), os.path.join(prefix, name), False)
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            tar.add(path, os.path.join(prefix, name), recursive=False)
+            archived.append(path)
+
+
+def prune(directory, prefix, keep=0, max_bytes=0):
+    """
+    Remove the oldest archives in `directory` beyond the retention policy.
+
+    Only the archives starting with `prefix` are considered. Up to `keep`
+    archives and `max_bytes` bytes are kept, a limit of 0 means no limit. The
+    most recent archive is always kept. Return the removed paths.
+    """
+
+    archives = []
+    for entry in os.scandir(directory):
+        if entry.name.startswith(prefix) and entry.name.endswith(SUFFIX):
+            st = entry.stat()
+            archives.append((st.st_mtime, entry.path, st.st_size))
+    archives.sort(reverse=True)
+
+    removed = []
+    total = 0
+    for i, (_, path, size) in enumerate(archives):
+        total += size
+        if i > 0 and ((keep and i >= keep) or (max_bytes and total > max_bytes)):
+            os.unlink(path)
+            removed.append(path)
+
+    return removed
@@ -0,0 +1,242 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Content-addressed cache of the artifacts fetched by the playbooks.
+
+Blobs are stored by SHA-256 under `<root>/blobs`, along with an index of the
+URLs they were downloaded from. A cache hit is hardlinked (or reflinked, or as
+a last resort copied) to its destination, so blobs are made read-only: modify
+a copy, never the fetched file itself.
+
+Downloads hold a lock per artifact, so concurrent agents fetching the same one
+wait for the first download instead of starting their own. Once over its size
+limit, the least recently used blobs are evicted.
+
+Agents expose the cache to the playbooks with the `DCI_ARTIFACT_CACHE` and
+`DCI_ARTIFACT_CACHE_SIZE` environment variables, used by `dci-agent-ctl fetch`.
+"""
+
+import contextlib
+import errno
+import fcntl
+import hashlib
+import os
+import shutil
+
+# default size limit of the cache, in MiB
+DEFAULT_MAX_SIZE = 50 * 1024
+
+# FICLONE from linux/fs.h, a copy-on-write clone on btrfs, xfs...
+FICLONE = 0x40049409
+CHUNK_SIZE = 1024 * 1024
+
+
+@contextlib.contextmanager
+def _flock(path, flags):
+    """
+    Hold a flock on `path`, created if needed, during the context.
+    """
+
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, flags)
+        yield
+    finally:
+        os.close(fd)
+
+
+def _sha256(text):
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def link(src, dest):
+    """
+    Make `dest` a hardlink, a reflink or, failing that, a copy of `src`.
+    """
+
+    tmp = "{}.{}.part".format(dest, os.getpid())
+    try:
+        os.link(src, tmp)
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            raise
+        with open(src, "rb") as fin, open(tmp, "wb") as fout:
+            try:
+                fcntl.ioctl(fout.fileno(), FICLONE, fin.fileno())
+            except OSError:
+                shutil.copyfileobj(fin, fout, CHUNK_SIZE)
+    os.replace(tmp, dest)
+
+
+class Cache(object):
+    """
+    A local artifact cache of at most `max_bytes` bytes (0 for no limit).
+    """
+
+    def __init__(self, root, max_bytes=0):
+        self.root = root
+        self.max_bytes = max_bytes
+        for d in ("blobs", "urls", "locks", "tmp"):
+            os.makedirs(os.path.join(root, d), exist_ok=True)
+
+    def path(self, digest):
+        """
+        Return the path of the blob with the given SHA-256.
+        """
+
+        return os.path.join(self.root, "blobs", digest[:2], digest)
+
+    def lookup(self, url=None, digest=None):
+        """
+        Return the digest of a cached artifact, `None` if not cached.
+
+        The artifact is looked up by digest when given, by URL otherwise, and
+        marked as recently used.
+        """
+
+        if digest is None and url is not None:
+            try:
+                with open(os.path.join(self.root, "urls", _sha256(url))) as f:
+                    digest = f.read().strip()
+            except FileNotFoundError:
+                return None
+
+        if digest is None:
+            return None
+        try:
+            os.utime(self.path(digest))
+        except FileNotFoundError:
+            return None
+
+        return digest
+
+    def store(self, src, url=None, digest=None):
+        """
+        Move the `src` file into the cache and return its digest.
+
+        The digest is computed unless already known.
+        """
+
+        if digest is None:
+            h = hashlib.sha256()
+            with open(src, "rb") as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                    h.update(chunk)
+            digest = h.hexdigest()
+
+        os.chmod(src, 0o444)
+        os.makedirs(os.path.dirname(self.path(digest)), exist_ok=True)
+        os.replace(src, self.path(digest))
+        if url is not None:
+            index = os.path.join(self.root, "urls", _sha256(url))
+            tmp = "{}.{}".format(index, os.getpid())
+            with open(tmp, "w") as f:
+                f.write(digest)
+            os.replace(tmp, index)
+
+        return digest
+
+    def _download(self, url):
+        """
+        Download `url` to a temporary file in the cache.
+
+        Return the path of the file and its digest, computed on the fly.
+        """
+
+        # heavy import, only needed on a cache miss
+        import urllib.request
+
+        tmp = os.path.join(self.root, "tmp", "{}.{}".format(_sha256(url), os.getpid()))
+        h = hashlib.sha256()
+        try:
+            with urllib.request.urlopen(url) as r, open(tmp, "wb") as f:
+                for chunk in iter(lambda: r.read(CHUNK_SIZE), b""):
+                    h.update(chunk)
+                    f.write(chunk)
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(tmp)
+            raise
+
+        return tmp, h.hexdigest()
+
+    def fetch(self, url, dest, digest=None):
+        """
+        Make the artifact at `url` available as `dest`, downloading on a miss.
+
+        When `digest` (SHA-256) is given, the download is checked against it
+        and the artifact is found even if cached from another URL. Return
+        whether it was a cache hit.
+        """
+
+        key = digest if digest is not None else _sha256(url)
+        # shared with the other fetches, exclusive for the eviction
+        with _flock(os.path.join(self.root, ".lock"), fcntl.LOCK_SH):
+            with _flock(os.path.join(self.root, "locks", key), fcntl.LOCK_EX):
+                found = self.lookup(url, digest)
+                hit = found is not None
+                if not hit:
+                    tmp, found = self._download(url)
+                    if digest is not None and found != digest:
+                        os.unlink(tmp)
+                        raise ValueError(
+                            "Checksum mismatch for {}: got {}, expected {}".format(
+                                url, found, digest
+                            )
+                        )
+                    self.store(tmp, url, found)
+                link(self.path(found), dest)
+
+        self.evict()
+        return hit
+
+    def evict(self):
+        """
+        Remove the least recently used blobs until the cache fits its limit.
+
+        Nothing is done while artifacts are being fetched. Return the number
+        of blobs removed.
+        """
+
+        if self.max_bytes <= 0:
+            return 0
+
+        with contextlib.ExitStack() as stack:
+            try:
+                stack.enter_context(
+                    _flock(
+                        os.path.join(self.root, ".lock"),
+                        fcntl.LOCK_EX | fcntl.LOCK_NB,
+                    )
+                )
+            except BlockingIOError:
+                return 0
+
+            blobs = []
+            for d in os.scandir(os.path.join(self.root, "blobs")):
+                for entry in os.scandir(d.path):
+                    st = entry.stat()
+                    blobs.append((st.st_mtime, entry.path, st.st_size))
+            blobs.sort()
+
+            total = sum(size for _, _, size in blobs)
+            removed = 0
+            for _, path, size in blobs:
+                if total <= self.max_bytes:
+                    break
+                os.unlink(path)
+                total -= size
+                removed += 1
+
+        return removed
@@ -0,0 +1,367 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Batch execution of many agent invocations.
+
+A jobs file lists agent invocations, either as a list or under a `jobs` key:
+
+    concurrency: 4
+    jobs:
+      - name: lab1
+        agent: example
+        argv: ["--pretty"]
+      - name: lab2
+        agent: example
+        priority: 10
+        after: [lab1]
+
+Jobs run concurrently up to the concurrency limit, once all the jobs they
+depend on (`after`) succeeded, higher `priority` first. Each job writes its
+output to its own log file, named after the job, and a summary is written at
+the end. Besides the output of the commands, the log gets what the agent
+prints while the job runs: `sys.stdout` and `sys.stderr` are routed to the log
+of the current job, found from the context of the running code (see
+`dciagent.core.context.ContextVar`).
+
+The file is read with PyYAML when installed, JSON otherwise.
+"""
+
+import asyncio
+import contextlib
+import json
+import os
+import re
+import sys
+import time
+
+import dciagent.core.context as ctx
+import dciagent.core.error as error
+import dciagent.core.printer as printer
+import dciagent.core.stream as stream
+
+try:
+    import yaml
+except ModuleNotFoundError:
+    yaml = None
+
+# job names are used as file names
+NAME_PATTERN = re.compile(r"[A-Za-z0-9][A-Za-z0-9._-]*")
+
+
+_current_log = ctx.ContextVar("current_log", default=None)
+
+
+class JobLog(stream.LogFile):
+    """
+    The log of a job, fed with the output of its commands and of its agent.
+
+    The agent closes its consumers once its command is done, the log stays
+    open until `finish()`.
+    """
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.partial = {"stdout": "", "stderr": ""}
+
+    def write(self, name, text):
+        """
+        Log the text written by the agent to the stream `name`, by lines.
+        """
+
+        lines = (self.partial[name] + text).split("\n")
+        self.partial[name] = lines.pop()
+        now = time.time()
+        for line in lines:
+            self(stream.Line(now, name, line))
+
+        return len(text)
+
+    def close(self):
+        """
+        Flush the log, it is closed by `finish()`.
+        """
+
+        self.f.flush()
+
+    def finish(self):
+        """
+        Log the incomplete lines and close the log.
+        """
+
+        for name, text in self.partial.items():
+            if text:
+                self(stream.Line(time.time(), name, text))
+        self.f.close()
+
+
+class Output(object):
+    """
+    Stand-in for `sys.stdout` or `sys.stderr`, writing to the current job log.
+
+    Outside of the jobs, the output goes to the `default` stream.
+    """
+
+    def __init__(self, name, default):
+        self.name = name
+        self.default = default
+
+    def write(self, text):
+        """
+        Write to the log of the current job, or to the default stream.
+        """
+
+        log = _current_log.get()
+        if log is None:
+            return self.default.write(text)
+
+        return log.write(self.name, text)
+
+    def flush(self):
+        """
+        Flush the default stream, the job logs are flushed once done.
+        """
+
+        self.default.flush()
+
+    def __getattr__(self, name):
+        """
+        Delegate the other attributes, e.g. `isatty()`, to the default stream.
+        """
+
+        return getattr(self.default, name)
+
+
+class Job(object):
+    """
+    A single agent invocation and its result.
+    """
+
+    def __init__(self, name, agent, argv=[], after=[], priority=0):
+        self.name = str(name)
+        self.agent = agent
+        self.argv = [str(a) for a in argv]
+        self.after = [str(a) for a in after]
+        self.priority = int(priority)
+        self.status = "pending"
+        self.rc = None
+        self.wall = None
+        self.log = None
+
+    def summary(self):
+        """
+        Return the job result as a dictionary.
+        """
+
+        return {
+            "name": self.name,
+            "agent": self.agent,
+            "status": self.status,
+            "rc": self.rc,
+            "wall": self.wall,
+            "log": self.log,
+        }
+
+
+def load(path):
+    """
+    Read a jobs file and return `(jobs, concurrency)`.
+
+    The concurrency is `None` when the file does not define it.
+    """
+
+    with open(path) as f:
+        data = yaml.safe_load(f) if yaml is not None else json.load(f)
+
+    concurrency = None
+    if isinstance(data, dict):
+        concurrency = data.get("concurrency")
+        data = data.get("jobs", [])
+
+    if not isinstance(data, list):
+        raise error.ValidationError("{} does not contain a list of jobs".format(path))
+
+    jobs = []
+    for i, spec in enumerate(data):
+        if not isinstance(spec, dict) or "agent" not in spec:
+            raise error.ValidationError("Job #{} does not define an agent".format(i))
+        spec = dict(spec)
+        spec.setdefault("name", "{}-{}".format(spec["agent"], i))
+        try:
+            jobs.append(Job(**spec))
+        except (TypeError, ValueError) as e:
+            raise error.ValidationError("Invalid job #{}: {}".format(i, e))
+
+    return jobs, concurrency
+
+
+class Batch(object):
+    """
+    Run jobs through a bounded pool, honoring dependencies and priorities.
+
+    `agents` maps the agent names to their `Agent` classes.
+    """
+
+    def __init__(self, jobs, agents, concurrency, log_dir):
+        self.jobs = jobs
+        self.agents = agents
+        self.concurrency = max(1, concurrency)
+        self.log_dir = log_dir
+        self._validate()
+
+    def _validate(self):
+        """
+        Check names, agents and dependencies, rejecting cycles.
+        """
+
+        names = [j.name for j in self.jobs]
+        if len(set(names)) != len(names):
+            raise error.ValidationError("Job names must be unique")
+
+        for j in self.jobs:
+            if not NAME_PATTERN.fullmatch(j.name):
+                raise error.ValidationError(
+                    "Invalid job name {!r}, use letters, digits, '.', '_' and '-' "
+                    "only".format(j.name)
+                )
+            if j.agent not in self.agents:
+                raise error.ValidationError(
+                    "Job {} uses unknown agent {}".format(j.name, j.agent)
+                )
+            for dep in j.after:
+                if dep not in names:
+                    raise error.ValidationError(
+                        "Job {} depends on unknown job {}".format(j.name, dep)
+                    )
+
+        # Kahn's algorithm, whatever cannot be ordered is part of a cycle
+        deps = {j.name: set(j.after) for j in self.jobs}
+        while deps:
+            free = [name for name, after in deps.items() if not after]
+            if not free:
+                raise error.ValidationError(
+                    "Circular dependencies between jobs {}".format(", ".join(deps))
+                )
+            for name in free:
+                del deps[name]
+            for after in deps.values():
+                after.difference_update(free)
+
+    async def _run_job(self, job):
+        """
+        Run a job's agent with its output going to the job log.
+        """
+
+        job.status = "running"
+        job.log = os.path.join(self.log_dir, "{}.log".format(job.name))
+        start = time.monotonic()
+        log = JobLog(job.log)
+        # what the agent prints from now on goes to the log, see Output
+        _current_log.set(log)
+        try:
+            agent = self.agents[job.agent]()
+            agent.echo = False
+            agent.extra_consumers.append(log)
+            try:
+                args = agent.cli(job.argv)
+            except SystemExit as e:
+                job.rc = e.code if isinstance(e.code, int) else 1
+            else:
+                job.rc = await agent.run_async(args)
+        except Exception as e:
+            print("{!r}".format(e), file=sys.stderr)
+            job.rc = 1
+        finally:
+            job.wall = time.monotonic() - start
+            job.status = "success" if job.rc == 0 else "failure"
+            _current_log.set(None)
+            log.finish()
+
+    async def run_async(self):
+        """
+        Run all the jobs and return the batch return code.
+        """
+
+        os.makedirs(self.log_dir, exist_ok=True)
+        with contextlib.redirect_stdout(
+            Output("stdout", sys.stdout)
+        ), contextlib.redirect_stderr(Output("stderr", sys.stderr)):
+            await self._run_jobs_async()
+
+        self.report()
+        return 0 if all(j.rc == 0 for j in self.jobs) else 1
+
+    async def _run_jobs_async(self):
+        order = {j.name: i for i, j in enumerate(self.jobs)}
+        jobs = {j.name: j for j in self.jobs}
+        pending = list(self.jobs)
+        running = {}
+
+        while pending or running:
+            for job in list(pending):
+                if any(jobs[dep].status in ("failure", "skipped") for dep in job.after):
+                    job.status = "skipped"
+                    pending.remove(job)
+
+            ready = [
+                j
+                for j in pending
+                if all(jobs[dep].status == "success" for dep in j.after)
+            ]
+            ready.sort(key=lambda j: (-j.priority, order[j.name]))
+            for job in ready[: self.concurrency - len(running)]:
+                pending.remove(job)
+                running[asyncio.ensure_future(self._run_job(job))] = job
+
+            if running:
+                try:
+                    done, _ = await asyncio.wait(
+                        running, return_when=asyncio.FIRST_COMPLETED
+                    )
+                except asyncio.CancelledError:
+                    # terminate the running agents before giving up
+                    for task in running:
+                        task.cancel()
+                    await asyncio.gather(*running, return_exceptions=True)
+                    raise
+                for task in done:
+                    del running[task]
+
+    def run(self):
+        """
+        Run all the jobs in a new event loop.
+        """
+
+        return stream.run(self.run_async())
+
+    def report(self):
+        """
+        Print the summary of the jobs and write it as JSON in the log dir.
+        """
+
+        summary = [j.summary() for j in self.jobs]
+        with open(os.path.join(self.log_dir, "summary.json"), "w") as f:
+            json.dump(summary, f, indent=2)
+
+        width = max(len(j.name) for j in self.jobs) if self.jobs else 0
+        with printer.section("Batch summary ({}):".format(self.log_dir)):
+            for j in self.jobs:
+                print(
+                    "{:<{}}  {:<8}  rc={:<4}  {}".format(
+                        j.name,
+                        width,
+                        j.status,
+                        "-" if j.rc is None else j.rc,
+                        "-" if j.wall is None else "{:.1f}s".format(j.wall),
+                    )
+                )
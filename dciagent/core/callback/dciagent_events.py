@@ -0,0 +1,175 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Send the playbook events to the agent running ansible, as JSON lines.
+
+The agent listens on the Unix socket given in `DCIAGENT_EVENTS`, the plugin
+does nothing without it. See `dciagent.core.events` for the events.
+"""
+
+import json
+import os
+import socket
+import time
+
+from ansible.plugins.callback import CallbackBase
+
+DOCUMENTATION = """
+    name: dciagent_events
+    type: notification
+    short_description: send structured events to python-dciagent
+    description:
+      - Sends compact JSON lines events about the playbook, plays, tasks and
+        host results to the Unix socket of the agent running ansible.
+    requirements:
+      - enabled by the agent, along with DCIAGENT_EVENTS
+"""
+
+# failure messages can be huge, the agent only needs a hint
+MAX_MESSAGE = 1024
+
+
+class CallbackModule(CallbackBase):
+    """
+    Stream the playbook events to the agent.
+    """
+
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = "notification"
+    CALLBACK_NAME = "dciagent_events"
+    CALLBACK_NEEDS_ENABLED = True
+
+    def __init__(self, display=None):
+        super(CallbackModule, self).__init__(display=display)
+        self.sock = None
+        self.tag = os.environ.get("DCIAGENT_EVENTS_TAG")
+        self.started = time.time()
+        self.task = None
+        self.task_started = None
+        path = os.environ.get("DCIAGENT_EVENTS")
+        if path:
+            try:
+                self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self.sock.connect(path)
+            except OSError:
+                self.sock = None
+
+    def _emit(self, event, **data):
+        if self.sock is None:
+            return
+        event = dict(event=event, time=time.time(), **data)
+        if self.tag:
+            event["tag"] = self.tag
+        line = json.dumps(event, separators=(",", ":"), default=str) + "\n"
+        try:
+            self.sock.sendall(line.encode("utf-8"))
+        except OSError:
+            self.sock = None  # the agent went away, keep running
+
+    def _end_task(self):
+        if self.task is not None:
+            self._emit(
+                "task_end",
+                task=self.task,
+                duration=time.time() - self.task_started,
+            )
+            self.task = None
+
+    def _result(self, result, status):
+        message = None
+        if status in ("failed", "unreachable", "ignored"):
+            message = str(result._result.get("msg", ""))[:MAX_MESSAGE]
+        self._emit(
+            "result",
+            task=self.task,
+            host=result._host.get_name(),
+            status=status,
+            duration=time.time() - self.task_started,
+            message=message,
+        )
+
+    def v2_playbook_on_start(self, playbook):
+        """
+        Send playbook_start.
+        """
+
+        self._emit("playbook_start", playbook=playbook._file_name)
+
+    def v2_playbook_on_play_start(self, play):
+        """
+        End the running task and send play_start.
+        """
+
+        self._end_task()
+        self._emit("play_start", play=play.get_name())
+
+    def v2_playbook_on_task_start(self, task, is_conditional):
+        """
+        End the running task and send task_start.
+        """
+
+        self._end_task()
+        self.task = task.get_name()
+        self.task_started = time.time()
+        self._emit("task_start", task=self.task)
+
+    def v2_playbook_on_handler_task_start(self, task):
+        """
+        Handlers are tasks too.
+        """
+
+        self.v2_playbook_on_task_start(task, False)
+
+    def v2_runner_on_ok(self, result):
+        """
+        Send the ok or changed result of a host.
+        """
+
+        self._result(result, "changed" if result._result.get("changed") else "ok")
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        """
+        Send the failed or ignored result of a host.
+        """
+
+        self._result(result, "ignored" if ignore_errors else "failed")
+
+    def v2_runner_on_unreachable(self, result):
+        """
+        Send the unreachable result of a host.
+        """
+
+        self._result(result, "unreachable")
+
+    def v2_runner_on_skipped(self, result):
+        """
+        Send the skipped result of a host.
+        """
+
+        self._result(result, "skipped")
+
+    def v2_playbook_on_stats(self, stats):
+        """
+        Send playbook_end with the recap of every host.
+        """
+
+        self._end_task()
+        self._emit(
+            "playbook_end",
+            duration=time.time() - self.started,
+            stats={h: stats.summarize(h) for h in sorted(stats.processed)},
+        )
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
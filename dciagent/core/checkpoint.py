@@ -0,0 +1,115 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Checkpoints of the playbook runs, to resume them where they stopped.
+
+The checkpoint lives in the run directory, next to the other run artifacts. It
+holds the arguments of the agent, so a resumed run rebuilds the same command
+line, and the task to resume at: the first task that failed or, failing that,
+the last task started, until the playbook ends without failures. Resuming
+re-runs that task, with `--start-at-task`. Tasks are known by name, so with
+duplicate names ansible starts at the first one.
+
+It is fed by the playbook events (see `dciagent.core.events`) and synced to
+disk whenever a task starts, so it survives the agent and the controller.
+Tagged events, i.e. sharded runs, are ignored: shards progress independently.
+"""
+
+import json
+import os
+import time
+
+FILE = "checkpoint.json"
+# resumable run directories left by killed agents are kept that long
+MAX_AGE = 7 * 24 * 3600
+
+
+class Checkpoint(object):
+    """
+    The checkpoint of the run directory `directory`.
+    """
+
+    def __init__(self, directory, args=None):
+        self.path = os.path.join(directory, FILE)
+        self.args = args
+        self.resume_at = None
+        self.failed = False
+
+    @classmethod
+    def load(cls, directory):
+        """
+        Return the checkpoint saved in `directory`.
+
+        Raise `OSError` if there is none, `ValueError` if it is invalid.
+        """
+
+        checkpoint = cls(directory)
+        with open(checkpoint.path) as f:
+            data = json.load(f)
+        checkpoint.args = data["args"]
+        checkpoint.resume_at = data["resume_at"]
+        return checkpoint
+
+    def save(self):
+        """
+        Atomically and durably write the checkpoint.
+        """
+
+        tmp = "{}.{}".format(self.path, os.getpid())
+        with open(tmp, "w") as f:
+            json.dump({"args": self.args, "resume_at": self.resume_at}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def record(self, event):
+        """
+        Update the checkpoint with a playbook event, a `Stream` listener.
+        """
+
+        if event.get("tag") is not None:
+            return
+        name = event.get("event")
+        if name == "playbook_start":
+            self.failed = False  # e.g. retrying the failed hosts
+        elif name == "task_start" and not self.failed:
+            self.resume_at = event.get("task")
+            self.save()
+        elif name == "result" and not self.failed:
+            if event.get("status") in ("failed", "unreachable"):
+                self.failed = True
+                self.resume_at = event.get("task")
+                self.save()
+        elif name == "playbook_end":
+            # rescued failures are not counted in the stats
+            stats = event.get("stats") or {}
+            if not any(
+                s.get("failures") or s.get("unreachable") for s in stats.values()
+            ):
+                self.resume_at = None
+                self.save()
+
+
+def resumable(directory, max_age=MAX_AGE):
+    """
+    Return whether the run in `directory` stopped at a task in the last `max_age`.
+    """
+
+    try:
+        checkpoint = Checkpoint.load(directory)
+        age = time.time() - os.stat(checkpoint.path).st_mtime
+    except (OSError, ValueError, KeyError):
+        return False
+
+    return checkpoint.resume_at is not None and age < max_age
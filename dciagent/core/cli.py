@@ -24,12 +24,93 @@ This script auto-discovers agents in the `dciagent.agents` Namespace.
 """
 
 import argparse
-import importlib
-import pkgutil
 import sys
 
 import dciagent.agents as agent_ns
 import dciagent.core
+import dciagent.core.client as client
+import dciagent.core.discovery as discovery
+
+
+class VersionAction(argparse.Action):
+    """
+    Print the version, only resolving it when the option is given.
+    """
+
+    def __init__(self, option_strings, dest=argparse.SUPPRESS, help=None):
+        super().__init__(
+            option_strings=option_strings,
+            dest=dest,
+            default=argparse.SUPPRESS,
+            nargs=0,
+            help=help,
+        )
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        """
+        Print the version and exit.
+        """
+
+        print("{} {}".format(parser.prog, dciagent.core.version()))
+        parser.exit()
+
+
+def _serve(args, agents):
+    """
+    Run the agent daemon with all the discovered agents loaded.
+    """
+
+    # imported here, asyncio is too heavy for the other commands
+    import dciagent.core.daemon as daemon
+
+    return daemon.serve(
+        {fqa.split(".")[-1]: discovery.load(fqa) for fqa in agents}, args.socket
+    )
+
+
+def _batch(args, agents):
+    """
+    Run a jobs file, only loading the agents it uses.
+    """
+
+    import time
+
+    import dciagent.core.batch as batch
+
+    jobs, concurrency = batch.load(args.jobs)
+    if args.concurrency is not None:
+        concurrency = args.concurrency
+    log_dir = args.log_dir
+    if log_dir is None:
+        log_dir = time.strftime("dci-batch-%Y%m%d-%H%M%S")
+
+    names = {fqa.split(".")[-1]: fqa for fqa in agents}
+    used = {j.agent for j in jobs if j.agent in names}
+    return batch.Batch(
+        jobs,
+        {name: discovery.load(names[name]) for name in used},
+        concurrency or 4,
+        log_dir,
+    ).run()
+
+
+def _fetch(args):
+    """
+    Fetch an artifact through the artifact cache.
+    """
+
+    import os
+
+    import dciagent.core.artifacts as artifacts
+    import dciagent.core.context as ctx
+
+    root = os.getenv("DCI_ARTIFACT_CACHE") or ctx.cache_dir("artifacts")
+    size = int(os.getenv("DCI_ARTIFACT_CACHE_SIZE", artifacts.DEFAULT_MAX_SIZE))
+    hit = artifacts.Cache(root, size * 1024 * 1024).fetch(
+        args.url, args.dest, args.sha256
+    )
+    print("{} {}".format("hit" if hit else "miss", args.dest))
+    return 0
 
 
 def main(argv=[]):
@@ -49,8 +130,7 @@ def main(argv=[]):
         "-v",
         "--version",
         help="print the version",
-        action="version",
-        version="%(prog)s {}".format(dciagent.core.__version__),
+        action=VersionAction,
     )
 
     sp = ap.add_subparsers(help="Agent to run")
@@ -58,39 +138,85 @@ def main(argv=[]):
 
     # auto-discover agents, pretty much taken as-is from
     # https://packaging.python.org/en/latest/guides/creating-and-discovering-plugins/#using-namespace-packages
-    agents = {
-        name: importlib.import_module(name)
-        for finder, name, ispkg in pkgutil.iter_modules(
-            agent_ns.__path__, agent_ns.__name__ + "."
-        )
-    }
+    # the results are cached in a manifest so only the selected agent is
+    # imported, see dciagent.core.discovery
+    agents = discovery.discover(agent_ns)
 
     # build the sub-commands
-    for fqa, mod in agents.items():
-        # check if there's an Agent class defined in the agent module
-        try:
-            a = getattr(mod, "Agent")
-            assert issubclass(a, dciagent.core.agent.base.Agent)
-        except AttributeError:
-            continue
-        except AssertionError:
-            continue
+    for fqa, entry in agents.items():
         agent = fqa.split(".")[-1]
         # add as a subparser
         subs[agent] = sp.add_parser(
             agent,
-            help=mod.Agent.__doc__,
-            description=mod.__doc__,
+            help=entry["help"],
+            description=entry["description"],
             formatter_class=argparse.RawDescriptionHelpFormatter,
         )
-        for e in mod.Agent._args():
+        for e in discovery.arguments(fqa, entry):
             args, kwargs = e.signature()
             subs[agent].add_argument(*args, **kwargs)
-        subs[agent].set_defaults(Agent=mod.Agent)
+        subs[agent].set_defaults(agent_module=fqa)
+
+    # built-in commands
+    serve = sp.add_parser(
+        "serve",
+        help="run a daemon accepting agent jobs on a Unix socket",
+        description="Keep all agents loaded and run the jobs submitted to it.",
+    )
+    serve.add_argument("-s", "--socket", help="path to the daemon socket")
+    serve.set_defaults(command=lambda args: _serve(args, agents))
+
+    submit = sp.add_parser(
+        "submit",
+        help="submit an agent job to a running daemon",
+        description="Run an agent through the daemon started with `serve`.",
+    )
+    submit.add_argument("-s", "--socket", help="path to the daemon socket")
+    submit.add_argument("agent", help="agent to run")
+    submit.add_argument(
+        "argv", nargs=argparse.REMAINDER, help="arguments passed to the agent"
+    )
+    submit.set_defaults(
+        command=lambda args: client.submit(args.agent, args.argv, args.socket)
+    )
+
+    batch = sp.add_parser(
+        "batch",
+        help="run many agent jobs from a jobs file",
+        description="Run the agent jobs listed in a YAML/JSON jobs file.",
+    )
+    batch.add_argument("jobs", help="path to the jobs file")
+    batch.add_argument(
+        "-j",
+        "--concurrency",
+        type=int,
+        help="maximum number of jobs running at once (default: from file or 4)",
+    )
+    batch.add_argument(
+        "-o",
+        "--log-dir",
+        help="directory for the job logs and summary (default: ./dci-batch-<date>)",
+    )
+    batch.set_defaults(command=lambda args: _batch(args, agents))
+
+    fetch = sp.add_parser(
+        "fetch",
+        help="fetch an artifact through the cache shared between runs",
+        description="Link a cached artifact to DEST, downloading it on a miss. "
+        "The cache is $DCI_ARTIFACT_CACHE, limited to $DCI_ARTIFACT_CACHE_SIZE MiB.",
+    )
+    fetch.add_argument("url", help="URL of the artifact")
+    fetch.add_argument("dest", help="destination path")
+    fetch.add_argument("--sha256", help="expected SHA-256 of the artifact")
+    fetch.set_defaults(command=_fetch)
 
     args = ap.parse_args()
+    if "command" in vars(args):
+        sys.exit(args.command(args))
+
     try:
-        agent = args.Agent(**vars(args))
+        Agent = discovery.load(args.agent_module)
+        agent = Agent(**vars(args))
         args = agent.cli(argv)
         sys.exit(agent.run(args))
     except AttributeError:
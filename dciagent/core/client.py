@@ -0,0 +1,58 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Client side of the agent daemon, see `dciagent.core.daemon`.
+
+Kept apart from the daemon so that submitting a job stays cheap to import.
+"""
+
+import json
+import socket
+import sys
+
+import dciagent.core.context as ctx
+
+
+def socket_path():
+    """
+    Return the default path of the daemon socket, in a private directory.
+    """
+
+    return ctx.runtime_dir("dciagent.sock")
+
+
+def encode(msg):
+    """
+    Encode a protocol message as a JSON line.
+    """
+
+    return (json.dumps(msg) + "\n").encode()
+
+
+def submit(agent, argv, path=None):
+    """
+    Submit a job to the daemon, print its output and return its rc.
+    """
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(path if path is not None else socket_path())
+        s.sendall(encode({"agent": agent, "argv": argv}))
+        for line in s.makefile("r"):
+            msg = json.loads(line)
+            if "rc" in msg:
+                return msg["rc"]
+            out = sys.stderr if msg["stream"] == "stderr" else sys.stdout
+            print(msg["text"], file=out)
+
+    raise ConnectionError("The daemon closed the connection before the job ended")
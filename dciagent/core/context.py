@@ -11,16 +11,168 @@
 # WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 # License for the specific language governing permissions and limitations
 # under the License.
-"""Context manager utilities used throughout the project."""
+"""Context manager and environment utilities used throughout the project."""
 
 import contextlib
+import errno
+import functools
 import os
+import stat
+import threading
+import types
+
+try:
+    import contextvars
+except ModuleNotFoundError:  # python 3.6
+    contextvars = None
+
+RUNTIME_FALLBACK = "/tmp/dciagent-{uid}"
+
+
+def cache_dir(*parts):
+    """
+    Return a path below the user cache directory of dciagent.
+
+    The directory itself is not created.
+    """
+
+    cache = os.getenv("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(cache, "dciagent", *parts)
+
+
+def runtime_dir(*parts, create=True):
+    """
+    Return a path below the private runtime directory of the user.
+
+    That is `$XDG_RUNTIME_DIR`, or a `/tmp/dciagent-<uid>` directory created
+    with restricted permissions unless `create` is false. Raise
+    `PermissionError` if the latter is not a directory of the user only, e.g.
+    created by another user to hijack the sockets.
+    """
+
+    runtime = os.getenv("XDG_RUNTIME_DIR")
+    if runtime is None:
+        runtime = RUNTIME_FALLBACK.format(uid=os.getuid())
+        try:
+            if create:
+                os.mkdir(runtime, 0o700)
+            st = os.lstat(runtime)
+        except FileExistsError:
+            st = os.lstat(runtime)
+        except FileNotFoundError:
+            return os.path.join(runtime, *parts)  # not created
+        if (
+            not stat.S_ISDIR(st.st_mode)
+            or st.st_uid != os.getuid()
+            or stat.S_IMODE(st.st_mode) != 0o700
+        ):
+            raise PermissionError(
+                errno.EPERM,
+                "Refusing to use runtime directory not private to the user",
+                runtime,
+            )
+
+    return os.path.join(runtime, *parts)
+
+
+class _TaskVar(object):
+    """
+    A `contextvars.ContextVar` stand-in for python 3.6.
+
+    Values are bound to the current asyncio task or, outside of any task, to
+    the current thread. Tasks started by a task do not inherit its values,
+    functions wrapped by `bind()` do.
+    """
+
+    instances = []
+
+    def __init__(self, name, default=None):
+        self.name = name
+        self.default = default
+        self.values = {}
+        self.instances.append(self)
+
+    @staticmethod
+    def _key():
+        import asyncio  # not needed by the client, slow to import
+
+        task = None
+        with contextlib.suppress(RuntimeError):  # no event loop in this thread
+            task = asyncio.Task.current_task()
+        return task if task is not None else threading.get_ident()
+
+    def get(self):
+        """
+        Return the value of the current task or thread.
+        """
+
+        return self.values.get(self._key(), self.default)
+
+    def set(self, value):
+        """
+        Set the value of the current task or thread.
+        """
+
+        if value is self.default:
+            self.values.pop(self._key(), None)
+        else:
+            self.values[self._key()] = value
+
+
+if contextvars is not None:
+    ContextVar = contextvars.ContextVar
+else:
+    ContextVar = _TaskVar
+
+
+def bind(func):
+    """
+    Return `func` bound to a copy of the current context, to run in a thread.
+
+    The threads of an executor do not inherit the context variables, e.g. the
+    log of the current batch job.
+    """
+
+    if contextvars is not None:
+        return functools.partial(contextvars.copy_context().run, func)
+
+    values = [(var, var.get()) for var in _TaskVar.instances]
+
+    def bound(*args, **kwargs):
+        for var, value in values:
+            var.set(value)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            for var, _ in values:
+                var.set(var.default)
+
+    return bound
+
+
+def environ(extra, base=None):
+    """
+    Return an immutable environment for a child process.
+
+    The environment is a snapshot of `base` (`os.environ` by default) updated
+    with `extra`, meant to be handed to the child directly so concurrent runs
+    never see each other's variables.
+    """
+
+    env = dict(os.environ if base is None else base)
+    env.update(extra)
+    return types.MappingProxyType(env)
 
 
 @contextlib.contextmanager
 def env(**new):
     """
     Execute this context within a given (clean, modified) environment.
+
+    This patches the process-wide `os.environ` and is therefore not safe to use
+    with concurrent runs, prefer passing an `environ()` to the child instead.
     """
 
     # take a snapshot of the variables affected by the new context
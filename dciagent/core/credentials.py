@@ -0,0 +1,175 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Reading of the DCI authentication files (i.e. dcirc.sh).
+
+Authentication files are shell scripts, but in practice they are a list of
+`export DCI_X=value` lines. Those are parsed in-process, only falling back to
+sourcing the file with `/bin/sh` when it contains anything else. Results are
+cached by path, mtime and size, so repeated runs do not read the file again.
+"""
+
+import asyncio
+import os
+import re
+import subprocess
+import threading
+
+_ASSIGN = re.compile(r"^(export\s+)?([A-Za-z_][A-Za-z0-9_]*)=(.*)$")
+_EXPORT = re.compile(r"^export\s+([A-Za-z_][A-Za-z0-9_]*)$")
+_VALUE = re.compile(
+    r"""^(?:'([^']*)'|"([^"$`\\]*)"|([^\s'"$`\\;&|<>(){}~]*))(?:\s+#.*)?$"""
+)
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def parse(text):
+    """
+    Parse the trivial form of an authentication file into a dictionary.
+
+    Only the exported `DCI_*` variables are returned, like sourcing the file
+    and running `env` would. Raise `ValueError` on anything that would need a
+    shell to be evaluated, e.g. expansions, escapes or control structures.
+    """
+
+    values = {}
+    exported = set()
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+
+        m = _EXPORT.match(line)
+        if m is not None:
+            exported.add(m.group(1))
+            continue
+
+        m = _ASSIGN.match(line)
+        if m is None:
+            raise ValueError("Cannot parse line: {}".format(line))
+        export, key, value = m.groups()
+
+        v = _VALUE.match(value)
+        if v is None:
+            raise ValueError("Cannot parse value of {}".format(key))
+        values[key] = next(g for g in v.groups() if g is not None)
+        if export:
+            exported.add(key)
+
+    return {k: v for k, v in values.items() if k in exported and k.startswith("DCI_")}
+
+
+def _parse_env(data):
+    """
+    Return the DCI variables from an `env` output as a dictionary.
+    """
+
+    env = {}
+    for line in data.splitlines():
+        if line.startswith("DCI_"):
+            k, v = line.split("=", 1)
+            env[k] = v
+
+    return env
+
+
+def _command(path):
+    return ". {}; env".format(path)
+
+
+def _shell(path):
+    """
+    Source the file with a shell in a clean environment.
+    """
+
+    pipe = subprocess.Popen(
+        _command(path),
+        stdout=subprocess.PIPE,
+        shell=True,
+        env={},  # start with a clean environment
+        universal_newlines=True,
+    )
+    return _parse_env(pipe.communicate()[0])
+
+
+async def _shell_async(path):
+    """
+    Source the file with a shell in a clean environment, without blocking.
+    """
+
+    # not an asyncio subprocess: with python < 3.8 the child watcher is only
+    # attached to the loop of the main thread
+    return await asyncio.get_event_loop().run_in_executor(None, _shell, path)
+
+
+def _lookup(path):
+    """
+    Return `(key, credentials)` from the cache or the native parser.
+
+    Credentials are `None` when the file has to be sourced by a shell, and the
+    key is `None` when the file cannot be stat'ed, i.e. should not be cached.
+    """
+
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None, None
+
+    key = (os.path.realpath(path), st.st_mtime_ns, st.st_size)
+    with _lock:
+        if key in _cache:
+            return key, dict(_cache[key])
+
+    try:
+        with open(path) as f:
+            return key, parse(f.read())
+    except (OSError, ValueError):
+        return key, None
+
+
+def _store(key, creds):
+    if key is not None:
+        with _lock:
+            # only keep the latest version of each file
+            for k in [k for k in _cache if k[0] == key[0]]:
+                del _cache[k]
+            _cache[key] = dict(creds)
+
+    return creds
+
+
+def read(path):
+    """
+    Read an authentication file and return its DCI variables as a dictionary.
+    """
+
+    key, creds = _lookup(path)
+    if creds is None:
+        creds = _shell(path)
+
+    return _store(key, creds)
+
+
+async def read_async(path):
+    """
+    Read an authentication file without blocking the event loop.
+    """
+
+    key, creds = _lookup(path)
+    if creds is None:
+        creds = await _shell_async(path)
+
+    return _store(key, creds)
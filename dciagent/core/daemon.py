@@ -0,0 +1,210 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Warm agent daemon.
+
+`dci-agent-ctl serve` keeps every discovered agent imported (and the
+credentials cached, see `dciagent.core.credentials`) and accepts jobs over a
+local Unix socket, so frequent callers do not pay the start-up cost each time.
+
+The protocol is JSON lines: the client sends one `{"agent": name, "argv": []}`
+request, the server answers with `{"stream": ..., "text": ...}` messages for
+every line of output and a final `{"rc": ...}` message. The client side lives
+in `dciagent.core.client`. The job is cancelled, terminating its children,
+when the client disconnects. A slow client slows the job down rather than
+growing the buffers of the daemon.
+
+Jobs run in the working directory and the environment of the daemon, not of
+the client: relative paths and the defaults read from environment variables
+are resolved on the daemon side.
+"""
+
+import asyncio
+import contextlib
+import io
+import json
+import os
+
+import dciagent.core.client as client
+import dciagent.core.stream as stream
+
+
+class Forward(stream.Consumer):
+    """
+    Send the lines of output to a client connection.
+    """
+
+    def __init__(self, writer):
+        self.writer = writer
+
+    def __call__(self, line):
+        """
+        Write the line as a JSON message to the client.
+        """
+
+        if self.writer.transport.is_closing():
+            return  # disconnected, the job is being cancelled
+        self.writer.write(
+            client.encode({"stream": line.stream, "text": line.text, "time": line.time})
+        )
+
+    async def drain_async(self):
+        """
+        Wait for the client to read what was sent.
+        """
+
+        with contextlib.suppress(ConnectionError):
+            await self.writer.drain()
+
+
+class Server(object):
+    """
+    Accept job submissions on a Unix socket and run them concurrently.
+
+    `agents` maps the agent names to their `Agent` classes.
+    """
+
+    def __init__(self, agents, path=None):
+        self.agents = agents
+        self.path = path if path is not None else client.socket_path()
+        self.server = None
+        self.jobs = set()
+
+    async def start(self):
+        """
+        Start listening on the socket, replacing any stale one.
+        """
+
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self.path)
+        self.server = await asyncio.start_unix_server(self.handle, path=self.path)
+        os.chmod(self.path, 0o600)
+
+    async def cancel(self):
+        """
+        Cancel the running jobs, terminating their children.
+        """
+
+        for job in self.jobs:
+            job.cancel()
+        await asyncio.gather(*self.jobs, return_exceptions=True)
+
+    def close(self):
+        """
+        Stop listening and remove the socket.
+        """
+
+        if self.server is not None:
+            self.server.close()
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self.path)
+
+    async def handle(self, reader, writer):
+        """
+        Serve a single job submission.
+        """
+
+        try:
+            request = json.loads((await reader.readline()).decode())
+            job = asyncio.ensure_future(self.run(request, writer))
+            self.jobs.add(job)
+            watch = asyncio.ensure_future(self._watch(reader, job))
+            try:
+                rc = await job
+            except asyncio.CancelledError:
+                if not watch.done():
+                    raise  # the daemon is cancelling its jobs
+                writer.close()
+                return
+            finally:
+                self.jobs.discard(job)
+                watch.cancel()
+        except Exception as e:
+            writer.write(client.encode({"stream": "stderr", "text": repr(e)}))
+            rc = 1
+
+        writer.write(client.encode({"rc": rc}))
+        with contextlib.suppress(ConnectionError):
+            await writer.drain()
+        writer.close()
+
+    async def _watch(self, reader, job):
+        """
+        Cancel the job once the client disconnects.
+        """
+
+        # the client sends nothing after its request
+        with contextlib.suppress(ConnectionError):
+            while await reader.read(4096):
+                pass
+        job.cancel()
+
+    async def run(self, request, writer):
+        """
+        Run the requested agent, forwarding its output, and return its rc.
+        """
+
+        cls = self.agents.get(request.get("agent"))
+        if cls is None:
+            writer.write(
+                client.encode(
+                    {
+                        "stream": "stderr",
+                        "text": "Unknown agent {}".format(request.get("agent")),
+                    }
+                )
+            )
+            return 2
+
+        agent = cls()
+        # a slow terminal would stall all the jobs, the client gets the output
+        agent.echo = False
+        agent.extra_consumers.append(Forward(writer))
+
+        # argparse reports to the terminal, the loop runs nothing else
+        # meanwhile so the redirection only captures this job
+        out = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(out), contextlib.redirect_stderr(out):
+                args = agent.cli(request.get("argv", []))
+        except SystemExit as e:
+            name = "stdout" if not e.code else "stderr"  # --help or usage error
+            for text in out.getvalue().splitlines():
+                writer.write(client.encode({"stream": name, "text": text}))
+            return e.code if isinstance(e.code, int) else 1
+
+        return await agent.run_async(args)
+
+
+def serve(agents, path=None):
+    """
+    Run the daemon until interrupted.
+    """
+
+    server = Server(agents, path)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)  # see stream.run()
+    try:
+        loop.run_until_complete(server.start())
+        print("Listening on {}".format(server.path))
+        loop.run_forever()
+    except KeyboardInterrupt:
+        # the children run in their own sessions, ^C did not reach them
+        loop.run_until_complete(server.cancel())
+    finally:
+        server.close()
+        asyncio.set_event_loop(None)
+        loop.close()
+
+    return 0
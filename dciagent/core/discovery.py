@@ -0,0 +1,268 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Agent discovery with a persisted manifest.
+
+Walking the `dciagent.agents` namespace requires importing every agent module
+to find out its arguments, which gets expensive with many agents installed.
+The result of that walk is stored in a JSON manifest keyed by the agent module
+file stamps (mtime and size), so subsequent calls can build the command line
+without importing anything but the selected agent.
+"""
+
+import contextlib
+import importlib
+import json
+import os
+import pkgutil
+import sys
+
+import dciagent.core.agent as agent
+import dciagent.core.context as ctx
+
+MANIFEST_VERSION = 1
+
+_TYPES = {t.__name__: t for t in (int, float, bool, str)}
+_FIELDS = (
+    "help",
+    "short",
+    "long",
+    "action",
+    "default",
+    "env",
+    "type",
+    "nargs",
+    "dest",
+    "metavar",
+)
+
+
+def manifest_path():
+    """
+    Return the path to the discovery manifest.
+    """
+
+    return ctx.cache_dir("agents.json")
+
+
+def _stamp(path):
+    """
+    Return a cheap fingerprint of a file, used to invalidate cached entries.
+    """
+
+    st = os.stat(path)
+    return [st.st_mtime_ns, st.st_size]
+
+
+def _framework():
+    """
+    Fingerprint the framework modules agents inherit their arguments from.
+    """
+
+    core = os.path.dirname(os.path.abspath(__file__))
+    stamps = {"python": sys.version}
+    for root in (core, os.path.join(core, "agent")):
+        for name in sorted(os.listdir(root)):
+            if name.endswith(".py"):
+                path = os.path.join(root, name)
+                stamps[path] = _stamp(path)
+
+    return stamps
+
+
+def _origin(finder, name):
+    """
+    Return the file a module would be loaded from, without importing it.
+    """
+
+    try:
+        spec = finder.find_spec(name)
+    except (AttributeError, ImportError):
+        return None
+
+    if spec is None or not spec.has_location:
+        return None
+
+    return spec.origin
+
+
+def _serialize(argument):
+    """
+    Return an `Argument` as a JSON-friendly dictionary.
+
+    Raise `TypeError` if the argument cannot survive a JSON round-trip, e.g.
+    custom types or actions, in which case the agent is never cached.
+    """
+
+    spec = {k: getattr(argument, k) for k in _FIELDS}
+    if argument.type is not None:
+        if _TYPES.get(getattr(argument.type, "__name__", None)) is not argument.type:
+            raise TypeError("Cannot serialize argument type {}".format(argument.type))
+        spec["type"] = argument.type.__name__
+
+    if json.loads(json.dumps(spec)) != spec:
+        raise TypeError("Cannot serialize argument {}".format(argument.help))
+
+    return spec
+
+
+def _deserialize(spec):
+    """
+    Rebuild an `Argument` from its serialized form.
+    """
+
+    spec = dict(spec)
+    if spec["type"] is not None:
+        spec["type"] = _TYPES[spec["type"]]
+
+    return agent.Argument(**spec)
+
+
+def _inspect(name):
+    """
+    Import an agent module and describe it.
+    """
+
+    import dciagent.core.agent.base as base
+
+    mod = importlib.import_module(name)
+    cls = getattr(mod, "Agent", None)
+    if not isinstance(cls, type) or not issubclass(cls, base.Agent):
+        return {"agent": False}
+
+    try:
+        arguments = [_serialize(e) for e in cls._args()]
+    except TypeError:
+        arguments = None
+
+    return {
+        "agent": True,
+        "help": cls.__doc__,
+        "description": mod.__doc__,
+        "arguments": arguments,
+    }
+
+
+def _load_manifest(path):
+    """
+    Read the manifest, returning an empty one if missing or corrupted.
+    """
+
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_manifest(path, manifest):
+    """
+    Atomically write the manifest, failing silently on read-only homes.
+    """
+
+    import tempfile  # only when the manifest changed, slow to import
+
+    try:
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        # unique, threads of a process may rediscover concurrently
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    except OSError:
+        return
+
+    try:
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(manifest, f)
+            os.replace(tmp, path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.unlink(tmp)
+            raise
+    except OSError:
+        pass
+
+
+def discover(namespace, path=None):
+    """
+    Return a dictionary describing every agent found in the namespace.
+
+    Keys are the fully qualified module names and values contain the `help`,
+    `description` and serialized `arguments` of each agent. Only modules whose
+    file changed since the manifest was last written are imported.
+    """
+
+    if path is None:
+        path = manifest_path()
+
+    framework = _framework()
+    manifest = _load_manifest(path)
+    cached = {}
+    if (
+        manifest.get("version") == MANIFEST_VERSION
+        and manifest.get("framework") == framework
+    ):
+        cached = manifest.get("modules", {})
+
+    modules = {}
+    dirty = False
+    for finder, name, ispkg in pkgutil.iter_modules(
+        namespace.__path__, namespace.__name__ + "."
+    ):
+        origin = _origin(finder, name)
+        stamp = _stamp(origin) if origin is not None else None
+        entry = cached.get(name)
+        if (
+            stamp is None
+            or entry is None
+            or entry.get("origin") != origin
+            or entry.get("stamp") != stamp
+        ):
+            entry = _inspect(name)
+            entry.update({"origin": origin, "stamp": stamp})
+            dirty = dirty or stamp is not None
+        modules[name] = entry
+
+    if dirty or modules.keys() != cached.keys():
+        _save_manifest(
+            path,
+            {
+                "version": MANIFEST_VERSION,
+                "framework": framework,
+                "modules": modules,
+            },
+        )
+
+    return {name: entry for name, entry in modules.items() if entry["agent"]}
+
+
+def arguments(name, entry):
+    """
+    Return the `Argument` list for a discovered agent.
+
+    Agents whose arguments could not be serialized are imported instead.
+    """
+
+    if entry["arguments"] is None:
+        return load(name)._args()
+
+    return [_deserialize(spec) for spec in entry["arguments"]]
+
+
+def load(name):
+    """
+    Import an agent module and return its `Agent` class.
+    """
+
+    return importlib.import_module(name).Agent
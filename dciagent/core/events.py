@@ -0,0 +1,192 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Structured events of a playbook run, sent live by the bundled callback plugin.
+
+The `dciagent_events` plugin (in `dciagent/core/callback`) connects to a Unix
+socket of the agent and writes one compact JSON object per line. Every event
+is a dict with the `event` name and its `time`, and depending on the event:
+
+- `playbook_start`: `playbook`
+- `play_start`: `play`
+- `task_start`: `task`
+- `result`: `task`, `host`, `status` (ok, changed, failed, ignored,
+  unreachable or skipped), `duration` and `message` for failures
+- `task_end`: `task`, `duration`
+- `playbook_end`: `duration`, `stats` per host as in the PLAY RECAP
+
+Events of sharded runs also get the shard `tag`.
+"""
+
+import asyncio
+import collections
+import json
+import os
+
+import dciagent.core.tuning as tuning
+
+PLUGIN = "dciagent_events"
+PLUGIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "callback")
+
+# search path of ansible, lost once overridden in the environment
+DEFAULT_CALLBACK_PLUGINS = (
+    "~/.ansible/plugins/callback:/usr/share/ansible/plugins/callback"
+)
+
+# the stats of playbook_end grow with the inventory
+LIMIT = 64 * 1024 * 1024
+# how long to wait for the plugin connections to be drained once done
+DRAIN_TIMEOUT = 5
+
+
+def _configured(parser, environ, names, option_names, relative_to=None):
+    """
+    Return the list value set in the environment or `ansible.cfg`, or `None`.
+
+    Relative paths from `ansible.cfg` are made relative to `relative_to`.
+    """
+
+    for name in names:
+        if environ.get(name):
+            return environ[name]
+    for option in option_names:
+        value = parser.get("defaults", option, fallback=None)
+        if value:
+            if relative_to is None:
+                return value
+            return ":".join(
+                os.path.join(relative_to, os.path.expanduser(p))
+                for p in value.split(":")
+            )
+
+    return None
+
+
+def environment(config, environ):
+    """
+    Return the ansible environment variables enabling the plugin.
+
+    The callbacks already configured in `environ` or in `ansible.cfg` at
+    `config` are kept enabled.
+    """
+
+    parser = tuning.read_config(config)
+    paths = _configured(
+        parser,
+        environ,
+        ["ANSIBLE_CALLBACK_PLUGINS"],
+        ["callback_plugins"],
+        os.path.dirname(os.path.abspath(config)) if config else None,
+    )
+    paths = (paths or DEFAULT_CALLBACK_PLUGINS).split(":")
+    if PLUGIN_DIR not in paths:
+        paths.insert(0, PLUGIN_DIR)
+
+    enabled = _configured(
+        parser,
+        environ,
+        ["ANSIBLE_CALLBACKS_ENABLED", "ANSIBLE_CALLBACK_WHITELIST"],
+        ["callbacks_enabled", "callback_whitelist"],
+    )
+    names = [n.strip() for n in (enabled or "").split(",") if n.strip()]
+    if PLUGIN not in names:
+        names.append(PLUGIN)
+
+    return {
+        "ANSIBLE_CALLBACK_PLUGINS": ":".join(paths),
+        "ANSIBLE_CALLBACKS_ENABLED": ",".join(names),
+        # ansible < 2.11
+        "ANSIBLE_CALLBACK_WHITELIST": ",".join(names),
+    }
+
+
+class Stream(object):
+    """
+    In-process stream of the events of a run.
+
+    Listeners are called with every event, in order, from the event loop: they
+    must not block. The stream also keeps the number of host results per
+    status.
+    """
+
+    def __init__(self):
+        self.listeners = []
+        self.results = collections.Counter()
+        self.server = None
+        # connection done future: its writer
+        self.connections = {}
+
+    def subscribe(self, listener):
+        """
+        Call `listener` with every event from now on.
+        """
+
+        self.listeners.append(listener)
+
+    def dispatch(self, event):
+        """
+        Feed an event to the listeners.
+        """
+
+        if event.get("event") == "result":
+            self.results[event.get("status")] += 1
+        for listener in self.listeners:
+            listener(event)
+
+    async def _handle(self, reader, writer):
+        done = asyncio.get_event_loop().create_future()
+        self.connections[done] = writer
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    continue  # over the limit, skipped
+                if not line:
+                    break
+                try:
+                    event = json.loads(line.decode("utf-8", errors="replace"))
+                except ValueError:
+                    continue
+                if isinstance(event, dict):
+                    self.dispatch(event)
+        finally:
+            writer.close()
+            self.connections.pop(done, None)
+            done.set_result(None)
+
+    async def listen(self, path):
+        """
+        Receive the events of the plugins connecting to the socket `path`.
+        """
+
+        self.server = await asyncio.start_unix_server(
+            self._handle, path=path, limit=LIMIT
+        )
+
+    async def close(self):
+        """
+        Stop listening once the connected plugins are done.
+        """
+
+        if self.server is None:
+            return
+        self.server.close()
+        if self.connections:
+            # the playbooks exited, what they sent is still to be read
+            await asyncio.wait(list(self.connections), timeout=DRAIN_TIMEOUT)
+        for writer in self.connections.values():
+            writer.close()  # e.g. held open by a leftover process
+        await self.server.wait_closed()
+        self.server = None
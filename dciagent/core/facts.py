@@ -0,0 +1,90 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Persistent fact cache managed by the agents.
+
+Facts are kept by the `jsonfile` cache plugin, one file per host, in a
+directory of the user cache per namespace (e.g. the DCI prefix), so agents
+targeting different labs never share facts. With the `smart` gathering policy,
+plays skip gathering the facts of the hosts found in the cache.
+
+The configuration goes through environment variables, which take precedence
+over `ansible.cfg`. Settings the user configured explicitly are left alone,
+another cache plugin taking its connection and timeout along.
+"""
+
+import os
+import time
+
+import dciagent.core.context as ctx
+
+
+def directory(namespace):
+    """
+    Return the fact cache directory of a namespace.
+    """
+
+    return ctx.cache_dir("facts", namespace or "default")
+
+
+def environment(path, timeout, configured=()):
+    """
+    Return the ansible environment variables using the fact cache in `path`.
+
+    The settings in `configured`, see `dciagent.core.tuning.explicit()`, are
+    not overridden.
+    """
+
+    env = {
+        "ANSIBLE_GATHERING": "smart",
+        "ANSIBLE_CACHE_PLUGIN": "jsonfile",
+        "ANSIBLE_CACHE_PLUGIN_CONNECTION": path,
+        "ANSIBLE_CACHE_PLUGIN_TIMEOUT": str(timeout),
+    }
+    if "ANSIBLE_CACHE_PLUGIN" in configured:
+        # e.g. redis, the connection and timeout are its own
+        del env["ANSIBLE_CACHE_PLUGIN_CONNECTION"]
+        del env["ANSIBLE_CACHE_PLUGIN_TIMEOUT"]
+
+    return {k: v for k, v in env.items() if k not in configured}
+
+
+def evict(path, timeout, max_bytes):
+    """
+    Remove the expired facts, then the oldest ones beyond `max_bytes`.
+
+    A `max_bytes` of 0 means no limit. Return the number of files removed.
+    """
+
+    try:
+        entries = [(e.stat(), e.path) for e in os.scandir(path) if e.is_file()]
+    except FileNotFoundError:
+        return 0
+    entries.sort(key=lambda e: e[0].st_mtime, reverse=True)
+
+    now = time.time()
+    total = 0
+    removed = 0
+    for st, p in entries:
+        total += st.st_size
+        expired = timeout > 0 and now - st.st_mtime > timeout
+        if expired or (max_bytes and total > max_bytes):
+            try:
+                os.unlink(p)
+                removed += 1
+            except FileNotFoundError:
+                pass
+            total -= st.st_size
+
+    return removed
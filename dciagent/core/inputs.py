@@ -0,0 +1,207 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Digest of the inputs of a run, to skip the runs identical to the last success.
+
+The digest covers the content of the input files, directories being walked
+recursively (hidden entries, logs and retry files skipped), and a description
+of the run such as its command line and environment.
+
+The hashes of the files are cached with their size, mtime and inode, so only
+the files changed since the previous run are read again, by a pool of threads.
+Files modified in the last couple of seconds are not cached, their mtime could
+still change within its granularity.
+"""
+
+import concurrent.futures
+import hashlib
+import json
+import os
+import stat
+import time
+
+import dciagent.core.context as ctx
+
+IGNORED_SUFFIXES = (".log", ".pyc", ".retry", ".swp")
+# files modified more recently than this are hashed again next time
+RACY = 2
+CHUNK_SIZE = 1024 * 1024
+
+
+def walk(paths):
+    """
+    Return the sorted input files found in `paths`, files or directories.
+
+    Missing paths are returned as well, they are part of the inputs too.
+    """
+
+    found = set()
+    for path in paths:
+        path = os.path.abspath(path)
+        if not os.path.isdir(path):
+            found.add(path)
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs[:] = [d for d in dirs if not d.startswith(".") and d != "__pycache__"]
+            for name in files:
+                if not name.startswith(".") and not name.endswith(IGNORED_SUFFIXES):
+                    found.add(os.path.join(root, name))
+
+    return sorted(found)
+
+
+def _sha256(path):
+    h = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                h.update(chunk)
+    except OSError:
+        return None  # removed meanwhile
+
+    return h.hexdigest()
+
+
+class HashCache(object):
+    """
+    File hashes cached in the JSON file `path`.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path) as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def hashes(self, files, workers=None):
+        """
+        Return the hash of every file, `None` for the missing ones.
+
+        Only the entries of `files` are kept in the cache.
+        """
+
+        now = time.time()
+        entries = {}
+        result = {}
+        todo = {}
+        for path in files:
+            try:
+                st = os.stat(path)
+            except OSError:
+                st = None
+            if st is None or not stat.S_ISREG(st.st_mode):
+                result[path] = None
+                continue
+            key = [st.st_size, st.st_mtime_ns, st.st_ino]
+            cached = self.entries.get(path)
+            if cached is not None and cached[:3] == key:
+                result[path] = cached[3]
+                entries[path] = cached
+            else:
+                todo[path] = (key, now - st.st_mtime < RACY)
+
+        if todo:
+            with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+                for path, digest in zip(todo, pool.map(_sha256, todo)):
+                    key, racy = todo[path]
+                    result[path] = digest
+                    if digest is not None and not racy:
+                        entries[path] = key + [digest]
+
+        self.entries = entries
+        return result
+
+    def save(self):
+        """
+        Atomically write the cache.
+        """
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = "{}.{}".format(self.path, os.getpid())
+        with open(tmp, "w") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp, self.path)
+
+
+def digest(paths, description, cache=None):
+    """
+    Return the digest of the files in `paths` and the run `description`.
+
+    The description is any JSON serializable value, the file hashes are
+    cached in `cache` (a `HashCache`) if given.
+    """
+
+    files = walk(paths)
+    if cache is None:
+        hashes = {
+            path: _sha256(path) if os.path.isfile(path) else None for path in files
+        }
+    else:
+        hashes = cache.hashes(files)
+
+    h = hashlib.sha256(json.dumps(description, sort_keys=True).encode())
+    for path in files:
+        h.update("{}\0{}\0".format(path, hashes[path]).encode())
+
+    return h.hexdigest()
+
+
+def state_path(*identity):
+    """
+    Return the directory of the input state of a run identity, e.g. an agent.
+    """
+
+    key = hashlib.sha256(json.dumps(identity).encode()).hexdigest()[:16]
+    return ctx.cache_dir("inputs", key)
+
+
+def last_success(state):
+    """
+    Return the record of the last successful run in `state`, if any.
+    """
+
+    try:
+        with open(os.path.join(state, "success.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def record_success(state, digest, duration):
+    """
+    Record a successful run with the given input digest.
+    """
+
+    os.makedirs(state, exist_ok=True)
+    path = os.path.join(state, "success.json")
+    tmp = "{}.{}".format(path, os.getpid())
+    with open(tmp, "w") as f:
+        json.dump({"digest": digest, "time": time.time(), "duration": duration}, f)
+    os.replace(tmp, path)
+
+
+def unchanged(state, digest, ttl):
+    """
+    Return the last success with the same `digest` less than `ttl` ago, if any.
+    """
+
+    last = last_success(state)
+    if last is None or last.get("digest") != digest:
+        return None
+    if time.time() - last.get("time", 0) >= ttl:
+        return None
+
+    return last
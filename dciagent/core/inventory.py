@@ -0,0 +1,99 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Cache of resolved inventories.
+
+Dynamic inventories (scripts or plugins) can take a while to resolve. The
+output of `ansible-inventory --list --export` is converted into a static
+inventory, in the format of the `yaml` inventory plugin (JSON being valid
+YAML), and stored in the user cache keyed by the content of the inventory
+file. Until it expires, `ansible-playbook` is handed the static inventory.
+"""
+
+import hashlib
+import json
+import os
+import time
+
+import dciagent.core.context as ctx
+
+
+def path(inventory):
+    """
+    Return the path of the cached static version of an inventory file.
+    """
+
+    h = hashlib.sha256(os.path.realpath(inventory).encode())
+    with open(inventory, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+
+    return ctx.cache_dir("inventory", "{}.json".format(h.hexdigest()))
+
+
+def fresh(cached, ttl):
+    """
+    Return whether the cached inventory exists and is younger than `ttl`.
+    """
+
+    try:
+        return time.time() - os.stat(cached).st_mtime < ttl
+    except FileNotFoundError:
+        return False
+
+
+def static(data):
+    """
+    Convert the output of `ansible-inventory --list --export` to a static one.
+    """
+
+    hostvars = data.get("_meta", {}).get("hostvars", {})
+    seen = set()
+    groups = {}
+    for name, group in data.items():
+        if name == "_meta":
+            continue
+        g = {}
+        if group.get("hosts"):
+            g["hosts"] = {}
+            for host in group["hosts"]:
+                # the variables only need to be set once per host
+                g["hosts"][host] = hostvars.get(host) if host not in seen else None
+                seen.add(host)
+        if group.get("vars"):
+            g["vars"] = group["vars"]
+        if group.get("children"):
+            g["children"] = {child: None for child in group["children"]}
+        groups[name] = g
+
+    return groups
+
+
+def store(cached, data):
+    """
+    Atomically write the static version of `data` to `cached`.
+
+    The hostvars may hold secrets, e.g. `ansible_password`: the file is only
+    readable by the user, in a private directory.
+    """
+
+    directory = os.path.dirname(cached)
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    os.chmod(directory, 0o700)
+    tmp = "{}.{}".format(cached, os.getpid())
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        os.fchmod(fd, 0o600)  # left over by a killed agent
+        json.dump(static(data), f)
+    os.replace(tmp, cached)
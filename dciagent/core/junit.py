@@ -0,0 +1,169 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Aggregation of JUnit XML reports.
+
+Reports are parsed incrementally: every test case is summarized and dropped as
+soon as its closing tag is read, so memory does not depend on the size or the
+number of the reports, only on the size of the biggest single test case.
+"""
+
+import heapq
+import json
+import os
+import xml.etree.ElementTree as ET
+
+
+class Summary(object):
+    """
+    Totals, slowest test cases and failures of a set of JUnit reports.
+
+    Only the `slowest` longest test cases and the first `max_failures`
+    failures are kept, with their messages truncated to `max_message`
+    characters.
+    """
+
+    def __init__(self, slowest=10, max_failures=100, max_message=1024):
+        self.slowest = slowest
+        self.max_failures = max_failures
+        self.max_message = max_message
+        self.files = 0
+        self.invalid = []
+        self.totals = dict.fromkeys(("tests", "failures", "errors", "skipped"), 0)
+        self.time = 0.0
+        self._slowest = []
+        self._order = 0
+        self.failures = []
+
+    def add(self, path):
+        """
+        Parse a JUnit report and add its test cases to the summary.
+
+        Reports that cannot be parsed are recorded in `self.invalid`, the test
+        cases read until the error are kept.
+        """
+
+        self.files += 1
+        stack = []
+        try:
+            for event, elem in ET.iterparse(path, events=("start", "end")):
+                if event == "start":
+                    stack.append(elem)
+                    continue
+                stack.pop()
+                if elem.tag == "testcase":
+                    self._testcase(elem)
+                    # drop the test case from the tree as well
+                    elem.clear()
+                    if stack:
+                        stack[-1].remove(elem)
+        except ET.ParseError as e:
+            self.invalid.append({"file": path, "error": str(e)})
+
+    def _testcase(self, elem):
+        try:
+            duration = float(elem.get("time") or 0)
+        except ValueError:
+            duration = 0.0
+        name = elem.get("name", "")
+        classname = elem.get("classname", "")
+        self.totals["tests"] += 1
+        self.time += duration
+
+        # keep a min-heap of the slowest cases, the order breaks ties
+        self._order += 1
+        case = (duration, -self._order, classname, name)
+        if len(self._slowest) < self.slowest:
+            heapq.heappush(self._slowest, case)
+        elif self._slowest and case > self._slowest[0]:
+            heapq.heapreplace(self._slowest, case)
+
+        for child in elem:
+            if child.tag == "failure":
+                kind = "failures"
+            elif child.tag == "error":
+                kind = "errors"
+            elif child.tag == "skipped":
+                self.totals["skipped"] += 1
+                break
+            else:
+                continue
+            self.totals[kind] += 1
+            if len(self.failures) < self.max_failures:
+                message = child.get("message") or (child.text or "").strip()
+                self.failures.append(
+                    {
+                        "classname": classname,
+                        "name": name,
+                        "kind": kind,
+                        "type": child.get("type"),
+                        "message": message[: self.max_message],
+                    }
+                )
+            break
+
+    def to_dict(self):
+        """
+        Return the summary as a JSON serializable dictionary.
+        """
+
+        slowest = sorted(self._slowest, reverse=True)
+        return {
+            "files": self.files,
+            "invalid": self.invalid,
+            "totals": dict(self.totals, time=round(self.time, 3)),
+            "slowest": [
+                {"classname": c, "name": n, "time": t} for t, _, c, n in slowest
+            ],
+            "failures": self.failures,
+        }
+
+
+def reports(directory):
+    """
+    Return the paths of the XML reports found below `directory`, sorted.
+    """
+
+    paths = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        paths.extend(os.path.join(root, f) for f in sorted(files) if f.endswith(".xml"))
+
+    return paths
+
+
+def summarize(paths, **kwargs):
+    """
+    Return the `Summary` of the given reports.
+
+    Keyword arguments are passed as-is to `Summary`.
+    """
+
+    summary = Summary(**kwargs)
+    for path in paths:
+        summary.add(path)
+
+    return summary
+
+
+def write(summary, path):
+    """
+    Atomically write a summary as JSON to `path`.
+    """
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = "{}.{}".format(path, os.getpid())
+    with open(tmp, "w") as f:
+        json.dump(summary.to_dict(), f, indent=2)
+    os.replace(tmp, path)
@@ -0,0 +1,356 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Live progress of a playbook run, read from its `ANSIBLE_LOG_PATH`.
+
+The log is followed incrementally: every poll only reads what was appended
+since the previous one. Lines are parsed for the PLAY/TASK boundaries and the
+per-host results, everything else (e.g. the verbose output of modules) is
+skipped after a couple of character comparisons.
+
+The duration of every task is recorded per playbook in the user cache, so the
+next run of the same playbook gets an ETA.
+"""
+
+import asyncio
+import datetime
+import hashlib
+import json
+import os
+import time
+
+import dciagent.core.context as ctx
+import dciagent.core.stream as stream
+
+# worst status first, a host gets the worst of its results within a task
+STATUSES = ("failed", "unreachable", "changed", "ok", "skipped", "ignored")
+
+_RESULTS = {
+    "ok": "ok",
+    "changed": "changed",
+    "skipping": "skipped",
+    "failed": "failed",
+    "fatal": "failed",
+}
+
+
+class Follower(object):
+    """
+    Read the complete lines appended to a file since the previous call.
+
+    The file is kept open, so it can still be read to the end once removed
+    (e.g. a shard log merged into the main one). A truncated file is read
+    again from the start.
+    """
+
+    def __init__(self, path, chunk_size=1024 * 1024):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.fd = None
+        self.offset = 0
+        self.pending = b""
+
+    def lines(self):
+        """
+        Yield the new lines, one chunk at a time.
+        """
+
+        if self.fd is None:
+            try:
+                self.fd = os.open(self.path, os.O_RDONLY)
+            except FileNotFoundError:
+                return
+
+        size = os.fstat(self.fd).st_size
+        if size < self.offset:
+            self.offset = 0
+            self.pending = b""
+
+        while self.offset < size:
+            data = os.pread(
+                self.fd, min(self.chunk_size, size - self.offset), self.offset
+            )
+            if not data:
+                break
+            self.offset += len(data)
+            lines = (self.pending + data).split(b"\n")
+            self.pending = lines.pop()
+            for line in lines:
+                yield line.decode("utf-8", "replace")
+
+    def close(self):
+        """
+        Close the file.
+        """
+
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def _timestamp(line):
+    """
+    Return the time of an ansible log line, or now if it cannot be parsed.
+    """
+
+    try:
+        return datetime.datetime.strptime(line[:23], "%Y-%m-%d %H:%M:%S,%f").timestamp()
+    except ValueError:
+        return time.time()
+
+
+class Progress(object):
+    """
+    Track the progress of a playbook from the lines of its ansible log.
+
+    `history` lists the `(task, duration)` of a previous run of the same
+    playbook and is used to estimate the remaining time.
+    """
+
+    def __init__(self, history=()):
+        self.play = None
+        self.task = None
+        self.started = None
+        self.hosts = {}
+        self.counts = dict.fromkeys(STATUSES, 0)
+        self.tasks = []
+        self.finished = False
+        self.recorded = False
+        self.history = [(str(name), float(d)) for name, d in history]
+        # remaining[i] is the expected duration from the i-th task to the end
+        self.remaining = [0.0] * (len(self.history) + 1)
+        for i in reversed(range(len(self.history))):
+            self.remaining[i] = self.remaining[i + 1] + self.history[i][1]
+        self.position = None
+        self._last = None
+
+    def feed(self, line):
+        """
+        Update the progress with one line of the log.
+        """
+
+        # '<date> <time>,<ms> p=<pid> u=<user> n=<name> | <message>', with
+        # ansible-core >= 2.17 '... n=<name> <level>| <message>', the other
+        # lines are continuations of multi-line messages
+        if line[23:26] != " p=":
+            return
+        i = line.find("| ", 26)
+        if i < 0:
+            return
+        text = line[i + 2 :]
+
+        c = text[:1]
+        if c == "T" and text.startswith("TASK ["):
+            self._end(_timestamp(line))
+            self._start(text[6 : text.rfind("]")], _timestamp(line))
+        elif c == "P" and text.startswith("PLAY "):
+            self._end(_timestamp(line))
+            if text.startswith("PLAY RECAP"):
+                self.finished = True
+                self.recorded = True
+            else:
+                if self.finished:
+                    # the playbook runs again, e.g. on the failed hosts
+                    self.finished = False
+                    self.position = None
+                self.play = text[6 : text.rfind("]")]
+        elif c == "." and text.startswith("...ignoring") and self._last:
+            self.hosts[self._last] = "ignored"
+        elif self.task is not None and c in "ocsf":
+            colon = text.find(": [")
+            status = _RESULTS.get(text[:colon]) if colon > 0 else None
+            if status is not None:
+                host = text[colon + 3 : text.find("]", colon)]
+                if status == "failed" and "UNREACHABLE!" in text[colon:]:
+                    status = "unreachable"
+                previous = self.hosts.get(host)
+                if previous is None or STATUSES.index(status) < STATUSES.index(
+                    previous
+                ):
+                    self.hosts[host] = status
+                self._last = host
+
+    def _start(self, name, stamp):
+        self.task = name
+        self.started = stamp
+        # look for the task in the previous run, ahead of the last match
+        start = 0 if self.position is None else self.position + 1
+        for i in range(start, len(self.history)):
+            if self.history[i][0] == name:
+                self.position = i
+                break
+
+    def _end(self, stamp):
+        if self.task is None:
+            return
+        for status in self.hosts.values():
+            self.counts[status] += 1
+        if not self.recorded:
+            self.tasks.append((self.task, max(0.0, stamp - self.started)))
+        self.task = None
+        self.hosts = {}
+        self._last = None
+
+    def eta(self, now=None):
+        """
+        Return the expected remaining seconds, `None` without history.
+        """
+
+        if self.position is None:
+            return None
+        now = time.time() if now is None else now
+        elapsed = now - self.started if self.task is not None else 0.0
+        current = self.history[self.position][1]
+        return self.remaining[self.position + 1] + max(0.0, current - elapsed)
+
+    def summary(self, now=None):
+        """
+        Return a one-line description of the progress.
+        """
+
+        counts = dict(self.counts)
+        for status in self.hosts.values():
+            counts[status] += 1
+        parts = []
+        if self.task is not None:
+            parts.append("TASK [{}]".format(self.task))
+            done = len(self.tasks) + 1
+            if len(self.history) >= done:
+                parts.append("task {}/{}".format(done, len(self.history)))
+            else:
+                parts.append("task {}".format(done))
+        elif self.finished:
+            parts.append("PLAY RECAP")
+        parts.append(
+            " ".join(
+                "{}={}".format(k, counts[k])
+                for k in ("ok", "changed", "failed", "unreachable", "skipped")
+            )
+        )
+        eta = self.eta(now)
+        if eta is not None and not self.finished:
+            parts.append("ETA {}".format(_duration(eta)))
+
+        return ", ".join(parts)
+
+
+def _duration(seconds):
+    seconds = int(round(seconds))
+    if seconds >= 3600:
+        return "{}h{:02d}m".format(seconds // 3600, seconds % 3600 // 60)
+    if seconds >= 60:
+        return "{}m{:02d}s".format(seconds // 60, seconds % 60)
+    return "{}s".format(seconds)
+
+
+def history_path(playbook):
+    """
+    Return the path of the task durations recorded for a playbook.
+    """
+
+    key = hashlib.sha1(os.path.realpath(playbook).encode()).hexdigest()
+    return ctx.cache_dir("progress", "{}.json".format(key))
+
+
+def load_history(playbook):
+    """
+    Return the `(task, duration)` recorded for a playbook, if any.
+    """
+
+    try:
+        with open(history_path(playbook)) as f:
+            return json.load(f)["tasks"]
+    except (OSError, ValueError, KeyError):
+        return []
+
+
+def save_history(playbook, tasks):
+    """
+    Record the task durations of a playbook, failing silently.
+    """
+
+    path = history_path(playbook)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = "{}.{}".format(path, os.getpid())
+        with open(tmp, "w") as f:
+            json.dump({"playbook": os.path.realpath(playbook), "tasks": tasks}, f)
+        os.replace(tmp, path)
+    except OSError:
+        pass
+
+
+class Watcher(object):
+    """
+    Periodically report the progress of one or more playbook logs.
+
+    `sources` maps a tag (`None` for a single log) to a log path. Reports are
+    `progress` lines fed to the consumers, which are not closed.
+    """
+
+    def __init__(self, sources, consumers, interval, history=()):
+        self.consumers = consumers
+        self.interval = interval
+        self.followers = {tag: Follower(path) for tag, path in sources.items()}
+        self.progress = {tag: Progress(history) for tag in sources}
+
+    def poll(self):
+        """
+        Parse whatever was appended to the logs since the previous poll.
+        """
+
+        for tag, follower in self.followers.items():
+            feed = self.progress[tag].feed
+            for line in follower.lines():
+                feed(line)
+
+    def report(self):
+        """
+        Feed the consumers with a progress line per log.
+        """
+
+        now = time.time()
+        for tag, progress in self.progress.items():
+            text = progress.summary(now)
+            if tag is not None:
+                text = "[{}] {}".format(tag, text)
+            line = stream.Line(now, "progress", text)
+            for consumer in self.consumers:
+                consumer(line)
+
+    async def run(self):
+        """
+        Poll and report every `interval` seconds until cancelled.
+        """
+
+        while True:
+            await asyncio.sleep(self.interval)
+            self.poll()
+            self.report()
+
+    def close(self):
+        """
+        Read the logs to the end, report one last time and close them.
+
+        Return the `(task, duration)` of the first log to be recorded, if it
+        went through the whole playbook.
+        """
+
+        self.poll()
+        self.report()
+        for follower in self.followers.values():
+            follower.close()
+
+        first = next(iter(self.progress.values()))
+        return first.tasks if first.recorded else []
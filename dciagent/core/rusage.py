@@ -0,0 +1,227 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Resource accounting of the child processes.
+
+The child is reaped with `wait4()`, which returns the resources used by the
+child and all the descendants it waited for (e.g. ansible forks). Note that
+the peak RSS is the one of the biggest single process, not of the whole tree.
+
+When requested, and if the host runs a delegated cgroup v2 hierarchy, the
+child is also moved into its own cgroup, accounting for the whole process tree
+including the memory peak and the I/O bytes.
+"""
+
+import collections
+import os
+
+import dciagent.core.timing as timing
+
+# CPU seconds, peak RSS in bytes, block I/O operations, voluntary/involuntary
+# context switches and the cgroup statistics (if any)
+Usage = collections.namedtuple(
+    "Usage",
+    ["user", "system", "maxrss", "inblock", "oublock", "nvcsw", "nivcsw", "cgroup"],
+)
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+
+def from_rusage(ru, cgroup=None):
+    """
+    Return a `Usage` from a `resource.struct_rusage`.
+    """
+
+    return Usage(
+        user=ru.ru_utime,
+        system=ru.ru_stime,
+        maxrss=ru.ru_maxrss * 1024,  # KiB on linux
+        inblock=ru.ru_inblock,
+        oublock=ru.ru_oublock,
+        nvcsw=ru.ru_nvcsw,
+        nivcsw=ru.ru_nivcsw,
+        cgroup=cgroup,
+    )
+
+
+def combine(usages):
+    """
+    Return the total usage of several children, e.g. shards or retries.
+
+    Everything adds up but the memory peaks, which are the maximum ones.
+    """
+
+    usages = [u for u in usages if u is not None]
+    if not usages:
+        return None
+
+    cgroup = None
+    for u in usages:
+        if u.cgroup is not None:
+            cgroup = dict(cgroup or {})
+            for k, v in u.cgroup.items():
+                if k == "memory_peak":
+                    cgroup[k] = max(cgroup.get(k, 0), v)
+                else:
+                    cgroup[k] = cgroup.get(k, 0) + v
+
+    return Usage(
+        user=sum(u.user for u in usages),
+        system=sum(u.system for u in usages),
+        maxrss=max(u.maxrss for u in usages),
+        inblock=sum(u.inblock for u in usages),
+        oublock=sum(u.oublock for u in usages),
+        nvcsw=sum(u.nvcsw for u in usages),
+        nivcsw=sum(u.nivcsw for u in usages),
+        cgroup=cgroup,
+    )
+
+
+def to_prometheus(usage, **kwargs):
+    """
+    Return the usage in the Prometheus text exposition format.
+
+    Keyword arguments are added as labels to every sample.
+    """
+
+    base = timing.labels(**kwargs)
+    metrics = [
+        ("cpu_user_seconds", "User CPU time of the child.", usage.user),
+        ("cpu_system_seconds", "System CPU time of the child.", usage.system),
+        ("max_rss_bytes", "Peak RSS of the biggest child process.", usage.maxrss),
+        ("block_input_operations", "Block input operations.", usage.inblock),
+        ("block_output_operations", "Block output operations.", usage.oublock),
+        ("voluntary_context_switches", "Voluntary context switches.", usage.nvcsw),
+        ("involuntary_context_switches", "Involuntary switches.", usage.nivcsw),
+    ]
+    for k, v in sorted((usage.cgroup or {}).items()):
+        metrics.append(("cgroup_{}".format(k), "cgroup v2 {}.".format(k), v))
+
+    lines = []
+    for name, doc, value in metrics:
+        name = "dciagent_child_{}".format(name)
+        lines.append("# HELP {} {}".format(name, doc))
+        lines.append("# TYPE {} gauge".format(name))
+        lines.append("{}{{{}}} {}".format(name, base, value))
+
+    return "\n".join(lines) + "\n"
+
+
+def summary(usage):
+    """
+    Return a one-line human readable summary of the usage.
+    """
+
+    text = "cpu user {:.2f}s sys {:.2f}s, max rss {:.1f} MiB, block io {}/{}".format(
+        usage.user,
+        usage.system,
+        usage.maxrss / 1024 / 1024,
+        usage.inblock,
+        usage.oublock,
+    )
+    text += ", context switches {}/{}".format(usage.nvcsw, usage.nivcsw)
+    if usage.cgroup and "memory_peak" in usage.cgroup:
+        text += ", cgroup memory peak {:.1f} MiB".format(
+            usage.cgroup["memory_peak"] / 1024 / 1024
+        )
+
+    return text
+
+
+class Cgroup(object):
+    """
+    A transient cgroup v2, below our own, to account for a whole process tree.
+
+    Raise `OSError` if cgroup v2 is not available or not delegated to us.
+    """
+
+    def __init__(self, name):
+        if not os.path.isfile(os.path.join(CGROUP_ROOT, "cgroup.controllers")):
+            raise OSError("cgroup v2 is not mounted at {}".format(CGROUP_ROOT))
+
+        with open("/proc/self/cgroup") as f:
+            own = [line.split(":", 2)[2].strip() for line in f if line[:3] == "0::"]
+        if not own:
+            raise OSError("Cannot find our own cgroup v2")
+        self.path = os.path.join(CGROUP_ROOT, own[0].lstrip("/"), name)
+        os.mkdir(self.path)
+
+    def command(self, command_line):
+        """
+        Return `command_line` wrapped to move itself into the cgroup first.
+
+        A shell writes its pid, then execs the command: a Popen `preexec_fn`
+        is not safe in a process running threads, and moving the child from
+        the parent would race with the processes it starts.
+        """
+
+        return [
+            "/bin/sh",
+            "-c",
+            'echo $$ > "$0/cgroup.procs" || exit 126; exec "$@"',
+            self.path,
+        ] + list(command_line)
+
+    def _read(self, name):
+        try:
+            with open(os.path.join(self.path, name)) as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def collect(self):
+        """
+        Return the statistics of the cgroup, as far as its controllers allow.
+        """
+
+        stats = {}
+        cpu = self._read("cpu.stat")
+        for line in (cpu or "").splitlines():
+            k, v = line.split()
+            if k in ("usage_usec", "user_usec", "system_usec"):
+                stats["cpu_{}".format(k)] = int(v)
+
+        peak = self._read("memory.peak")
+        if peak is not None:
+            stats["memory_peak"] = int(peak)
+
+        io = self._read("io.stat")
+        for line in (io or "").splitlines():
+            for field in line.split()[1:]:
+                k, v = field.split("=")
+                if k in ("rbytes", "wbytes"):
+                    stats["io_{}".format(k)] = stats.get("io_{}".format(k), 0) + int(v)
+
+        return stats
+
+    def kill(self):
+        """
+        Kill every process left in the cgroup, when the kernel supports it.
+        """
+
+        try:
+            with open(os.path.join(self.path, "cgroup.kill"), "w") as f:
+                f.write("1")
+        except OSError:
+            pass
+
+    def remove(self):
+        """
+        Remove the cgroup, leftover processes (if any) keep it alive.
+        """
+
+        try:
+            os.rmdir(self.path)
+        except OSError:
+            pass
@@ -0,0 +1,165 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Inventory sharding utilities.
+
+Hosts are resolved from the JSON output of `ansible-inventory --list`, split
+into shards each run by its own `ansible-playbook` process, and the per-shard
+logs and JUnit reports are merged back once all of them are done.
+"""
+
+import os
+import shutil
+import xml.etree.ElementTree as ET
+
+import dciagent.core.printer as printer
+
+
+def groups(inventory):
+    """
+    Return the hosts of every group, including those of its children.
+
+    `inventory` is the parsed output of `ansible-inventory --list`, the result
+    maps group names to host lists, in inventory order.
+    """
+
+    resolved = {}
+
+    def walk(name, seen):
+        if name in resolved:
+            return resolved[name]
+        group = inventory.get(name, {})
+        hosts = list(group.get("hosts", []))
+        for child in group.get("children", []):
+            if child not in seen:
+                hosts.extend(walk(child, seen | {child}))
+        # keep the first occurrence of each host
+        resolved[name] = list(dict.fromkeys(hosts))
+        return resolved[name]
+
+    walk("all", {"all"})
+    for name in inventory:
+        if name != "_meta":
+            walk(name, {name})
+
+    return resolved
+
+
+def partition(inventory, count, by="host"):
+    """
+    Split the inventory hosts into at most `count` non-empty shards.
+
+    With `by="host"` hosts are dealt round-robin. With `by="group"` the
+    top-level groups are kept together, biggest first, in the least loaded
+    shard, so group-wide plays stay within one process where possible.
+    """
+
+    resolved = groups(inventory)
+    hosts = resolved["all"]
+    count = max(1, min(count, len(hosts)))
+    shards = [[] for _ in range(count)]
+
+    if by == "host":
+        for i, host in enumerate(hosts):
+            shards[i % count].append(host)
+    elif by == "group":
+        top = inventory.get("all", {})
+        # hosts directly under `all`, if any, behave like one more group
+        candidates = [resolved[g] for g in top.get("children", [])]
+        candidates.append(top.get("hosts", []))
+
+        assigned = set()
+        members = []
+        for group in candidates:
+            group = [h for h in group if h not in assigned]
+            assigned.update(group)
+            members.append(group)
+
+        for group in sorted(members, key=len, reverse=True):
+            min(shards, key=len).extend(group)
+    else:
+        raise ValueError("Unknown sharding method {}".format(by))
+
+    return [s for s in shards if s]
+
+
+def merge_logs(paths, dest):
+    """
+    Append the given log files to `dest` and remove them.
+    """
+
+    with open(dest, "ab") as out:
+        for path in paths:
+            if os.path.isfile(path):
+                with open(path, "rb") as f:
+                    shutil.copyfileobj(f, out, 1024 * 1024)
+                os.unlink(path)
+
+
+def _suites(path):
+    """
+    Yield the outermost `testsuite` elements of a JUnit report as parsed.
+
+    Every element is cleared once yielded, so the report is never fully held
+    in memory.
+    """
+
+    depth = 0
+    for event, elem in ET.iterparse(path, events=("start", "end")):
+        if elem.tag != "testsuite":
+            continue
+        if event == "start":
+            depth += 1
+            continue
+        depth -= 1
+        if depth == 0:
+            yield elem
+            elem.clear()
+
+
+def merge_junit(dirs, dest_dir, name):
+    """
+    Merge the JUnit reports found in `dirs` into `dest_dir/name`.
+
+    All the `testsuite` elements end up in a single `testsuites` document, the
+    shard directories are removed afterwards. Reports that cannot be parsed,
+    e.g. truncated by a killed shard, are skipped past their last complete
+    suite.
+    """
+
+    out = None
+    try:
+        for d in dirs:
+            for entry in sorted(os.listdir(d)) if os.path.isdir(d) else []:
+                if not entry.endswith(".xml"):
+                    continue
+                path = os.path.join(d, entry)
+                try:
+                    for suite in _suites(path):
+                        if out is None:
+                            out = open(os.path.join(dest_dir, name), "wb")
+                            out.write(
+                                b"<?xml version='1.0' encoding='utf-8'?>\n"
+                                b"<testsuites>"
+                            )
+                        out.write(ET.tostring(suite, encoding="unicode").encode())
+                except (ET.ParseError, OSError) as e:
+                    printer.header(
+                        "Skipping invalid JUnit report {}: {}".format(path, e)
+                    )
+            shutil.rmtree(d, ignore_errors=True)
+    finally:
+        if out is not None:
+            out.write(b"</testsuites>\n")
+            out.close()
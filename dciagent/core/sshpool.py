@@ -0,0 +1,114 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Pool of SSH ControlMaster connections shared between agent runs.
+
+The ControlMaster sockets of ansible are kept in a private runtime directory
+per pool key, a digest of everything the SSH identity depends on (e.g. the
+DCI prefix, credentials and ansible configuration). Consecutive and concurrent
+runs with the same key reuse the open connections, the others never see them.
+
+Masters exit on their own once idle for the `ControlPersist` time, sockets left
+behind by masters that died are removed by `evict()`.
+"""
+
+import errno
+import hashlib
+import json
+import os
+import socket
+
+import dciagent.core.context as ctx
+
+
+def key(*identity):
+    """
+    Return the pool key of an SSH identity, any JSON serializable values.
+    """
+
+    return hashlib.sha256(json.dumps(identity).encode()).hexdigest()[:16]
+
+
+def root(create=True):
+    """
+    Return the directory holding the pools of the user.
+    """
+
+    return ctx.runtime_dir("dciagent-ssh", create=create)
+
+
+def directory(pool, create=True):
+    """
+    Return the ControlMaster directory of a pool key, created if needed.
+    """
+
+    path = os.path.join(root(create), pool)
+    if create:
+        os.makedirs(path, mode=0o700, exist_ok=True)
+    return path
+
+
+def ssh_args(idle):
+    """
+    Return the ansible SSH arguments keeping masters for `idle` seconds.
+    """
+
+    return "-C -o ControlMaster=auto -o ControlPersist={}s".format(idle)
+
+
+def _alive(path):
+    """
+    Return whether a master is listening on the socket `path`.
+    """
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        try:
+            s.connect(path)
+        except OSError as e:
+            if e.errno in (errno.ECONNREFUSED, errno.ENOENT):
+                return False
+            raise
+    return True
+
+
+def evict(keep=None):
+    """
+    Remove the sockets of dead masters and the empty pools but `keep`.
+
+    Return the number of sockets removed.
+    """
+
+    removed = 0
+    try:
+        pools = list(os.scandir(root()))
+    except FileNotFoundError:
+        return 0
+
+    for pool in pools:
+        if not pool.is_dir(follow_symlinks=False):
+            continue
+        for entry in os.scandir(pool.path):
+            try:
+                if not _alive(entry.path):
+                    os.unlink(entry.path)
+                    removed += 1
+            except OSError:
+                pass
+        if pool.name != keep:
+            try:
+                os.rmdir(pool.path)
+            except OSError:
+                pass  # not empty
+
+    return removed
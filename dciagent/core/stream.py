@@ -0,0 +1,481 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Streaming of the child process output.
+
+The output of the executed command is read from its stdout/stderr pipes as it
+is produced, split into timestamped lines and handed to a list of consumers
+(echo to the terminal, tee to a log file, keep the last lines around, ...).
+Nothing accumulates besides what the consumers decide to keep, so memory stays
+constant regardless of how verbose the child is.
+
+Every child runs in its own session, so its whole process group can be
+terminated at once. The terminal interrupts only reach the agent: use `run()`
+to cancel the pipelines (terminating their children) on ^C.
+"""
+
+import asyncio
+import collections
+import contextlib
+import os
+import selectors
+import signal
+import subprocess
+import sys
+import time
+
+import dciagent.core.rusage as rusage
+
+Line = collections.namedtuple("Line", ["time", "stream", "text"])
+
+
+class Consumer(object):
+    """
+    Base class for line consumers, called once per line of output.
+    """
+
+    def __call__(self, line):
+        """
+        Consume a `Line`, override to define.
+        """
+
+        raise NotImplementedError("Define the __call__() method in your consumer")
+
+    def close(self):
+        """
+        Release any resource once the child is done, override if needed.
+        """
+
+        pass
+
+    async def drain_async(self):
+        """
+        Wait until more lines can be consumed, override to apply backpressure.
+
+        The asynchronous pipelines wait for it after each chunk of output, the
+        child being blocked on its pipes meanwhile.
+        """
+
+        pass
+
+
+class Echo(Consumer):
+    """
+    Write the lines back to the terminal, as if the child owned it.
+    """
+
+    def __call__(self, line):
+        """
+        Write the line to the stream it was read from.
+        """
+
+        out = sys.stderr if line.stream == "stderr" else sys.stdout
+        out.write(line.text + "\n")
+
+    def close(self):
+        """
+        Flush the terminal streams.
+        """
+
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+
+class LogFile(Consumer):
+    """
+    Tee the lines to a log file, prefixed with their timestamp and stream.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.f = open(path, "a", buffering=1024 * 1024)
+        self._second = None
+        self._prefix = None
+
+    def __call__(self, line):
+        """
+        Append the line to the log file.
+        """
+
+        second = int(line.time)
+        if second != self._second:
+            # formatting the date is the costly part, do it once per second
+            self._second = second
+            self._prefix = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(second))
+        self.f.write(
+            "{}.{:03d} [{}] {}\n".format(
+                self._prefix,
+                int((line.time - second) * 1000),
+                line.stream,
+                line.text,
+            )
+        )
+
+    def close(self):
+        """
+        Close the log file.
+        """
+
+        self.f.close()
+
+
+class Tail(Consumer):
+    """
+    Keep the last lines of output in a ring buffer, e.g. for failure summaries.
+    """
+
+    def __init__(self, size):
+        self.lines = collections.deque(maxlen=size)
+
+    def __call__(self, line):
+        """
+        Keep the line, pushing out the oldest one if full.
+        """
+
+        self.lines.append(line)
+
+
+class Shared(Consumer):
+    """
+    Feed other consumers shared between several pipelines.
+
+    Closing the wrapped consumers is left to their owner, once all the
+    pipelines are done.
+    """
+
+    def __init__(self, consumers):
+        self.consumers = consumers
+
+    def __call__(self, line):
+        """
+        Forward the line.
+        """
+
+        for consumer in self.consumers:
+            consumer(line)
+
+    async def drain_async(self):
+        """
+        Wait for the wrapped consumers.
+        """
+
+        for consumer in self.consumers:
+            await consumer.drain_async()
+
+
+class Tagged(Shared):
+    """
+    Feed shared consumers with lines prefixed by a tag, e.g. a shard number.
+    """
+
+    def __init__(self, consumers, tag):
+        super().__init__(consumers)
+        self.tag = tag
+
+    def __call__(self, line):
+        """
+        Forward the tagged line.
+        """
+
+        super().__call__(line._replace(text="[{}] {}".format(self.tag, line.text)))
+
+
+def run(coro):
+    """
+    Run a coroutine in a new event loop and return its result.
+
+    On ^C the coroutine is cancelled, terminating the children of its
+    pipelines, before `KeyboardInterrupt` is raised again.
+    """
+
+    loop = asyncio.new_event_loop()
+    # python < 3.8 needs the loop set to attach the child watcher to it
+    asyncio.set_event_loop(loop)
+    try:
+        task = loop.create_task(coro)
+        try:
+            return loop.run_until_complete(task)
+        except KeyboardInterrupt:
+            task.cancel()
+            try:
+                loop.run_until_complete(task)
+            except (asyncio.CancelledError, Exception):
+                pass
+            raise
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+class Pipeline(object):
+    """
+    Run a command and dispatch its output lines to the given consumers.
+
+    Lines longer than `max_line` bytes are split, so a single runaway line
+    cannot grow the buffers either. When terminated, the child process group
+    gets `SIGTERM`, then `SIGKILL` after `grace` seconds.
+    """
+
+    def __init__(
+        self,
+        consumers,
+        chunk_size=64 * 1024,
+        max_line=64 * 1024,
+        cgroup=None,
+        grace=10,
+    ):
+        self.consumers = consumers
+        self.chunk_size = chunk_size
+        self.max_line = max_line
+        self.cgroup = cgroup
+        self.grace = grace
+        self.usage = None
+        self.process = None
+        self.terminated = False
+
+    def _spawn(self, command_line, kwargs):
+        """
+        Start the child in a new session, with its output piped to us.
+        """
+
+        if self.cgroup is not None:
+            command_line = self.cgroup.command(command_line)
+
+        self.process = subprocess.Popen(
+            command_line,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            start_new_session=True,
+            **kwargs,
+        )
+        return self.process
+
+    def _running(self):
+        """
+        Return whether the child is still running, without reaping it.
+        """
+
+        p = self.process
+        if p is None or p.returncode is not None:
+            return False
+        try:
+            return (
+                os.waitid(os.P_PID, p.pid, os.WEXITED | os.WNOHANG | os.WNOWAIT) is None
+            )
+        except ChildProcessError:
+            return False
+
+    def _signal(self, sig):
+        """
+        Send `sig` to the child process group, if any is left.
+        """
+
+        with contextlib.suppress(ProcessLookupError, PermissionError):
+            os.killpg(self.process.pid, sig)
+
+    async def terminate_async(self):
+        """
+        Terminate the child process group, escalating to `SIGKILL`.
+
+        The group gets `SIGKILL` once the child exited or after `grace`
+        seconds, whichever comes first, so no straggler is left behind. A
+        pipeline terminated before it starts never runs its command.
+        """
+
+        self.terminated = True
+        if not self._running():
+            return
+
+        self._signal(signal.SIGTERM)
+        deadline = time.monotonic() + self.grace
+        while self._running() and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        self._signal(signal.SIGKILL)
+        if self.cgroup is not None:
+            self.cgroup.kill()  # also reaches the processes out of the group
+
+    def _reaped(self, p, status, ru):
+        """
+        Record the resource usage of a reaped child and return its rc.
+        """
+
+        cgroup = None
+        if self.cgroup is not None:
+            cgroup = self.cgroup.collect()
+            self.cgroup.remove()
+        self.usage = rusage.from_rusage(ru, cgroup)
+
+        if os.WIFSIGNALED(status):
+            p.returncode = -os.WTERMSIG(status)
+        else:
+            p.returncode = os.WEXITSTATUS(status)
+
+        return p.returncode
+
+    def run(self, command_line, **kwargs):
+        """
+        Run the command line through Popen and return its return code.
+
+        Keyword arguments are passed as-is to Popen. The resources used by the
+        child are available in `self.usage` afterwards.
+        """
+
+        try:
+            p = self._spawn(command_line, kwargs)
+            with p:
+                try:
+                    self.pump({"stdout": p.stdout, "stderr": p.stderr})
+                except BaseException:
+                    self._signal(signal.SIGKILL)
+                    raise
+                _, status, ru = os.wait4(p.pid, 0)
+                return self._reaped(p, status, ru)
+        finally:
+            for consumer in self.consumers:
+                consumer.close()
+
+    async def run_async(self, command_line, **kwargs):
+        """
+        Run the command line and return its return code, without blocking.
+
+        Keyword arguments are passed as-is to Popen. The child process group is
+        terminated if the task gets cancelled. The resources used by the child
+        are available in `self.usage` afterwards.
+        """
+
+        loop = asyncio.get_event_loop()
+        try:
+            if self.terminated:
+                return -signal.SIGTERM
+            p = self._spawn(command_line, kwargs)
+            pumps = []
+            try:
+                stdout = await self._reader(loop, p.stdout)
+                stderr = await self._reader(loop, p.stderr)
+                pumps = [
+                    asyncio.ensure_future(self.pump_async("stdout", stdout)),
+                    asyncio.ensure_future(self.pump_async("stderr", stderr)),
+                ]
+                await asyncio.gather(*pumps)
+                return await self._wait_async(loop, p)
+            except BaseException:
+                # cancelled or a consumer failed, leave nothing running behind
+                for pump in pumps:
+                    pump.cancel()
+                await asyncio.gather(*pumps, return_exceptions=True)
+                await self.terminate_async()
+                await self._wait_async(loop, p)
+                raise
+        finally:
+            for consumer in self.consumers:
+                consumer.close()
+
+    async def _reader(self, loop, pipe):
+        """
+        Return an asyncio stream reader on a pipe.
+        """
+
+        reader = asyncio.StreamReader(limit=self.chunk_size)
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), pipe)
+        return reader
+
+    async def _wait_async(self, loop, p):
+        """
+        Reap the child with `wait4()` and return its return code.
+
+        The child exit is watched through a pidfd when available, without
+        blocking any thread, otherwise `wait4()` runs in the default executor.
+        Children are reaped here rather than by the asyncio child watcher, as
+        the latter drops their resource usage.
+        """
+
+        if p.returncode is not None:
+            return p.returncode
+
+        try:
+            fd = os.pidfd_open(p.pid)
+        except (AttributeError, OSError):
+            _, status, ru = await loop.run_in_executor(None, os.wait4, p.pid, 0)
+            return self._reaped(p, status, ru)
+
+        exited = loop.create_future()
+        loop.add_reader(fd, lambda: exited.done() or exited.set_result(None))
+        try:
+            await exited
+        finally:
+            loop.remove_reader(fd)
+            os.close(fd)
+
+        _, status, ru = os.wait4(p.pid, 0)
+        return self._reaped(p, status, ru)
+
+    async def pump_async(self, name, reader):
+        """
+        Read from an asyncio stream reader until it reaches EOF.
+        """
+
+        pending = b""
+        while True:
+            data = await reader.read(self.chunk_size)
+            if not data:
+                break
+            pending = self._feed(name, pending + data)
+            for consumer in self.consumers:
+                await consumer.drain_async()
+
+        if pending:
+            self._dispatch(name, pending)
+
+    def pump(self, pipes):
+        """
+        Read from the pipes as data becomes available until all of them close.
+        """
+
+        pending = {}
+        with selectors.DefaultSelector() as sel:
+            for name, pipe in pipes.items():
+                sel.register(pipe, selectors.EVENT_READ, name)
+                pending[name] = b""
+
+            while sel.get_map():
+                for key, _ in sel.select():
+                    name = key.data
+                    data = os.read(key.fd, self.chunk_size)
+                    if not data:
+                        sel.unregister(key.fileobj)
+                        if pending[name]:
+                            self._dispatch(name, pending[name])
+                        continue
+                    pending[name] = self._feed(name, pending[name] + data)
+
+    def _feed(self, name, data):
+        """
+        Dispatch all complete lines in `data` and return the remainder.
+        """
+
+        lines = data.split(b"\n")
+        rest = lines.pop()
+        for line in lines:
+            self._dispatch(name, line)
+
+        while len(rest) > self.max_line:
+            self._dispatch(name, rest[: self.max_line])
+            rest = rest[self.max_line :]
+
+        return rest
+
+    def _dispatch(self, name, data):
+        line = Line(time.time(), name, data.decode("utf-8", "replace"))
+        for consumer in self.consumers:
+            consumer(line)
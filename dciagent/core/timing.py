@@ -0,0 +1,151 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Timing instrumentation for the agent lifecycle.
+"""
+
+import collections
+import contextlib
+import json
+import os
+import time
+
+Span = collections.namedtuple("Span", ["name", "start", "duration"])
+
+
+def _escape(value):
+    """
+    Escape a Prometheus label value.
+    """
+
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def labels(**kwargs):
+    """
+    Format Prometheus labels, without the surrounding braces.
+    """
+
+    return ",".join('{}="{}"'.format(k, _escape(v)) for k, v in kwargs.items())
+
+
+def _write(path, data):
+    """
+    Atomically replace `path`, so collectors never read a partial file.
+    """
+
+    tmp = "{}.{}".format(path, os.getpid())
+    with open(tmp, "w") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class Timings(object):
+    """
+    Record monotonic timing spans, e.g. around each lifecycle phase.
+
+    Spans are kept in the order they started, with their start relative to the
+    creation of this object. Spans can nest, e.g. a `credentials` span within
+    the `pre` one.
+    """
+
+    def __init__(self):
+        self.origin = time.monotonic()
+        self.wall = time.time()
+        self.spans = []
+
+    @contextlib.contextmanager
+    def span(self, name):
+        """
+        Time the context as a span called `name`.
+        """
+
+        start = time.monotonic()
+        index = len(self.spans)
+        self.spans.append(Span(name, start - self.origin, None))
+        try:
+            yield
+        finally:
+            self.spans[index] = self.spans[index]._replace(
+                duration=time.monotonic() - start
+            )
+
+    def durations(self):
+        """
+        Return the total duration of each span name, in seconds.
+        """
+
+        totals = collections.OrderedDict()
+        for s in self.spans:
+            if s.duration is not None:
+                totals[s.name] = totals.get(s.name, 0.0) + s.duration
+
+        return totals
+
+    def to_json(self, **extra):
+        """
+        Return the spans, and any extra top-level key, as a JSON document.
+        """
+
+        doc = {"started": self.wall, "spans": [s._asdict() for s in self.spans]}
+        doc.update(extra)
+        return json.dumps(doc, indent=2)
+
+    def to_prometheus(self, **kwargs):
+        """
+        Return the span durations in the Prometheus text exposition format.
+
+        Keyword arguments are added as labels to every sample.
+        """
+
+        base = labels(**kwargs)
+        lines = [
+            "# HELP dciagent_phase_duration_seconds "
+            "Duration of the agent lifecycle phases.",
+            "# TYPE dciagent_phase_duration_seconds gauge",
+        ]
+        for name, duration in self.durations().items():
+            lines.append(
+                "dciagent_phase_duration_seconds{{{}}} {:.6f}".format(
+                    labels(**dict(kwargs, phase=name)), duration
+                )
+            )
+        lines.extend(
+            [
+                "# HELP dciagent_last_run_timestamp_seconds "
+                "Start time of the last agent run.",
+                "# TYPE dciagent_last_run_timestamp_seconds gauge",
+                "dciagent_last_run_timestamp_seconds{{{}}} {:.3f}".format(
+                    base, self.wall
+                ),
+            ]
+        )
+
+        return "\n".join(lines) + "\n"
+
+    def write_json(self, path, **extra):
+        """
+        Write the spans as JSON to `path`.
+        """
+
+        _write(path, self.to_json(**extra))
+
+    def write_prometheus(self, path, extra="", **kwargs):
+        """
+        Write the durations to `path` for the node exporter textfile collector.
+
+        `extra` is appended as-is, e.g. other metrics about the run.
+        """
+
+        _write(path, self.to_prometheus(**kwargs) + extra)
@@ -0,0 +1,264 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Background removal of the run directories.
+
+Removing a big directory tree takes a while, so instead of deleting it the
+agent atomically renames it into a trash directory on the same filesystem and
+leaves the deletion to a detached reaper process, which empties the trash and
+exits. Each trash entry records the size of the directory in its name, so the
+trash size is known without walking it: once over its limit, directories are
+removed synchronously instead.
+
+While a run directory is in use, the agent holds a lock on a `<dir>.lock` file
+next to it. Directories whose lock is not held anymore were left behind by a
+killed agent and are moved to the trash by `recover()`, called when the next
+agent starts.
+"""
+
+import fcntl
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# the reaper processes we started, kept around to be reaped in turn
+_reapers = []
+
+
+def trash_dir(parent=None):
+    """
+    Return the trash directory of the user, below `parent` (the temp dir).
+    """
+
+    parent = tempfile.gettempdir() if parent is None else parent
+    return os.path.join(parent, "dciagent-trash-{}".format(os.getuid()))
+
+
+def size(path):
+    """
+    Return the total size of the files below `path`, symlinks not followed.
+    """
+
+    total = 0
+    stack = [path]
+    while stack:
+        try:
+            entries = list(os.scandir(stack.pop()))
+        except OSError:
+            continue
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                else:
+                    total += entry.stat(follow_symlinks=False).st_size
+            except OSError:
+                pass
+
+    return total
+
+
+def _entries(trash):
+    """
+    Return the `(name, size)` of the trash entries, oldest first.
+    """
+
+    try:
+        names = os.listdir(trash)
+    except FileNotFoundError:
+        return []
+
+    entries = []
+    for name in names:
+        parts = name.rsplit(".", 2)
+        if len(parts) == 3 and parts[1].isdigit() and parts[2].isdigit():
+            entries.append((int(parts[1]), name, int(parts[2])))
+
+    return [(name, n) for _, name, n in sorted(entries)]
+
+
+def _move(path, trash, n):
+    """
+    Rename a directory of `n` bytes into the trash.
+    """
+
+    os.makedirs(trash, mode=0o700, exist_ok=True)
+    name = "{}.{}.{}".format(os.path.basename(path), int(time.time() * 1e6), n)
+    os.rename(path, os.path.join(trash, name))
+
+
+def lock(path):
+    """
+    Lock the `<path>.lock` file of a run directory and return its fd.
+    """
+
+    # lock the file before it gets its name, so recover() never sees it
+    # unlocked
+    tmp = "{}.lock.{}".format(path, os.getpid())
+    fd = os.open(tmp, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+    fcntl.flock(fd, fcntl.LOCK_EX)
+    os.rename(tmp, "{}.lock".format(path))
+    return fd
+
+
+def unlock(path, fd, remove=True):
+    """
+    Release and remove the lock file of a run directory.
+
+    With `remove` false the lock file is kept, so `recover()` will consider
+    the directory again.
+    """
+
+    if remove:
+        try:
+            os.unlink("{}.lock".format(path))
+        except FileNotFoundError:
+            pass
+    os.close(fd)
+
+
+def locked(path):
+    """
+    Return whether an agent holds the lock of a run directory.
+    """
+
+    try:
+        fd = os.open("{}.lock".format(path), os.O_RDWR)
+    except FileNotFoundError:
+        return False
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        return False
+    except OSError:
+        return True
+    finally:
+        os.close(fd)
+
+
+def discard(path, max_bytes, trash=None):
+    """
+    Move a directory into the trash and start a reaper to delete it.
+
+    The directory is removed synchronously when it does not fit in the trash
+    (`max_bytes`, 0 disables the trash) or cannot be renamed there, e.g. if
+    it lives on another filesystem.
+    """
+
+    trash = trash_dir(os.path.dirname(path)) if trash is None else trash
+    n = size(path) if max_bytes > 0 else 0
+    if max_bytes <= 0 or n + sum(s for _, s in _entries(trash)) > max_bytes:
+        shutil.rmtree(path)
+        return
+
+    try:
+        _move(path, trash, n)
+    except OSError:
+        shutil.rmtree(path)
+        return
+
+    reap(trash)
+
+
+def recover(parent=None, prefix="dci-", keep=None):
+    """
+    Move the run directories left by killed agents into the trash.
+
+    Directories for which `keep(path)` is true are left alone, e.g. runs that
+    can be resumed. Start a reaper if the trash is not empty and return the
+    recovered paths.
+    """
+
+    parent = tempfile.gettempdir() if parent is None else parent
+    trash = trash_dir(parent)
+    recovered = []
+    for entry in os.scandir(parent):
+        if not entry.name.startswith(prefix) or not entry.name.endswith(".lock"):
+            continue
+        try:
+            fd = os.open(entry.path, os.O_RDWR)
+        except OSError:
+            continue
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)  # still in use
+            continue
+
+        path = entry.path[: -len(".lock")]
+        if keep is not None and keep(path):
+            os.close(fd)
+            continue
+        try:
+            if os.path.isdir(path):
+                _move(path, trash, size(path))
+                recovered.append(path)
+        except OSError:
+            pass
+        finally:
+            unlock(path, fd)
+
+    if _entries(trash):
+        reap(trash)
+
+    return recovered
+
+
+def reap(trash):
+    """
+    Start a detached process emptying the trash.
+    """
+
+    _reapers[:] = [p for p in _reapers if p.poll() is None]
+    _reapers.append(
+        subprocess.Popen(
+            [sys.executable, "-m", "dciagent.core.trash", trash],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+    )
+
+
+def empty(trash):
+    """
+    Delete the trash entries, unless another process already does.
+
+    Entries are deleted oldest first, until none is left or none of those
+    left can be deleted.
+    """
+
+    left = None
+    while True:
+        entries = _entries(trash)
+        if not entries or entries == left:
+            return
+        fd = os.open(os.path.join(trash, ".reaper"), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return  # the other reaper checks for new entries once done
+            for name, _ in entries:
+                shutil.rmtree(os.path.join(trash, name), ignore_errors=True)
+        finally:
+            os.close(fd)
+        left = entries
+
+
+if __name__ == "__main__":
+    empty(sys.argv[1])
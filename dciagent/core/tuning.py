@@ -0,0 +1,139 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Ansible performance profile tuned to the inventory and the local resources.
+
+The profile is a set of ansible environment variables. Settings the user
+already configured, in the environment, `ansible.cfg` or on the command line,
+are left alone.
+"""
+
+import configparser
+import os
+
+# memory used by every ansible worker process, roughly
+FORK_MEMORY = 96 * 1024 * 1024
+FORKS_PER_CPU = 10
+MAX_FORKS = 256
+SSH_ARGS = "-C -o ControlMaster=auto -o ControlPersist=300s"
+
+# where each setting can be set in ansible.cfg
+SETTINGS = {
+    "ANSIBLE_CACHE_PLUGIN": [("defaults", "fact_caching")],
+    "ANSIBLE_CACHE_PLUGIN_CONNECTION": [("defaults", "fact_caching_connection")],
+    "ANSIBLE_CACHE_PLUGIN_TIMEOUT": [("defaults", "fact_caching_timeout")],
+    "ANSIBLE_FORKS": [("defaults", "forks")],
+    "ANSIBLE_GATHERING": [("defaults", "gathering")],
+    "ANSIBLE_PIPELINING": [
+        ("defaults", "pipelining"),
+        ("connection", "pipelining"),
+        ("ssh_connection", "pipelining"),
+    ],
+    "ANSIBLE_SSH_ARGS": [("ssh_connection", "ssh_args")],
+    "ANSIBLE_STRATEGY": [("defaults", "strategy")],
+}
+
+# command line options overriding a setting
+OPTIONS = {"ANSIBLE_FORKS": ("-f", "--forks")}
+
+
+def resources():
+    """
+    Return the usable CPUs and the available memory in bytes.
+    """
+
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+
+    memory = None
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    memory = int(line.split()[1]) * 1024
+                    break
+    except OSError:
+        pass
+    if memory is None:
+        memory = os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+
+    return cpus, memory
+
+
+def profile(hosts, cpus, memory):
+    """
+    Return the tuned settings for `hosts` hosts (`None` if unknown).
+
+    Forks are bounded by the number of hosts, the CPUs and the memory. The
+    `free` strategy is only used when the hosts do not fit in the forks, so
+    fast hosts do not wait for the slow ones of each batch.
+    """
+
+    forks = min(cpus * FORKS_PER_CPU, memory // FORK_MEMORY, MAX_FORKS)
+    if hosts is not None:
+        forks = min(forks, hosts)
+    forks = max(1, forks)
+
+    return {
+        "ANSIBLE_FORKS": str(forks),
+        "ANSIBLE_PIPELINING": "True",
+        "ANSIBLE_SSH_ARGS": SSH_ARGS,
+        "ANSIBLE_STRATEGY": "free" if hosts is not None and hosts > forks else "linear",
+    }
+
+
+def read_config(config):
+    """
+    Return the parsed `ansible.cfg` at `config`, empty if `None` or invalid.
+    """
+
+    parser = configparser.ConfigParser(
+        allow_no_value=True, interpolation=None, strict=False
+    )
+    if config is not None:
+        try:
+            parser.read(config)
+        except configparser.Error:
+            pass
+
+    return parser
+
+
+def explicit(config, environ, args):
+    """
+    Return the settings explicitly set by the user.
+
+    `config` is the path to `ansible.cfg` (or `None`), `environ` the
+    environment of the run and `args` the extra `ansible-playbook` arguments.
+    """
+
+    parser = read_config(config)
+    found = set()
+    for name, keys in SETTINGS.items():
+        if name in environ:
+            found.add(name)
+        for section, key in keys:
+            if parser.has_option(section, key):
+                found.add(name)
+        for option in OPTIONS.get(name, ()):
+            for a in args:
+                # short options can be glued to their value, e.g. -f10
+                if len(option) == 2 and a.startswith(option):
+                    found.add(name)
+                elif a == option or a.startswith(option + "="):
+                    found.add(name)
+
+    return found
@@ -3,7 +3,13 @@ import os.path
 
 from setuptools import setup
 
-packages = ["dciagent", "dciagent.agents", "dciagent.core", "dciagent.core.agent"]
+packages = [
+    "dciagent",
+    "dciagent.agents",
+    "dciagent.core",
+    "dciagent.core.agent",
+    "dciagent.core.callback",
+]
 
 package_data = {"": ["*"]}
 
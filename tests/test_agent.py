@@ -0,0 +1,131 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import asyncio
+import os
+import signal
+import threading
+import time
+
+import dciagent.core.abort as abort
+import dciagent.core.agent.base as base
+import dciagent.core.stream as stream
+
+
+class ShellAgent(base.Agent):
+    executable = "sh"
+    script = "exit 0"
+
+    def __init__(self, script):
+        super().__init__("shell-ctl", "test agent", "0.1")
+        self.script = script
+
+    def _build_command(self):
+        self.command_line = [self.executable, "-c", self.script]
+
+
+def test_run():
+    agent = ShellAgent("exit 4")
+    assert agent.run(agent.cli([])) == 4
+
+
+def test_run_async_concurrent():
+    agents = [ShellAgent("echo {}; exit {}".format(i, i)) for i in range(5)]
+
+    async def run_all():
+        return await asyncio.gather(*[a.run_async(a.cli([])) for a in agents])
+
+    loop = asyncio.new_event_loop()
+    try:
+        assert loop.run_until_complete(run_all()) == list(range(5))
+    finally:
+        loop.close()
+    assert [a.tail.lines[-1].text for a in agents] == [str(i) for i in range(5)]
+
+
+def test_run_environment_isolated():
+    agents = [ShellAgent('echo "$TENANT"') for i in range(8)]
+    for i, a in enumerate(agents):
+        a.environment["TENANT"] = str(i)
+
+    threads = [threading.Thread(target=a.run, args=(a.cli([]),)) for a in agents]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert "TENANT" not in os.environ
+    assert [a.tail.lines[-1].text for a in agents] == [str(i) for i in range(8)]
+    assert ShellAgent.environment == {}
+
+
+def test_run_timings(tmp_path):
+    agent = ShellAgent("exit 0")
+    prom = tmp_path / "agent.prom"
+    agent.run(agent.cli(["--prometheus-textfile", str(prom)]))
+
+    assert list(agent.timings.durations()) == [
+        "load_args",
+        "normalize",
+        "validate",
+        "pre",
+        "build_command",
+        "build_env",
+        "execute",
+        "post",
+    ]
+    assert 'phase="execute"' in prom.read_text()
+
+
+def test_abort_kills_process_group(tmp_path):
+    pid_file = tmp_path / "pid"
+    # the background sleep ignores SIGTERM, only the escalation kills it
+    agent = ShellAgent(
+        "(trap '' TERM; sleep 60) & echo $! > {}; echo started; sleep 60".format(
+            pid_file
+        )
+    )
+    start = time.monotonic()
+    rc = agent.run(agent.cli(["--idle-timeout", "1", "--kill-grace", "1"]))
+    assert rc < 0
+    assert time.monotonic() - start < 10
+    assert agent.watchdog.reason == "no output for 1s"
+    # killed, possibly left as a zombie if nothing reaps orphans
+    stat = "/proc/{}/stat".format(pid_file.read_text().strip())
+    assert not os.path.exists(stat) or open(stat).read().split()[2] == "Z"
+
+
+def test_abort_pattern():
+    agent = ShellAgent("echo ok; echo 'FATAL: boom'; sleep 60")
+    rc = agent.run(agent.cli(["--abort-pattern", "^FATAL", "--timeout", "30"]))
+    assert rc == -signal.SIGTERM
+    assert agent.watchdog.reason.startswith("output matched '^FATAL'")
+
+
+def test_idle_timeout_ignores_progress():
+    watchdog = abort.Watchdog([], idle_timeout=2)
+    watchdog.started = watchdog.last_output = 100
+    watchdog(stream.Line(101, "stdout", "output"))
+    watchdog(stream.Line(102, "progress", "tasks 1/2"))
+    assert watchdog.check(102) is None
+    assert watchdog.check(103) == "no output for 2s"
+
+
+def test_abort_pattern_env(monkeypatch):
+    monkeypatch.setenv("ABORT_PATTERN", "^FATAL\n^PANIC")
+    agent = ShellAgent("echo ok; echo 'PANIC: boom'; sleep 60")
+    args = agent.cli(["--abort-pattern", "^ERROR", "--timeout", "30"])
+    assert args.abort_pattern == ["^FATAL", "^PANIC", "^ERROR"]
+    assert agent.run(args) == -signal.SIGTERM
+    assert agent.watchdog.reason.startswith("output matched '^PANIC'")
@@ -0,0 +1,185 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+import os
+import sys
+
+import dciagent.core.agent.ansible as ansible
+import dciagent.core.progress as progress
+
+# fails on h2 for the first run, then succeeds on the retried hosts
+PLAYBOOK = """#!/bin/sh
+for a; do case $a in @*) limit=${a#@};; esac; done
+if [ -z "$limit" ]; then
+    echo h2 > "$ANSIBLE_RETRY_FILES_SAVE_PATH/playbook.retry"
+    exit 2
+fi
+echo "retried $(cat $limit)"
+"""
+
+
+def make_agent(tmp_path, script):
+    for name in ("playbook.yml", "hosts", "ansible.cfg"):
+        (tmp_path / name).write_text("")
+    executable = tmp_path / "ansible-playbook"
+    executable.write_text(script)
+    executable.chmod(0o755)
+
+    class Agent(ansible.Agent):
+        def __init__(self):
+            super().__init__("test-ctl", "test agent", "0.1")
+
+    Agent.executable = str(executable)
+    return Agent(), [
+        "-i",
+        str(tmp_path / "hosts"),
+        "-c",
+        str(tmp_path / "ansible.cfg"),
+        str(tmp_path / "playbook.yml"),
+    ]
+
+
+def test_retry_failed(tmp_path):
+    agent, argv = make_agent(tmp_path, PLAYBOOK)
+    assert agent.run(agent.cli(argv)) == 2
+
+    agent, argv = make_agent(tmp_path, PLAYBOOK)
+    assert agent.run(agent.cli(["--retry-failed", "1"] + argv)) == 0
+    assert agent.tail.lines[-1].text == "retried h2"
+
+
+LOGGING = """#!/bin/sh
+log() { echo "2021-05-03 10:00:00,000 p=1 u=dci n=ansible | $1" >> $ANSIBLE_LOG_PATH; }
+log "PLAY [test] ****"
+log "TASK [first] ****"
+log "ok: [h1]"
+sleep 1.5
+log "PLAY RECAP ****"
+"""
+
+
+def test_progress(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    monkeypatch.setenv("ANSIBLE_LOG_PATH", str(tmp_path / "ansible.log"))
+    agent, argv = make_agent(tmp_path, LOGGING)
+    assert agent.run(agent.cli(["--progress-interval", "1"] + argv)) == 0
+
+    lines = [line.text for line in agent.tail.lines if line.stream == "progress"]
+    assert lines[0].startswith("TASK [first], task 1, ok=1")
+    assert lines[-1].startswith("PLAY RECAP, ok=1")
+    history = progress.load_history(str(tmp_path / "playbook.yml"))
+    assert [name for name, _ in history] == ["first"]
+
+
+INVENTORY = """#!/bin/sh
+echo run >> "$(dirname $0)/inventory.calls"
+echo '{"all": {"children": ["ungrouped"]}, "ungrouped": {"hosts": ["h1"]}}'
+"""
+
+
+def test_inventory_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    script = tmp_path / "ansible-inventory"
+    script.write_text(INVENTORY)
+    script.chmod(0o755)
+    calls = tmp_path / "inventory.calls"
+
+    for refresh in ([], [], ["--refresh-inventory"]):
+        agent, argv = make_agent(tmp_path, '#!/bin/sh\necho "$2"\n')
+        args = agent.cli(["--inventory-cache-ttl", "60"] + refresh + argv)
+        assert agent.run(args) == 0
+        cached = agent.tail.lines[-1].text
+        assert cached.startswith(str(tmp_path / "cache"))
+    assert len(calls.read_text().splitlines()) == 2
+    assert os.stat(cached).st_mode & 0o777 == 0o600
+    assert os.stat(os.path.dirname(cached)).st_mode & 0o777 == 0o700
+    assert json.loads(open(cached).read()) == {
+        "all": {"children": {"ungrouped": None}},
+        "ungrouped": {"hosts": {"h1": None}},
+    }
+
+
+def test_fact_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    agent, argv = make_agent(
+        tmp_path,
+        '#!/bin/sh\necho "$ANSIBLE_GATHERING $ANSIBLE_CACHE_PLUGIN_CONNECTION"\n',
+    )
+    assert agent.run(agent.cli(["--fact-cache"] + argv)) == 0
+    assert agent.tail.lines[-1].text == "smart {}".format(
+        tmp_path / "cache" / "dciagent" / "facts" / "default"
+    )
+
+
+EVENTS = """#!{}
+import json, os, socket
+s = socket.socket(socket.AF_UNIX)
+s.connect(os.environ["DCIAGENT_EVENTS"])
+for status in ("ok", "changed", "failed"):
+    event = {{"event": "result", "time": 0, "host": "h1", "status": status}}
+    s.sendall(json.dumps(event).encode() + b"\\n")
+s.sendall(b"not json\\n")
+print(os.environ["ANSIBLE_CALLBACKS_ENABLED"])
+"""
+
+
+def test_events(tmp_path):
+    agent, argv = make_agent(tmp_path, EVENTS.format(sys.executable))
+    assert agent.run(agent.cli(argv)) == 0
+    assert agent.tail.lines[-1].text.endswith("dciagent_events")
+    assert agent.events.results == {"ok": 1, "changed": 1, "failed": 1}
+
+
+UNREACHABLE = """#!{}
+import json, os, socket, time
+s = socket.socket(socket.AF_UNIX)
+s.connect(os.environ["DCIAGENT_EVENTS"])
+event = {{"event": "result", "host": "h1", "task": "ping", "status": "unreachable"}}
+s.sendall(json.dumps(event).encode() + b"\\n")
+time.sleep(60)
+"""
+
+
+def test_abort_on_unreachable(tmp_path):
+    agent, argv = make_agent(tmp_path, UNREACHABLE.format(sys.executable))
+    assert agent.run(agent.cli(["--abort-on-unreachable"] + argv)) < 0
+    assert agent.watchdog.reason == "host h1 unreachable in task ping"
+
+
+def test_skip_unchanged(tmp_path, monkeypatch):
+    project = tmp_path / "project"
+    project.mkdir()
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    calls = tmp_path / "calls"
+    script = "#!/bin/sh\necho run >> {}\n".format(calls)
+
+    for playbook in ("", "", "- hosts: all\n"):
+        agent, argv = make_agent(project, script)
+        (project / "playbook.yml").write_text(playbook)
+        assert agent.run(agent.cli(["--skip-unchanged", "60"] + argv)) == 0
+    assert calls.read_text().splitlines() == ["run", "run"]
+
+
+def test_dry_run_side_effects(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path / "run"))
+    (tmp_path / "run").mkdir(mode=0o700)
+    script = tmp_path / "ansible-inventory"
+    script.write_text(INVENTORY)
+    script.chmod(0o755)
+    agent, argv = make_agent(tmp_path, "#!/bin/sh\n")
+    args = agent.cli(["--dry-run", "--perf-profile", "--ssh-pool"] + argv)
+    assert agent.run(args) == 0
+    assert not (tmp_path / "inventory.calls").exists()
+    assert os.listdir(str(tmp_path / "run")) == []
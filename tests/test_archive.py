@@ -0,0 +1,84 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import errno
+import gzip
+import io
+import os
+import tarfile
+
+import pytest
+
+import dciagent.core.archive as archive
+
+
+def test_parallel_gzip():
+    data = os.urandom(1000) * 100
+    out = io.BytesIO()
+    writer = archive.ParallelGzip(out, block_size=4096, workers=3)
+    for i in range(0, len(data), 3000):
+        writer.write(data[i : i + 3000])
+    writer.close()
+    assert gzip.decompress(out.getvalue()) == data
+
+
+def test_create_and_prune(tmp_path):
+    run = tmp_path / "dci-run"
+    (run / "sub").mkdir(parents=True)
+    (run / "ansible.log").write_text("log\n" * 1000)
+    (run / "sub" / "report.xml").write_text("<testsuite/>")
+
+    dest = tmp_path / "dci-run.tar.gz"
+    assert archive.create(str(run), str(dest), remove=True) > 0
+    assert not (run / "ansible.log").exists()
+    with tarfile.open(str(dest)) as tar:
+        assert sorted(tar.getnames()) == [
+            "dci-run",
+            "dci-run/ansible.log",
+            "dci-run/sub",
+            "dci-run/sub/report.xml",
+        ]
+        assert tar.extractfile("dci-run/ansible.log").read() == b"log\n" * 1000
+
+    for i in range(3):
+        old = tmp_path / "dci-old{}.tar.gz".format(i)
+        old.write_bytes(b"x" * 100)
+        os.utime(str(old), (i, i))
+    removed = archive.prune(str(tmp_path), "dci-", keep=2)
+    assert sorted(os.path.basename(p) for p in removed) == [
+        "dci-old0.tar.gz",
+        "dci-old1.tar.gz",
+    ]
+
+
+def test_create_failure_keeps_files(tmp_path, monkeypatch):
+    run = tmp_path / "dci-run"
+    run.mkdir()
+    for i in range(5):
+        (run / "{}.log".format(i)).write_text("log\n")
+    added = []
+    add = tarfile.TarFile.add
+
+    def failing_add(tar, name, *args, **kwargs):
+        if len(added) == 4:
+            raise OSError(errno.ENOSPC, "No space left on device")
+        added.append(name)
+        add(tar, name, *args, **kwargs)
+
+    monkeypatch.setattr(tarfile.TarFile, "add", failing_add)
+    dest = tmp_path / "dci-run.tar.gz"
+    with pytest.raises(OSError):
+        archive.create(str(run), str(dest), remove=True)
+    assert sorted(os.listdir(str(run))) == ["{}.log".format(i) for i in range(5)]
+    assert os.listdir(str(tmp_path)) == ["dci-run"]
@@ -0,0 +1,72 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import concurrent.futures
+import hashlib
+import os
+
+import pytest
+
+import dciagent.core.artifacts as artifacts
+
+
+class Counting(artifacts.Cache):
+    downloads = 0
+
+    def _download(self, url):
+        self.downloads += 1
+        return super()._download(url)
+
+
+def test_fetch(tmp_path):
+    src = tmp_path / "image.iso"
+    src.write_bytes(b"iso" * 1000)
+    url = src.as_uri()
+    cache = Counting(str(tmp_path / "cache"))
+
+    with concurrent.futures.ThreadPoolExecutor(4) as pool:
+        hits = list(
+            pool.map(
+                lambda i: cache.fetch(url, str(tmp_path / "run{}.iso".format(i))),
+                range(4),
+            )
+        )
+    assert cache.downloads == 1
+    assert sorted(hits) == [False, True, True, True]
+    assert (
+        os.stat(str(tmp_path / "run0.iso")).st_ino
+        == os.stat(str(tmp_path / "run3.iso")).st_ino
+    )
+
+    # found by digest whatever the URL
+    digest = hashlib.sha256(src.read_bytes()).hexdigest()
+    assert cache.fetch("http://invalid/", str(tmp_path / "other.iso"), digest)
+    other = tmp_path / "other"
+    other.write_bytes(b"other")
+    with pytest.raises(ValueError):
+        cache.fetch(other.as_uri(), str(tmp_path / "bad.iso"), "0" * 64)
+    assert not (tmp_path / "bad.iso").exists()
+
+
+def test_evict(tmp_path):
+    cache = artifacts.Cache(str(tmp_path / "cache"), max_bytes=2500)
+    for i in range(3):
+        src = tmp_path / "a{}".format(i)
+        src.write_bytes(str(i).encode() * 1000)
+        cache.fetch(src.as_uri(), str(tmp_path / "dest{}".format(i)))
+        os.utime(cache.path(cache.lookup(src.as_uri())), (i, i))
+
+    cache.evict()
+    assert cache.lookup((tmp_path / "a0").as_uri()) is None
+    assert cache.lookup((tmp_path / "a2").as_uri()) is not None
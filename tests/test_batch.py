@@ -0,0 +1,102 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import asyncio
+import json
+
+import pytest
+
+import dciagent.core.agent as agent
+import dciagent.core.agent.base as base
+import dciagent.core.batch as batch
+import dciagent.core.error as error
+import dciagent.core.printer as printer
+
+
+class ExitAgent(base.Agent):
+    executable = "sh"
+    code = agent.Argument("exit code", long="--code", default=0, type=int)
+
+    def __init__(self, **kwargs):
+        super().__init__("exit-ctl", "test agent", "0.1")
+
+    def _build_command(self):
+        self.command_line = [self.executable, "-c", "exit {}".format(self.code)]
+
+
+def test_batch(tmp_path):
+    jobs_file = tmp_path / "jobs.json"
+    jobs_file.write_text(
+        json.dumps(
+            {
+                "jobs": [
+                    {"name": "a", "agent": "exit"},
+                    {"name": "b", "agent": "exit", "argv": ["--code", "3"]},
+                    {"name": "c", "agent": "exit", "after": ["a"], "priority": 5},
+                    {"name": "d", "agent": "exit", "after": ["b"]},
+                ]
+            }
+        )
+    )
+    jobs, concurrency = batch.load(str(jobs_file))
+    assert concurrency is None
+
+    log_dir = tmp_path / "logs"
+    rc = batch.Batch(jobs, {"exit": ExitAgent}, 2, str(log_dir)).run()
+    assert rc == 1
+    assert [(j.name, j.status, j.rc) for j in jobs] == [
+        ("a", "success", 0),
+        ("b", "failure", 3),
+        ("c", "success", 0),
+        ("d", "skipped", None),
+    ]
+    assert len(json.loads((log_dir / "summary.json").read_text())) == 4
+
+
+def test_batch_rejects_cycles():
+    jobs = [
+        batch.Job("a", "exit", after=["b"]),
+        batch.Job("b", "exit", after=["a"]),
+    ]
+    with pytest.raises(error.ValidationError):
+        batch.Batch(jobs, {"exit": ExitAgent}, 2, "unused")
+
+
+class TalkativeAgent(ExitAgent):
+    def _pre(self):
+        printer.header("pre {}".format(self.code))
+
+    async def _post_async(self):
+        await asyncio.sleep(0.1)  # let the other jobs print meanwhile
+        printer.header("post {}".format(self.code))
+
+
+def test_batch_logs_agent_output(tmp_path, capsys):
+    jobs = [batch.Job("j{}".format(i), "talk", ["--code", str(i)]) for i in range(3)]
+    log_dir = tmp_path / "logs"
+    assert batch.Batch(jobs, {"talk": TalkativeAgent}, 3, str(log_dir)).run() == 1
+
+    out = capsys.readouterr().out
+    assert "pre" not in out and "post" not in out
+    assert "Batch summary" in out
+    for i in range(3):
+        log = (log_dir / "j{}.log".format(i)).read_text()
+        assert "[stdout] pre {}\n".format(i) in log
+        assert "[stdout] post {}\n".format(i) in log
+        assert "pre {}".format(1 - i) not in log
+
+
+def test_batch_rejects_unsafe_names():
+    with pytest.raises(error.ValidationError):
+        batch.Batch([batch.Job("../x", "exit")], {"exit": ExitAgent}, 2, "unused")
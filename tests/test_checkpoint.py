@@ -0,0 +1,84 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import sys
+
+import dciagent.core.agent.dci as dci
+import dciagent.core.checkpoint as checkpoint
+
+# fails at the second task, unless started at a task
+PLAYBOOK = """#!{}
+import json, os, socket, sys
+s = socket.socket(socket.AF_UNIX)
+s.connect(os.environ["DCIAGENT_EVENTS"])
+def send(event, **data):
+    s.sendall(json.dumps(dict(event=event, **data)).encode() + b"\\n")
+resume = "--start-at-task" in sys.argv
+print("start at", sys.argv[sys.argv.index("--start-at-task") + 1] if resume else "-")
+send("playbook_start")
+for task in ("first", "second", "third"):
+    if resume and task == "first":
+        continue
+    send("task_start", task=task)
+    status = "failed" if task == "second" and not resume else "ok"
+    send("result", task=task, host="h1", status=status)
+    if status == "failed":
+        break
+send("playbook_end", stats={{"h1": {{"failures": int(not resume)}}}})
+sys.exit(0 if resume else 2)
+"""
+
+
+def test_record():
+    c = checkpoint.Checkpoint("/nonexistent")
+    c.save = lambda: None
+    c.record({"event": "task_start", "task": "first"})
+    c.record({"event": "result", "task": "first", "status": "failed"})
+    c.record({"event": "task_start", "task": "second"})
+    assert c.resume_at == "first"
+    c.record({"event": "playbook_end", "stats": {"h1": {"failures": 0}}})
+    assert c.resume_at is None
+
+
+def test_resume(tmp_path, monkeypatch):
+    monkeypatch.setenv("TMPDIR", str(tmp_path))
+    monkeypatch.setattr("tempfile.tempdir", None)
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    for name in ("playbook.yml", "hosts", "ansible.cfg", "dcirc.sh"):
+        (tmp_path / name).write_text("")
+    executable = tmp_path / "ansible-playbook"
+    executable.write_text(PLAYBOOK.format(sys.executable))
+    executable.chmod(0o755)
+
+    class Agent(dci.Agent):
+        default_config_dir = str(tmp_path)
+        default_settings_file = None
+
+        def __init__(self):
+            super().__init__("test-ctl", "test agent", "0.1")
+
+    Agent.executable = str(executable)
+
+    agent = Agent()
+    argv = ["-c", str(tmp_path / "ansible.cfg"), str(tmp_path / "playbook.yml")]
+    assert agent.run(agent.cli(argv)) == 2
+    run_id = os.path.basename(agent.tempdir)
+    assert checkpoint.resumable(agent.tempdir)
+
+    agent = Agent()
+    assert agent.run(agent.cli(["--resume", run_id])) == 0
+    assert agent.tempdir == str(tmp_path / run_id)
+    assert [line.text for line in agent.tail.lines] == ["start at second"]
+    assert not os.path.exists(str(tmp_path / run_id))
@@ -0,0 +1,37 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+
+import pytest
+
+import dciagent.core.context as ctx
+
+
+def test_runtime_dir_fallback(tmp_path, monkeypatch):
+    monkeypatch.delenv("XDG_RUNTIME_DIR", raising=False)
+    runtime = tmp_path / "runtime"
+    monkeypatch.setattr(ctx, "RUNTIME_FALLBACK", str(runtime))
+    assert ctx.runtime_dir("x.sock") == str(runtime / "x.sock")
+    assert os.stat(str(runtime)).st_mode & 0o777 == 0o700
+
+    # pre-created by someone else, or readable by others
+    runtime.chmod(0o755)
+    with pytest.raises(PermissionError):
+        ctx.runtime_dir("x.sock")
+    runtime.rmdir()
+    (tmp_path / "elsewhere").mkdir(mode=0o700)
+    runtime.symlink_to(tmp_path / "elsewhere")
+    with pytest.raises(PermissionError):
+        ctx.runtime_dir("x.sock")
@@ -0,0 +1,54 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import pytest
+
+import dciagent.core.credentials as credentials
+
+DCIRC = """
+# DCI credentials
+export DCI_CLIENT_ID=remoteci/1234
+export DCI_API_SECRET='a=b c'
+export DCI_CS_URL="https://api.distributed-ci.io"  # control server
+DCI_LOCAL=not-exported
+OTHER=ignored
+export OTHER
+"""
+
+
+def test_parse():
+    assert credentials.parse(DCIRC) == {
+        "DCI_CLIENT_ID": "remoteci/1234",
+        "DCI_API_SECRET": "a=b c",
+        "DCI_CS_URL": "https://api.distributed-ci.io",
+    }
+
+
+@pytest.mark.parametrize(
+    "text", ["export DCI_X=$HOME", 'export DCI_X="`id`"', "if true; then :; fi"]
+)
+def test_parse_needs_shell(text):
+    with pytest.raises(ValueError):
+        credentials.parse(text)
+
+
+def test_read_matches_shell(tmp_path, monkeypatch):
+    path = tmp_path / "dcirc.sh"
+    path.write_text(DCIRC)
+    expected = credentials._shell(str(path))
+
+    monkeypatch.setattr(credentials, "_shell", None)  # must not fork
+    assert credentials.read(str(path)) == expected
+    monkeypatch.setattr(credentials, "parse", None)  # must hit the cache
+    assert credentials.read(str(path)) == expected
@@ -0,0 +1,88 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import asyncio
+import socket
+import threading
+import time
+
+import dciagent.core.agent.base as base
+import dciagent.core.client as client
+import dciagent.core.daemon as daemon
+
+
+class EchoAgent(base.Agent):
+    executable = "echo"
+
+    def __init__(self, **kwargs):
+        super().__init__("echo-ctl", "test agent", "0.1")
+
+    def _build_command(self):
+        self.command_line = [self.executable, "hello"]
+
+
+def test_submit(tmp_path, capsys):
+    path = str(tmp_path / "agent.sock")
+    server = daemon.Server({"echo": EchoAgent}, path)
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(server.start())
+    thread = threading.Thread(target=loop.run_forever)
+    thread.start()
+    try:
+        assert client.submit("echo", [], path) == 0
+        assert client.submit("unknown", [], path) == 2
+        assert client.submit("echo", ["--bogus"], path) == 2
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        server.close()
+        loop.close()
+
+    out, err = capsys.readouterr()
+    # forwarded to the client only, not echoed by the daemon
+    assert out.splitlines().count("hello") == 1
+    assert "Unknown agent unknown" in err
+
+
+class SleepAgent(base.Agent):
+    executable = "sh"
+
+    def __init__(self, **kwargs):
+        super().__init__("sleep-ctl", "test agent", "0.1")
+
+    def _build_command(self):
+        self.command_line = [self.executable, "-c", "echo started; sleep 60"]
+
+
+def test_disconnect_cancels_job(tmp_path):
+    path = str(tmp_path / "agent.sock")
+    server = daemon.Server({"sleep": SleepAgent}, path)
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(server.start())
+    thread = threading.Thread(target=loop.run_forever)
+    thread.start()
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.connect(path)
+            s.sendall(client.encode({"agent": "sleep", "argv": []}))
+            assert b"started" in s.recv(4096)
+        start = time.monotonic()
+        while server.jobs and time.monotonic() - start < 10:
+            time.sleep(0.1)
+        assert not server.jobs
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        server.close()
+        loop.close()
@@ -0,0 +1,49 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+
+import dciagent.agents as agent_ns
+import dciagent.core.agent.dci as dci
+import dciagent.core.discovery as discovery
+
+
+def test_discover_uses_manifest(tmp_path, monkeypatch):
+    manifest = str(tmp_path / "agents.json")
+    agents = discovery.discover(agent_ns, manifest)
+    assert "dciagent.agents.example" in agents
+
+    def fail(name):
+        raise AssertionError("{} should not be imported".format(name))
+
+    monkeypatch.setattr(discovery, "_inspect", fail)
+    cached = discovery.discover(agent_ns, manifest)
+    assert cached == agents
+
+
+def test_arguments_round_trip():
+    entry = {"arguments": [discovery._serialize(e) for e in dci.Agent._args()]}
+    restored = discovery.arguments("dciagent.agents.example", entry)
+    assert [e.signature() for e in restored] == [
+        e.signature() for e in dci.Agent._args()
+    ]
+
+
+def test_save_manifest_failure(tmp_path, monkeypatch):
+    def fail(src, dst):
+        raise OSError("read-only")
+
+    monkeypatch.setattr(os, "replace", fail)
+    discovery._save_manifest(str(tmp_path / "manifest.json"), {"a": 1})
+    assert os.listdir(str(tmp_path)) == []
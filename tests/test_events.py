@@ -0,0 +1,34 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import dciagent.core.events as events
+
+
+def test_environment_keeps_configured_callbacks(tmp_path):
+    cfg = tmp_path / "ansible.cfg"
+    cfg.write_text(
+        "[defaults]\ncallback_plugins = plugins\ncallbacks_enabled = junit\n"
+    )
+
+    env = events.environment(str(cfg), {})
+    assert env["ANSIBLE_CALLBACK_PLUGINS"] == "{}:{}".format(
+        events.PLUGIN_DIR, tmp_path / "plugins"
+    )
+    assert env["ANSIBLE_CALLBACKS_ENABLED"] == "junit,dciagent_events"
+
+    env = events.environment(str(cfg), {"ANSIBLE_CALLBACK_WHITELIST": "a, b"})
+    assert env["ANSIBLE_CALLBACKS_ENABLED"] == "a,b,dciagent_events"
+
+    env = events.environment(None, {})
+    assert env["ANSIBLE_CALLBACK_PLUGINS"].endswith(events.DEFAULT_CALLBACK_PLUGINS)
@@ -0,0 +1,53 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import threading
+
+from dciagent.agents import example
+
+
+def make_argv(tmp_path):
+    for name in ("playbook.yml", "hosts", "ansible.cfg", "dcirc.sh"):
+        (tmp_path / name).write_text("")
+    return [
+        "--config-dir",
+        str(tmp_path),
+        "-i",
+        str(tmp_path / "hosts"),
+        "-c",
+        str(tmp_path / "ansible.cfg"),
+        str(tmp_path / "playbook.yml"),
+    ]
+
+
+def test_example(tmp_path, monkeypatch, capsys):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    assert example.main(make_argv(tmp_path)) == 0
+    out = capsys.readouterr().out
+    assert "Running pre-execution hook" in out
+    assert "load average" in out
+    assert "Running post-execution hook" in out
+
+
+def test_post_off_loop(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    threads = []
+
+    class Agent(example.Agent):
+        def _post(self):
+            threads.append(threading.current_thread())
+
+    agent = Agent()
+    assert agent.run(agent.cli(make_argv(tmp_path))) == 0
+    assert threads and threads[0] is not threading.main_thread()
@@ -0,0 +1,45 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import time
+
+import dciagent.core.facts as facts
+import dciagent.core.tuning as tuning
+
+
+def test_evict(tmp_path):
+    now = time.time()
+    for name, age in (("expired", 7200), ("old", 600), ("new", 60), ("newer", 0)):
+        path = tmp_path / name
+        path.write_bytes(b"x" * 100)
+        os.utime(str(path), (now - age, now - age))
+
+    assert facts.evict(str(tmp_path), 3600, 250) == 2
+    assert sorted(os.listdir(str(tmp_path))) == ["new", "newer"]
+    assert facts.evict(str(tmp_path / "missing"), 3600, 0) == 0
+
+
+def test_environment_keeps_configured(tmp_path):
+    assert facts.environment("/cache", 60) == {
+        "ANSIBLE_GATHERING": "smart",
+        "ANSIBLE_CACHE_PLUGIN": "jsonfile",
+        "ANSIBLE_CACHE_PLUGIN_CONNECTION": "/cache",
+        "ANSIBLE_CACHE_PLUGIN_TIMEOUT": "60",
+    }
+
+    cfg = tmp_path / "ansible.cfg"
+    cfg.write_text("[defaults]\ngathering = explicit\n")
+    configured = tuning.explicit(str(cfg), {"ANSIBLE_CACHE_PLUGIN": "redis"}, [])
+    assert facts.environment("/cache", 60, configured) == {}
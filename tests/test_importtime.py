@@ -0,0 +1,57 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+# cumulative import time of the dciagent modules for `dci-agent-ctl --version`,
+# in milliseconds, can be relaxed on slow CI nodes through the environment
+BUDGET = float(os.getenv("DCIAGENT_IMPORT_BUDGET_MS", "100"))
+
+
+def _importtime(env):
+    p = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "dciagent.core.cli", "--version"],
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    assert p.returncode == 0, p.stderr
+    return p.stderr.splitlines()
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7), reason="-X importtime is 3.7+")
+def test_version_import_budget(tmp_path):
+    env = dict(os.environ, XDG_CACHE_HOME=str(tmp_path))
+    _importtime(env)  # warm up the discovery manifest
+    lines = _importtime(env)
+
+    modules = {}
+    for line in lines:
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit():
+            modules[name.rstrip()] = int(cumulative)
+
+    assert "distutils.util" not in [m.strip() for m in modules]
+    assert "dciagent.agents.example" not in [m.strip() for m in modules]
+
+    # only count top-level entries, nested ones are already in the cumulative
+    spent = sum(us for name, us in modules.items() if name.startswith(" dciagent"))
+    assert spent / 1000 < BUDGET
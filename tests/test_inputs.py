@@ -0,0 +1,46 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+
+import dciagent.core.inputs as inputs
+
+
+def test_digest(tmp_path):
+    roles = tmp_path / "roles" / "r" / "tasks"
+    roles.mkdir(parents=True)
+    (roles / "main.yml").write_text("- debug:\n")
+    (tmp_path / "playbook.yml").write_text("- hosts: all\n")
+    (tmp_path / "ansible.log").write_text("ignored")
+    (tmp_path / ".git").mkdir()
+    (tmp_path / ".git" / "index").write_text("ignored")
+    old = 1000000000
+    for f in (roles / "main.yml", tmp_path / "playbook.yml"):
+        os.utime(str(f), (old, old))
+
+    cache = inputs.HashCache(str(tmp_path / ".cache" / "hashes.json"))
+    first = inputs.digest([str(tmp_path)], {"argv": []}, cache)
+    assert sorted(cache.entries) == [
+        str(tmp_path / "playbook.yml"),
+        str(roles / "main.yml"),
+    ]
+    cache.save()
+
+    (tmp_path / "ansible.log").write_text("changed")
+    cache = inputs.HashCache(str(tmp_path / ".cache" / "hashes.json"))
+    assert inputs.digest([str(tmp_path)], {"argv": []}, cache) == first
+    assert inputs.digest([str(tmp_path)], {"argv": ["-v"]}) != first
+
+    (roles / "main.yml").write_text("- fail:\n")
+    assert inputs.digest([str(tmp_path)], {"argv": []}, cache) != first
@@ -0,0 +1,62 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+
+import dciagent.core.junit as junit
+
+REPORT = """<?xml version="1.0" encoding="utf-8"?>
+<testsuites>
+  <testsuite name="s">
+    <testcase classname="c" name="fast" time="0.5"/>
+    <testcase classname="c" name="slow" time="12"/>
+    <testcase classname="c" name="broken" time="1">
+      <failure message="boom" type="failed">details</failure>
+    </testcase>
+    <testcase classname="c" name="skip"><skipped/></testcase>
+  </testsuite>
+</testsuites>
+"""
+
+
+def test_summarize(tmp_path):
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "a.xml").write_text(REPORT)
+    (tmp_path / "b.xml").write_text(
+        '<testsuite><testcase classname="d" name="err" time="3">'
+        "<error>trace</error></testcase>"
+    )
+    (tmp_path / "output.log").write_text("not a report")
+
+    paths = junit.reports(str(tmp_path))
+    assert [p[len(str(tmp_path)) :] for p in paths] == ["/b.xml", "/sub/a.xml"]
+
+    summary = junit.summarize(paths, slowest=2)
+    junit.write(summary, str(tmp_path / "out" / "summary.json"))
+    data = json.loads((tmp_path / "out" / "summary.json").read_text())
+
+    assert data["totals"] == {
+        "tests": 5,
+        "failures": 1,
+        "errors": 1,
+        "skipped": 1,
+        "time": 16.5,
+    }
+    assert [s["name"] for s in data["slowest"]] == ["slow", "err"]
+    assert [(f["name"], f["message"]) for f in data["failures"]] == [
+        ("err", "trace"),
+        ("broken", "boom"),
+    ]
+    # b.xml is truncated, what was read is still accounted for
+    assert len(data["invalid"]) == 1
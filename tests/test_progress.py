@@ -0,0 +1,77 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import dciagent.core.progress as progress
+
+LOG = """\
+2021-05-03 10:00:00,000 p=1 u=dci n=ansible | PLAY [deploy] ****
+2021-05-03 10:00:00,000 p=1 u=dci n=ansible | TASK [Gathering Facts] ****
+2021-05-03 10:00:01,000 p=1 u=dci n=ansible | ok: [h1]
+2021-05-03 10:00:01,000 p=1 u=dci n=ansible | ok: [h2]
+2021-05-03 10:00:10,000 p=1 u=dci n=ansible | TASK [install] ****
+2021-05-03 10:00:11,000 p=1 u=dci n=ansible | changed: [h1] => (item=a)
+2021-05-03 10:00:11,000 p=1 u=dci n=ansible | fatal: [h1]: FAILED! => {"msg":
+  "failed: [h2] is not a result"}
+2021-05-03 10:00:11,000 p=1 u=dci n=ansible | fatal: [h2]: UNREACHABLE! => {}
+"""
+
+# ansible-core >= 2.17
+LOG_LEVELS = """\
+2026-10-18 06:14:25,488 p=1807 u=dci n=ansible INFO| PLAY [deploy] ****
+2026-10-18 06:14:25,500 p=1807 u=dci n=ansible INFO| TASK [hello] ****
+2026-10-18 06:14:25,524 p=1807 u=dci n=ansible INFO| ok: [h1] => {
+    "msg": "hi"
+}
+2026-10-18 06:14:25,526 p=1807 u=dci n=ansible INFO| TASK [boom] ****
+2026-10-18 06:14:25,551 p=1807 u=dci n=ansible ERROR| [ERROR]: Task failed: x
+2026-10-18 06:14:25,552 p=1807 u=dci n=ansible INFO| fatal: [h1]: FAILED! => {}
+2026-10-18 06:14:25,553 p=1807 u=dci n=ansible INFO| PLAY RECAP ****
+"""
+
+
+def test_follow_and_parse(tmp_path):
+    log = tmp_path / "ansible.log"
+    follower = progress.Follower(str(log))
+    p = progress.Progress([("Gathering Facts", 5.0), ("install", 20.0), ("end", 3)])
+    assert list(follower.lines()) == []
+
+    log.write_text(LOG[:100])
+    for line in follower.lines():
+        p.feed(line)
+    with open(str(log), "a") as f:
+        f.write(LOG[100:])
+    for line in follower.lines():
+        p.feed(line)
+
+    assert p.task == "install"
+    assert p.tasks[0][0] == "Gathering Facts"
+    assert p.tasks[0][1] == 10.0
+    assert p.hosts == {"h1": "failed", "h2": "unreachable"}
+    assert p.counts["ok"] == 2
+    # 15s into a 20s task, followed by a 3s one
+    assert p.eta(p.started + 15) == 8.0
+    assert "task 2/3" in p.summary(p.started + 15)
+    assert "ETA 8s" in p.summary(p.started + 15)
+
+
+def test_parse_levels():
+    p = progress.Progress()
+    for line in LOG_LEVELS.splitlines():
+        p.feed(line)
+
+    assert p.play == "deploy"
+    assert [t[0] for t in p.tasks] == ["hello", "boom"]
+    assert p.counts["ok"] == 1
+    assert p.counts["failed"] == 1
+    assert p.finished
@@ -0,0 +1,105 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+
+import dciagent.core.agent.ansible as ansible
+import dciagent.core.shard as shard
+
+INVENTORY = {
+    "_meta": {"hostvars": {}},
+    "all": {"children": ["ungrouped", "web", "db"]},
+    "web": {"hosts": ["web1", "web2", "web3"]},
+    "db": {"children": ["primary"], "hosts": ["db2"]},
+    "primary": {"hosts": ["db1", "web1"]},
+    "ungrouped": {"hosts": ["lone"]},
+}
+
+
+def test_partition_by_host():
+    assert shard.partition(INVENTORY, 2) == [
+        ["lone", "web2", "db2"],
+        ["web1", "web3", "db1"],
+    ]
+    assert len(shard.partition(INVENTORY, 100)) == 6
+
+
+def test_partition_by_group():
+    assert shard.partition(INVENTORY, 2, by="group") == [
+        ["web1", "web2", "web3"],
+        ["db2", "db1", "lone"],
+    ]
+
+
+def make_agent(tmp_path, script):
+    for name in ("playbook.yml", "hosts", "ansible.cfg"):
+        (tmp_path / name).write_text("")
+    inventory = tmp_path / "ansible-inventory"
+    inventory.write_text("#!/bin/sh\necho '{}'\n".format(json.dumps(INVENTORY)))
+    playbook = tmp_path / "ansible-playbook"
+    playbook.write_text(
+        "#!/bin/sh\nfor a; do case $a in @*) f=${a#@};; esac; done\n" + script
+    )
+    inventory.chmod(0o755)
+    playbook.chmod(0o755)
+
+    class Agent(ansible.Agent):
+        executable = str(playbook)
+
+        def __init__(self):
+            super().__init__("test-ctl", "test agent", "0.1")
+
+    agent = Agent()
+    args = agent.cli(
+        [
+            "--shards",
+            "2",
+            "-i",
+            str(tmp_path / "hosts"),
+            "-c",
+            str(tmp_path / "ansible.cfg"),
+            str(tmp_path / "playbook.yml"),
+        ]
+    )
+    return agent, args
+
+
+def test_sharded_run(tmp_path):
+    # fail the shard holding db1, print the hosts of each shard
+    agent, args = make_agent(tmp_path, "cat $f; ! grep -q db1 $f\n")
+    assert agent.run(args) == 1
+    assert agent.shard_results == [0, 1]
+    assert sorted(line.text for line in agent.tail.lines) == sorted(
+        "[shard{}] {}".format(i, host)
+        for i, hosts in enumerate(shard.partition(INVENTORY, 2))
+        for host in hosts
+    )
+
+
+def test_signalled_shard(tmp_path):
+    junit = tmp_path / "junit"
+    junit.mkdir()
+    # the shard holding db1 gets killed while writing its report
+    agent, args = make_agent(
+        tmp_path,
+        'if grep -q db1 $f; then echo "<testsuite><testcase" > $JUNIT_OUTPUT_DIR/a.xml;'
+        " kill -TERM $$; fi\n"
+        "echo '<testsuites><testsuite name=\"ok\"/></testsuites>'"
+        " > $JUNIT_OUTPUT_DIR/a.xml\n",
+    )
+    agent.environment["JUNIT_OUTPUT_DIR"] = str(junit)
+    assert agent.run(args) == -15
+    assert agent.shard_results == [0, -15]
+    merged = (junit / "playbook-shards.xml").read_text()
+    assert merged.endswith('<testsuites><testsuite name="ok" /></testsuites>\n')
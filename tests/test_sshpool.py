@@ -0,0 +1,42 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import socket
+
+import dciagent.core.sshpool as sshpool
+
+
+def listen(path):
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.bind(path)
+    s.listen()
+    return s
+
+
+def test_evict(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path))
+    mine = sshpool.key("prefix-a", "client-1")
+    assert mine != sshpool.key("prefix-b", "client-1")
+
+    alive = listen(os.path.join(sshpool.directory(mine), "alive"))
+    listen(os.path.join(sshpool.directory(mine), "dead")).close()
+    listen(os.path.join(sshpool.directory("other"), "dead")).close()
+    try:
+        assert sshpool.evict(keep=mine) == 2
+    finally:
+        alive.close()
+
+    assert os.listdir(sshpool.root()) == [mine]
+    assert os.listdir(sshpool.directory(mine)) == ["alive"]
@@ -0,0 +1,119 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import asyncio
+import os
+
+import pytest
+
+import dciagent.core.rusage as rusage
+import dciagent.core.stream as stream
+
+
+def test_pipeline_tail_and_log(tmp_path):
+    tail = stream.Tail(3)
+    log = tmp_path / "output.log"
+    rc = stream.Pipeline([tail, stream.LogFile(str(log))]).run(
+        ["sh", "-c", "echo one; echo two >&2; printf three; exit 3"]
+    )
+    assert rc == 3
+    assert sorted((line.stream, line.text) for line in tail.lines) == [
+        ("stderr", "two"),
+        ("stdout", "one"),
+        ("stdout", "three"),
+    ]
+    assert len(log.read_text().splitlines()) == 3
+
+
+def test_pipeline_splits_long_lines():
+    tail = stream.Tail(10)
+    stream.Pipeline([tail], chunk_size=4, max_line=8).run(
+        ["sh", "-c", "printf 0123456789abcdef"]
+    )
+    assert [line.text for line in tail.lines] == ["01234567", "89abcdef"]
+
+
+def test_pipeline_usage():
+    pipeline = stream.Pipeline([stream.Tail(1)])
+    pipeline.run(["python3", "-c", "x = bytearray(32 * 1024 * 1024)"])
+    assert pipeline.usage.maxrss > 32 * 1024 * 1024
+    assert pipeline.usage.user + pipeline.usage.system > 0
+
+
+class Slow(stream.Tail):
+    def __init__(self):
+        super().__init__(1)
+        self.count = 0
+        self.ready = asyncio.Event()
+
+    def __call__(self, line):
+        super().__call__(line)
+        self.count += 1
+
+    async def drain_async(self):
+        await self.ready.wait()
+
+
+def test_pipeline_backpressure():
+    async def run():
+        slow = Slow()
+        pipeline = stream.Pipeline([slow], chunk_size=1024)
+        task = asyncio.ensure_future(
+            pipeline.run_async(["sh", "-c", "seq 1000000; echo done"])
+        )
+        await asyncio.sleep(0.5)
+        # the child is blocked on its full pipe
+        assert 0 < slow.count < 1000
+        slow.ready.set()
+        assert await task == 0
+        return slow
+
+    slow = stream.run(run())
+    assert slow.lines[-1].text == "done"
+
+
+class Failing(stream.Tail):
+    def __call__(self, line):
+        if line.text == "boom":
+            raise OSError("No space left on device")
+        super().__call__(line)
+
+
+def test_pipeline_consumer_failure(tmp_path):
+    pid_file = tmp_path / "pid"
+    pipeline = stream.Pipeline([Failing(10)], grace=1)
+    with pytest.raises(OSError):
+        stream.run(
+            pipeline.run_async(
+                [
+                    "sh",
+                    "-c",
+                    "sleep 60 & echo $! > {}; echo boom; sleep 60".format(pid_file),
+                ]
+            )
+        )
+    # the child was reaped, its process group killed
+    assert pipeline.process.returncode is not None
+    stat = "/proc/{}/stat".format(pid_file.read_text().strip())
+    assert not os.path.exists(stat) or open(stat).read().split()[2] == "Z"
+
+
+def test_pipeline_cgroup(tmp_path):
+    # a plain directory standing for the cgroup
+    cgroup = rusage.Cgroup.__new__(rusage.Cgroup)
+    cgroup.path = str(tmp_path)
+    tail = stream.Tail(1)
+    pipeline = stream.Pipeline([tail], cgroup=cgroup)
+    assert pipeline.run(["sh", "-c", "echo $$"]) == 0
+    assert (tmp_path / "cgroup.procs").read_text().strip() == tail.lines[0].text
@@ -0,0 +1,53 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+
+import dciagent.core.trash as trash
+
+
+def make_run(path):
+    (path / "sub").mkdir(parents=True)
+    (path / "sub" / "ansible.log").write_bytes(b"x" * 1000)
+    return str(path)
+
+
+def test_discard(tmp_path):
+    run = make_run(tmp_path / "dci-a")
+    trash.discard(run, max_bytes=10000)
+    assert not os.path.exists(run)
+    for p in trash._reapers:
+        p.wait()
+    assert os.listdir(trash.trash_dir(str(tmp_path))) == [".reaper"]
+
+    # too big for the trash, removed right away
+    run = make_run(tmp_path / "dci-b")
+    trash.discard(run, max_bytes=100)
+    assert os.listdir(str(tmp_path)) == [os.path.basename(trash.trash_dir())]
+
+
+def test_recover(tmp_path):
+    stale = make_run(tmp_path / "dci-stale")
+    os.close(trash.lock(stale))
+    running = make_run(tmp_path / "dci-running")
+    fd = trash.lock(running)
+    kept = make_run(tmp_path / "dci-kept")
+
+    assert trash.recover(str(tmp_path)) == [stale]
+    assert os.path.isdir(running) and os.path.isdir(kept)
+    assert not os.path.exists(stale + ".lock")
+    trash.unlock(running, fd)
+    assert not os.path.exists(running + ".lock")
+    for p in trash._reapers:
+        p.wait()
@@ -0,0 +1,42 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import dciagent.core.tuning as tuning
+
+GiB = 1024**3
+
+
+def test_profile():
+    small = tuning.profile(3, 8, 16 * GiB)
+    assert small["ANSIBLE_FORKS"] == "3"
+    assert small["ANSIBLE_STRATEGY"] == "linear"
+
+    # bounded by the memory, 2 GiB fit 21 forks
+    big = tuning.profile(500, 8, 2 * GiB)
+    assert big["ANSIBLE_FORKS"] == "21"
+    assert big["ANSIBLE_STRATEGY"] == "free"
+
+    assert tuning.profile(None, 2, 16 * GiB)["ANSIBLE_FORKS"] == "20"
+
+
+def test_explicit(tmp_path):
+    cfg = tmp_path / "ansible.cfg"
+    cfg.write_text("[defaults]\nstrategy = mitogen_linear\n[ssh_connection]\n")
+
+    assert tuning.explicit(str(cfg), {"ANSIBLE_PIPELINING": "False"}, ["-f20"]) == {
+        "ANSIBLE_FORKS",
+        "ANSIBLE_PIPELINING",
+        "ANSIBLE_STRATEGY",
+    }
+    assert tuning.explicit(None, {}, ["--flush-cache"]) == set()